@@ -0,0 +1,258 @@
+import os
+import uuid
+import hashlib
+import datetime as dt
+import numpy as np
+
+import serialization
+import sparse_granule
+from aqi_categories import CATEGORIES, category_code
+from granule_snapshot import nearest_axis_index
+
+# Redis list of triggered alert events (RPUSH by the pipeline, BLPOP by notifiers)
+ALERTS_QUEUE = 'aqi_alerts'
+# Events kept in the queue if nobody consumes them
+MAX_QUEUED_ALERTS = int(os.getenv("MAX_QUEUED_ALERTS", 100000))
+
+
+def grid_key(lat_axis, lon_axis):
+    """Short id of a lat/lon grid; point subscriptions are indexed by cell on one grid"""
+    digest = hashlib.sha1(np.ascontiguousarray(lat_axis, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(lon_axis, dtype=np.float64).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def grid_cells(lat_axis, lon_axis, lats, lons):
+    """Flat grid cell of each point, -1 for points more than half a cell outside the grid"""
+    lat_axis, lon_axis = np.asarray(lat_axis), np.asarray(lon_axis)
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    rows = nearest_axis_index(lat_axis, lats)
+    cols = nearest_axis_index(lon_axis, lons)
+    lat_step = abs(lat_axis[1] - lat_axis[0]) if len(lat_axis) > 1 else 0.0
+    lon_step = abs(lon_axis[1] - lon_axis[0]) if len(lon_axis) > 1 else 0.0
+    inside = (np.abs(lat_axis[rows] - lats) <= lat_step / 2) & (np.abs(lon_axis[cols] - lons) <= lon_step / 2)
+    return np.where(inside, rows * len(lon_axis) + cols, -1)
+
+
+def categories_at(granule, cells):
+    """Category code at flat grid cells of a sparse granule or snapshot (None where invalid or off the grid)"""
+    cells = np.asarray(cells, dtype=np.int64)
+    pos = sparse_granule.positions(np.asarray(granule['index']), np.maximum(cells, 0))
+    pos = np.where(cells >= 0, pos, -1)
+    category = np.asarray(granule['category'])
+    return [int(category[p]) if p >= 0 else None for p in pos.tolist()]
+
+
+def ensure_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tempo_alert_subscriptions (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            latitude DOUBLE PRECISION,
+            longitude DOUBLE PRECISION,
+            zone_id TEXT,
+            threshold SMALLINT NOT NULL,
+            target TEXT,
+            grid TEXT,
+            cell INTEGER,
+            last_category SMALLINT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # The spatial index: point subscriptions by grid cell, zone subscriptions by zone
+    cursor.execute("CREATE INDEX IF NOT EXISTS tempo_alert_subscriptions_cell "
+                   "ON tempo_alert_subscriptions (grid, cell) WHERE kind = 'point'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS tempo_alert_subscriptions_zone "
+                   "ON tempo_alert_subscriptions (zone_id) WHERE kind = 'zone'")
+
+
+def add_subscription(db_conn, threshold, latitude=None, longitude=None, zone_id=None, target=None, snapshot=None,
+                     zone_record=None):
+    """Store a point (latitude/longitude) or zone subscription; returns its id
+
+    threshold is a category code: the subscriber is alerted whenever the
+    category at the point (or of the zone's mean AQI) moves from below it to
+    at or above it, and back. With the current granule snapshot the point is
+    indexed right away and starts from the category at its cell (a zone from
+    its current record); otherwise the next pipeline run indexes it.
+    """
+    kind = 'zone' if zone_id is not None else 'point'
+    grid, cell, last_category = None, None, None
+    if kind == 'point' and snapshot is not None:
+        grid = grid_key(snapshot['latitude'], snapshot['longitude'])
+        cell = int(grid_cells(snapshot['latitude'], snapshot['longitude'], [latitude], [longitude])[0])
+        last_category = categories_at(snapshot, [cell])[0]
+    elif kind == 'zone' and zone_record is not None and zone_record.get('aqi_mean') is not None:
+        last_category = category_code(round(zone_record['aqi_mean']))
+
+    subscription_id = uuid.uuid4().hex
+    cursor = db_conn.cursor()
+    ensure_tables(cursor)
+    cursor.execute("""
+        INSERT INTO tempo_alert_subscriptions
+            (id, kind, latitude, longitude, zone_id, threshold, target, grid, cell, last_category)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, (subscription_id, kind, latitude, longitude, zone_id, int(threshold), target, grid, cell, last_category))
+    db_conn.commit()
+    cursor.close()
+    return subscription_id
+
+
+def remove_subscription(db_conn, subscription_id):
+    """Delete a subscription; returns False if it did not exist"""
+    cursor = db_conn.cursor()
+    ensure_tables(cursor)
+    cursor.execute("DELETE FROM tempo_alert_subscriptions WHERE id = %s", (subscription_id,))
+    removed = cursor.rowcount > 0
+    db_conn.commit()
+    cursor.close()
+    return removed
+
+
+def index_points(cursor, sparse):
+    """Assign grid cells to point subscriptions not yet indexed on this granule's grid
+
+    Normally only subscriptions created without a snapshot; every point is
+    re-indexed once when the grid itself changes. Their known category is
+    reset to the granule's category at the new cell, so the next change
+    there is a crossing.
+    """
+    from psycopg2.extras import execute_values
+    grid = grid_key(sparse['latitude'], sparse['longitude'])
+    cursor.execute("""
+        SELECT id, latitude, longitude FROM tempo_alert_subscriptions
+        WHERE kind = 'point' AND (grid IS NULL OR grid <> %s)
+    """, (grid,))
+    pending = cursor.fetchall()
+    if pending:
+        cells = grid_cells(sparse['latitude'], sparse['longitude'],
+                           [row[1] for row in pending], [row[2] for row in pending])
+        execute_values(cursor, """
+            UPDATE tempo_alert_subscriptions AS s SET grid = v.grid, cell = v.cell, last_category = v.category
+            FROM (VALUES %s) AS v (id, grid, cell, category) WHERE s.id = v.id
+        """, [(row[0], grid, int(cell), category)
+              for row, cell, category in zip(pending, cells, categories_at(sparse, cells))],
+            template="(%s, %s, %s, %s::smallint)")
+        print(f"   Indexed {len(pending):,} point subscriptions on grid {grid}")
+    return grid
+
+
+def changed_cells(previous, sparse):
+    """Valid cells of the new granule whose category differs from the previous snapshot's
+
+    Cells that were invalid before count as changed; cells that turned
+    invalid do not (subscriptions keep their last known category). Without a
+    comparable previous snapshot every valid cell is changed.
+    """
+    index = np.asarray(sparse['index'])
+    category = np.asarray(sparse['category'])
+    if (previous is None or not np.array_equal(previous['latitude'], sparse['latitude']) or
+            not np.array_equal(previous['longitude'], sparse['longitude'])):
+        return index, category
+    _, new_pos, prev_pos = np.intersect1d(index, previous['index'], assume_unique=True, return_indices=True)
+    changed = np.ones(len(index), dtype=bool)
+    changed[new_pos] = category[new_pos] != previous['category'][prev_pos]
+    return index[changed], category[changed]
+
+
+def _crossings(rows, categories):
+    """Split evaluated subscriptions into (events, state updates)
+
+    rows are (id, threshold, last_category, ...) tuples and categories their
+    new category codes. A subscription with no known category only records it.
+    """
+    events, updates = [], []
+    for row, new in zip(rows, categories):
+        subscription_id, threshold, last = row[0], row[1], row[2]
+        if new == last:
+            continue
+        updates.append((subscription_id, new))
+        if last is not None and (last >= threshold) != (new >= threshold):
+            events.append((row, last, new))
+    return events, updates
+
+
+def evaluate(sparse, previous, version, db_conn, redis_client, zone_records=None):
+    """Evaluate alert subscriptions against a new granule and queue the triggered events
+
+    Only point subscriptions indexed to cells whose category changed since
+    the previous snapshot are read, so the cost follows changed cells x their
+    subscribers rather than all subscriptions. Zone subscriptions are compared
+    against the category of each zone's mean AQI (zone_records from
+    zonal_stats.compute_zone_stats).
+    Returns the number of events queued.
+    """
+    from psycopg2.extras import execute_values
+    cursor = db_conn.cursor()
+    ensure_tables(cursor)
+    grid = index_points(cursor, sparse)
+
+    cells, categories = changed_cells(previous, sparse)
+    print(f"Evaluating alerts for {len(cells):,} cells with a changed category...")
+    cursor.execute("""
+        SELECT id, threshold, last_category, cell, latitude, longitude, target FROM tempo_alert_subscriptions
+        WHERE kind = 'point' AND grid = %s AND cell = ANY(%s)
+    """, (grid, cells.tolist()))
+    point_rows = cursor.fetchall()
+    sorter = np.argsort(cells)
+    positions = sorter[np.searchsorted(cells, [row[3] for row in point_rows], sorter=sorter)]
+    events, updates = _crossings(point_rows, categories[positions].tolist())
+    aqi = np.asarray(sparse['aqi'])
+    index = np.asarray(sparse['index'])
+    values = aqi[np.searchsorted(index, [row[3] for row, _, _ in events])].tolist() if events else []
+    point_events = [
+        {'subscription_id': row[0], 'kind': 'point', 'latitude': row[4], 'longitude': row[5],
+         'target': row[6], 'aqi': value, 'previous_category': last, 'category': new, 'threshold': row[1]}
+        for (row, last, new), value in zip(events, values)
+    ]
+
+    zone_rows, zone_events = [], []
+    if zone_records is not None:
+        # A zone's mean can cross a category boundary without any of its cells
+        # changing category, so every zone's mean category is compared; only
+        # subscriptions whose recorded category differs are read
+        by_id = {record['id']: record for record in zone_records if record['aqi_mean'] is not None}
+        zone_categories = {zone_id: category_code(round(record['aqi_mean'])) for zone_id, record in by_id.items()}
+        cursor.execute("""
+            SELECT s.id, s.threshold, s.last_category, s.zone_id, s.target
+            FROM tempo_alert_subscriptions s
+            JOIN unnest(%s::text[], %s::smallint[]) AS z (zone_id, category) ON s.zone_id = z.zone_id
+            WHERE s.kind = 'zone' AND s.last_category IS DISTINCT FROM z.category
+        """, (list(zone_categories), list(zone_categories.values())))
+        zone_rows = cursor.fetchall()
+        events, zone_updates = _crossings(zone_rows, [zone_categories[row[3]] for row in zone_rows])
+        updates += zone_updates
+        zone_events = [
+            {'subscription_id': row[0], 'kind': 'zone', 'zone_id': row[3], 'target': row[4],
+             'aqi': by_id[row[3]]['aqi_mean'], 'previous_category': last, 'category': new, 'threshold': row[1]}
+            for row, last, new in events
+        ]
+
+    alert_events = point_events + zone_events
+    triggered_at = dt.datetime.now(dt.timezone.utc).isoformat()
+    for event in alert_events:
+        event.update({
+            'version': str(version),
+            'triggered_at': triggered_at,
+            'direction': 'up' if event['category'] >= event['threshold'] else 'down',
+            'category_name': CATEGORIES[event['category']][0]
+        })
+
+    # Events are queued before the new categories are committed: a failed run
+    # repeats its events rather than losing them
+    if alert_events:
+        pipe = redis_client.pipeline()
+        for start in range(0, len(alert_events), 1000):
+            pipe.rpush(ALERTS_QUEUE, *[serialization.dumps(event) for event in alert_events[start:start + 1000]])
+        pipe.ltrim(ALERTS_QUEUE, -MAX_QUEUED_ALERTS, -1)
+        pipe.execute()
+    if updates:
+        execute_values(cursor, """
+            UPDATE tempo_alert_subscriptions AS s SET last_category = v.category
+            FROM (VALUES %s) AS v (id, category) WHERE s.id = v.id
+        """, updates)
+    db_conn.commit()
+    cursor.close()
+    print(f"✅ Alerts: evaluated {len(point_rows):,} point and {len(zone_rows):,} zone subscriptions, "
+          f"queued {len(alert_events):,} events")
+    return len(alert_events)
@@ -0,0 +1,149 @@
+import os
+import time
+import threading
+
+import serialization
+
+# Redis keys shared by the pipeline (writer) and the API (reader)
+LATEST_KEY = 'latest_aqi_data'
+VERSION_KEY = 'latest_aqi_version'
+REFRESH_LOCK_KEY = 'latest_aqi_data:refresh_lock'
+
+# A snapshot is "fresh" for CACHE_FRESH_SECONDS; after that it is still served
+# (flagged as stale) until CACHE_STALE_SECONDS, while a refresh runs in the background
+FRESH_SECONDS = int(os.getenv("CACHE_FRESH_SECONDS", 3600))
+STALE_SECONDS = int(os.getenv("CACHE_STALE_SECONDS", 86400))
+REFRESH_LOCK_SECONDS = int(os.getenv("CACHE_REFRESH_LOCK_SECONDS", 120))
+
+# Number of points kept in the API snapshot
+API_POINTS = 10000
+
+# Last good snapshot seen by this process, served if Redis loses the key
+_last_good_snapshot = None
+_refresh_lock = threading.Lock()
+_refresh_done = threading.Event()
+_refresh_done.set()
+
+
+def _timestamp_str(timestamp):
+    return timestamp.isoformat() if hasattr(timestamp, 'isoformat') else str(timestamp)
+
+
+def write_snapshot(redis_client, data_points, timestamp, total_points=None, cached_at=None):
+    """Write the API snapshot and bump the data version
+
+    cached_at (Unix seconds) defaults to now; rewrites of older data pass the
+    time the data was first cached so they are not reported as fresh.
+    """
+    cache_data = {
+        'timestamp': _timestamp_str(timestamp),
+        'cached_at': time.time() if cached_at is None else cached_at,
+        'total_points': total_points if total_points is not None else len(data_points),
+        'data_points': data_points[:API_POINTS]
+    }
+    pipe = redis_client.pipeline()
+    pipe.set(LATEST_KEY, serialization.dumps(cache_data), ex=STALE_SECONDS)
+    pipe.set(VERSION_KEY, cache_data['timestamp'], ex=STALE_SECONDS)
+    pipe.execute()
+
+    global _last_good_snapshot
+    _last_good_snapshot = cache_data
+    return cache_data
+
+
+def read_snapshot(redis_client):
+    """Read the API snapshot from Redis, falling back to the last good in-process copy
+
+    Returns (snapshot, age_seconds, is_stale) or (None, None, None) if nothing is cached.
+    """
+    global _last_good_snapshot
+    snapshot = None
+    try:
+        cached_data = redis_client.get(LATEST_KEY)
+        if cached_data:
+            snapshot = serialization.loads(cached_data)
+            _last_good_snapshot = snapshot
+    except Exception as e:
+        print(f"⚠️  Redis snapshot read failed: {e}")
+
+    if snapshot is None:
+        snapshot = _last_good_snapshot
+    if snapshot is None:
+        return None, None, None
+
+    # Snapshots written before cached_at existed are treated as stale
+    age = time.time() - snapshot.get('cached_at', 0)
+    return snapshot, age, age > FRESH_SECONDS
+
+
+def refresh_from_db(redis_client, db_conn):
+    """Rebuild the API snapshot from the newest tempo_aqi row"""
+    cursor = db_conn.cursor()
+    # Only transfer the slice the API serves instead of the whole JSONB array
+    cursor.execute("""
+        SELECT timestamp, jsonb_array_length(data),
+               jsonb_path_query_array(data, %s::jsonpath)
+        FROM tempo_aqi
+        ORDER BY timestamp DESC
+        LIMIT 1
+    """, (f"$[0 to {API_POINTS - 1}]",))
+    result = cursor.fetchone()
+    cursor.close()
+
+    if not result or not result[2]:
+        print("⚠️  Cache refresh: no data in database")
+        return None
+
+    timestamp, total_points, data_points = result
+    # Freshness follows the data, not the refresh: an unchanged row keeps its
+    # original cached_at, otherwise the row's write time stands in for it
+    previous, _, _ = read_snapshot(redis_client)
+    if previous is not None and previous.get('timestamp') == _timestamp_str(timestamp) and 'cached_at' in previous:
+        cached_at = previous['cached_at']
+    else:
+        cached_at = timestamp.timestamp() if hasattr(timestamp, 'timestamp') else None
+    snapshot = write_snapshot(redis_client, data_points, timestamp, total_points=total_points, cached_at=cached_at)
+    print(f"✅ Cache refreshed from database ({len(data_points):,} points, data from {snapshot['timestamp']})")
+    return snapshot
+
+
+def _run_refresh(get_redis_client, get_db_connection):
+    try:
+        redis_client = get_redis_client()
+        # Cross-instance lock: only one API instance hits Postgres per refresh window
+        if not redis_client.set(REFRESH_LOCK_KEY, b'1', nx=True, ex=REFRESH_LOCK_SECONDS):
+            print("Cache refresh already running elsewhere, skipping")
+            return
+        try:
+            conn = get_db_connection()
+            try:
+                refresh_from_db(redis_client, conn)
+            finally:
+                conn.close()
+        finally:
+            redis_client.delete(REFRESH_LOCK_KEY)
+    except Exception as e:
+        print(f"⚠️  Cache refresh failed: {e}")
+    finally:
+        _refresh_done.set()
+        _refresh_lock.release()
+
+
+def trigger_refresh(get_redis_client, get_db_connection, wait=None):
+    """Start a background cache refresh unless one is already in flight
+
+    Concurrent callers in this process share a single refresh (singleflight).
+    If wait is given, block up to that many seconds for the refresh to finish.
+    Returns True if this call started the refresh.
+    """
+    started = _refresh_lock.acquire(blocking=False)
+    if started:
+        _refresh_done.clear()
+        threading.Thread(
+            target=_run_refresh,
+            args=(get_redis_client, get_db_connection),
+            daemon=True
+        ).start()
+    if wait:
+        _refresh_done.wait(wait)
+    return started
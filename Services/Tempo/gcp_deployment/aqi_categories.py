@@ -0,0 +1,65 @@
+import numpy as np
+
+# Compact internal representation: AQI as uint16 with a sentinel for invalid
+# pixels, categories as uint8 codes into one shared lookup table. Codes are
+# expanded to names/colours only when a response is built.
+AQI_DTYPE = np.uint16
+AQI_INVALID = np.iinfo(AQI_DTYPE).max
+CATEGORY_DTYPE = np.uint8
+CATEGORY_INVALID = np.iinfo(CATEGORY_DTYPE).max
+
+# Upper AQI bound of each category (the last category is open ended)
+CATEGORY_BOUNDS = np.array([50, 100, 150, 200, 300], dtype=AQI_DTYPE)
+
+CATEGORIES = [
+    ("Good", "#00E400"),
+    ("Moderate", "#FFFF00"),
+    ("Unhealthy for Sensitive Groups", "#FF7E00"),
+    ("Unhealthy", "#FF0000"),
+    ("Very Unhealthy", "#8F3F97"),
+    ("Hazardous", "#7E0023"),
+]
+
+
+def category_code(aqi_value):
+    """Category code (index into CATEGORIES) for one AQI value"""
+    return int(np.searchsorted(CATEGORY_BOUNDS, aqi_value, side='left'))
+
+
+def category_codes(aqi_values):
+    """Vectorized category codes for an AQI array; invalid pixels get CATEGORY_INVALID"""
+    aqi_values = np.asarray(aqi_values)
+    codes = np.searchsorted(CATEGORY_BOUNDS, aqi_values, side='left').astype(CATEGORY_DTYPE)
+    if aqi_values.dtype == AQI_DTYPE:
+        codes[aqi_values == AQI_INVALID] = CATEGORY_INVALID
+    return codes
+
+
+def get_aqi_category(aqi_value):
+    """Get AQI category and color"""
+    return CATEGORIES[category_code(aqi_value)]
+
+
+def expand_category(category):
+    """Expand a category code to [name, color]; already expanded values pass through"""
+    if isinstance(category, int):
+        return list(CATEGORIES[category]) if category < len(CATEGORIES) else None
+    return category
+
+
+def expand_point(point):
+    """Copy of a stored data point with its category code expanded for responses"""
+    if isinstance(point.get('category'), int):
+        return dict(point, category=expand_category(point['category']))
+    return point
+
+
+def pack_mask(mask):
+    """Bit-pack a boolean grid (8 pixels per byte, row-major)"""
+    return np.packbits(np.asarray(mask, dtype=bool).ravel())
+
+
+def mask_bits(packed, flat_index):
+    """Read bits of a packed mask at flat grid indices"""
+    flat_index = np.asarray(flat_index)
+    return ((packed[flat_index >> 3] >> (7 - (flat_index & 7))) & 1).astype(bool)
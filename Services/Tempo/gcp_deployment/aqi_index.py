@@ -0,0 +1,123 @@
+import time
+import threading
+import numpy as np
+
+import aqi_cache
+from aqi_categories import expand_point
+import serialization
+
+EARTH_RADIUS_KM = 6371
+
+# Cap on the (queries x points) distance matrix evaluated at once
+MAX_MATRIX_CELLS = 4_000_000
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class PointIndex:
+    """Columnar copy of a cache snapshot for vectorized lookups
+
+    Each point is also serialized once per snapshot, so responses can splice
+    the byte fragments instead of re-encoding the points on every request.
+    """
+
+    def __init__(self, snapshot):
+        self.version = snapshot['timestamp']
+        self.cached_at = snapshot.get('cached_at', 0)
+        self.total_points = snapshot.get('total_points', len(snapshot['data_points']))
+        self.points = [p for p in snapshot['data_points'] if 'latitude' in p and 'longitude' in p]
+        # Category codes are expanded here, once per snapshot, at the response edge
+        self.fragments = [serialization.dumps(expand_point(p)) for p in self.points]
+        self.lat = np.radians(np.array([p['latitude'] for p in self.points], dtype=np.float64))
+        self.lon = np.radians(np.array([p['longitude'] for p in self.points], dtype=np.float64))
+        self.cos_lat = np.cos(self.lat)
+
+    def __len__(self):
+        return len(self.points)
+
+    def age(self):
+        return time.time() - self.cached_at
+
+    def is_stale(self):
+        return self.age() > aqi_cache.FRESH_SECONDS
+
+    def _distances(self, q_lat, q_lon):
+        """Haversine distance matrix (km) between query points (radians) and all indexed points"""
+        dlat = self.lat[None, :] - q_lat[:, None]
+        dlon = self.lon[None, :] - q_lon[:, None]
+        a = np.sin(dlat / 2) ** 2 + np.cos(q_lat[:, None]) * self.cos_lat[None, :] * np.sin(dlon / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def within(self, lat, lon, radius, limit):
+        """Indices and distances (km) of up to limit points within radius, nearest first"""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        dist = self._distances(np.radians([lat]), np.radians([lon]))[0]
+        candidates = np.flatnonzero(dist <= radius)
+        order = candidates[np.argsort(dist[candidates], kind='stable')][:limit]
+        return order, dist[order]
+
+    def nearest(self, lats, lons, radii):
+        """Nearest point within each query's radius
+
+        Returns (indices, distances_km, matches) arrays in query order. indices
+        is -1 where no point lies within the radius.
+        """
+        q_lat = np.radians(np.asarray(lats, dtype=np.float64))
+        q_lon = np.radians(np.asarray(lons, dtype=np.float64))
+        radii = np.asarray(radii, dtype=np.float64)
+
+        n = len(q_lat)
+        indices = np.full(n, -1, dtype=np.int64)
+        distances = np.full(n, np.nan)
+        matches = np.zeros(n, dtype=np.int64)
+        if n == 0 or len(self) == 0:
+            return indices, distances, matches
+
+        # Evaluate the haversine matrix in row blocks to bound memory
+        block = max(1, MAX_MATRIX_CELLS // len(self))
+        for start in range(0, n, block):
+            end = min(start + block, n)
+            dist = self._distances(q_lat[start:end], q_lon[start:end])
+
+            within = dist <= radii[start:end, None]
+            matches[start:end] = within.sum(axis=1)
+            best = np.argmin(np.where(within, dist, np.inf), axis=1)
+            found = matches[start:end] > 0
+            indices[start:end] = np.where(found, best, -1)
+            distances[start:end] = np.where(found, dist[np.arange(end - start), best], np.nan)
+
+        return indices, distances, matches
+
+
+def get_index(redis_client):
+    """Return the point index for the current snapshot, rebuilding it only when the version changes
+
+    Stale indexes re-read the snapshot so a background refresh is picked up.
+    """
+    global _index
+    try:
+        version = redis_client.get(aqi_cache.VERSION_KEY)
+        version = version.decode() if isinstance(version, bytes) else version
+    except Exception as e:
+        print(f"⚠️  Redis version read failed: {e}")
+        version = None
+
+    index = _index
+    if index is not None and (version is None or index.version == version) and not index.is_stale():
+        return index
+
+    with _index_lock:
+        if _index is not None and _index.version == version and not _index.is_stale():
+            return _index
+        snapshot, _, _ = aqi_cache.read_snapshot(redis_client)
+        if snapshot is None:
+            return _index
+        if _index is not None and _index.version == snapshot['timestamp']:
+            # Same data re-cached by a refresh: only its freshness changed
+            _index.cached_at = snapshot.get('cached_at', 0)
+            return _index
+        _index = PointIndex(snapshot)
+        print(f"Built point index for {snapshot['timestamp']} ({len(_index):,} points)")
+        return _index
@@ -0,0 +1,291 @@
+import os
+import re
+import datetime as dt
+
+# Raw granules are kept this many days; older partitions are downsampled into
+# tempo_aqi_daily and then dropped (or detached, see RETENTION_MODE)
+RETENTION_DAYS = int(os.getenv("TEMPO_AQI_RETENTION_DAYS", 7))
+# Partition granularity for tempo_aqi: "day" or "month"
+PARTITION_INTERVAL = os.getenv("TEMPO_AQI_PARTITION", "day").lower()
+# "drop" deletes expired partitions; "detach" keeps them as standalone tempo_aqi_archive_* tables
+RETENTION_MODE = os.getenv("TEMPO_AQI_RETENTION_MODE", "drop").lower()
+# Cell size (degrees) of the daily downsampled grid
+DOWNSAMPLE_DEGREES = float(os.getenv("TEMPO_AQI_DOWNSAMPLE_DEGREES", 0.25))
+
+# Partitions created ahead of the current one, so a run never lands outside the table
+PARTITIONS_AHEAD = 2
+
+_PARTITION_RE = re.compile(r'^tempo_aqi_p(\d{6}|\d{8})$')
+
+
+def _period_start(timestamp):
+    day = timestamp.astimezone(dt.timezone.utc).date() if isinstance(timestamp, dt.datetime) else timestamp
+    return day.replace(day=1) if PARTITION_INTERVAL == 'month' else day
+
+
+def _next_period(start):
+    if PARTITION_INTERVAL == 'month':
+        return (start.replace(day=28) + dt.timedelta(days=4)).replace(day=1)
+    return start + dt.timedelta(days=1)
+
+
+def partition_name(start):
+    return f"tempo_aqi_p{start.strftime('%Y%m' if PARTITION_INTERVAL == 'month' else '%Y%m%d')}"
+
+
+def _partition_start(name):
+    match = _PARTITION_RE.match(name)
+    if not match:
+        return None
+    suffix = match.group(1)
+    if len(suffix) == 6:
+        return dt.date(int(suffix[:4]), int(suffix[4:]), 1)
+    return dt.date(int(suffix[:4]), int(suffix[4:6]), int(suffix[6:]))
+
+
+def _partition_end(name, start):
+    # The suffix length says how the partition was created, whatever the current setting
+    if len(_PARTITION_RE.match(name).group(1)) == 6:
+        return (start.replace(day=28) + dt.timedelta(days=4)).replace(day=1)
+    return start + dt.timedelta(days=1)
+
+
+def _relkind(cursor, table):
+    cursor.execute("""
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = %s AND n.nspname = current_schema()
+    """, (table,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _create_parent(cursor):
+    cursor.execute("""
+        CREATE TABLE tempo_aqi (
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+            data JSONB,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            CONSTRAINT tempo_aqi_timestamp_uniq UNIQUE (timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """)
+
+
+def _create_partition(cursor, start):
+    name = partition_name(start)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {name} PARTITION OF tempo_aqi
+        FOR VALUES FROM (%s) TO (%s)
+    """, (f"{start.isoformat()} 00:00:00+00", f"{_next_period(start).isoformat()} 00:00:00+00"))
+    return name
+
+
+def _retention_cutoff(now):
+    return _period_start(now - dt.timedelta(days=RETENTION_DAYS))
+
+
+def _downsample(cursor, source_table, before):
+    """Aggregate raw granules in source_table older than before into tempo_aqi_daily
+
+    One row per UTC day: mean/max AQI and sample count per DOWNSAMPLE_DEGREES
+    cell, plus the number of granules the day was built from. Days that
+    already have a row are left alone.
+    """
+    cursor.execute(f"""
+        INSERT INTO tempo_aqi_daily (day, resolution_deg, granules, data)
+        SELECT day, %(res)s, days.granules, jsonb_agg(jsonb_build_object(
+            'latitude', lat, 'longitude', lon,
+            'aqi_mean', aqi_mean, 'aqi_max', aqi_max, 'samples', samples
+        ))
+        FROM (
+            SELECT (t.timestamp AT TIME ZONE 'UTC')::date AS day,
+                   round((p->>'latitude')::float8 / %(res)s) * %(res)s AS lat,
+                   round((p->>'longitude')::float8 / %(res)s) * %(res)s AS lon,
+                   round(avg((p->>'aqi')::float8)::numeric, 1) AS aqi_mean,
+                   max(round((p->>'aqi')::numeric))::int AS aqi_max,
+                   count(*) AS samples
+            FROM {source_table} t
+            CROSS JOIN LATERAL jsonb_array_elements(t.data) p
+            WHERE t.timestamp < %(before)s AND p ? 'aqi'
+            GROUP BY 1, 2, 3
+        ) cells
+        JOIN (
+            SELECT (timestamp AT TIME ZONE 'UTC')::date AS day, count(*) AS granules
+            FROM {source_table} WHERE timestamp < %(before)s
+            GROUP BY 1
+        ) days USING (day)
+        GROUP BY day, days.granules
+        ON CONFLICT (day) DO NOTHING
+    """, {'res': DOWNSAMPLE_DEGREES, 'before': f"{before.isoformat()} 00:00:00+00"})
+    return cursor.rowcount
+
+
+def _migrate_plain_table(cursor, now):
+    """Move an unpartitioned tempo_aqi into the partitioned layout
+
+    Rows inside the retention window are copied into partitions; older rows
+    are downsampled into tempo_aqi_daily. The old table is then dropped.
+    """
+    print("Migrating tempo_aqi to a partitioned table...")
+    cursor.execute("ALTER TABLE tempo_aqi RENAME TO tempo_aqi_unpartitioned")
+    _create_parent(cursor)
+
+    cutoff = _retention_cutoff(now)
+    cursor.execute("""
+        SELECT DISTINCT (timestamp AT TIME ZONE 'UTC')::date
+        FROM tempo_aqi_unpartitioned WHERE timestamp >= %s
+    """, (f"{cutoff.isoformat()} 00:00:00+00",))
+    for start in sorted({_period_start(row[0]) for row in cursor.fetchall()}):
+        _create_partition(cursor, start)
+
+    cursor.execute("""
+        INSERT INTO tempo_aqi (timestamp, data)
+        SELECT timestamp, data FROM tempo_aqi_unpartitioned WHERE timestamp >= %s
+    """, (f"{cutoff.isoformat()} 00:00:00+00",))
+    print(f"   Copied {cursor.rowcount:,} granules inside the {RETENTION_DAYS}-day window")
+    days = _downsample(cursor, 'tempo_aqi_unpartitioned', cutoff)
+    print(f"   Downsampled {days:,} older days into tempo_aqi_daily")
+    cursor.execute("DROP TABLE tempo_aqi_unpartitioned")
+
+
+def ensure_storage(conn, now=None):
+    """Create (or migrate to) the partitioned tempo_aqi table, upcoming partitions and tempo_aqi_daily"""
+    now = now or dt.datetime.now(dt.timezone.utc)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tempo_aqi_daily (
+                day DATE PRIMARY KEY,
+                resolution_deg REAL,
+                granules INTEGER,
+                data JSONB,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        kind = _relkind(cursor, 'tempo_aqi')
+        if kind is None:
+            _create_parent(cursor)
+        elif kind == 'r':
+            _migrate_plain_table(cursor, now)
+
+        start = _period_start(now)
+        for _ in range(PARTITIONS_AHEAD + 1):
+            _create_partition(cursor, start)
+            start = _next_period(start)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def list_partitions(cursor):
+    """(name, start, end) of every tempo_aqi partition, oldest first"""
+    cursor.execute("""
+        SELECT child.relname FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = 'tempo_aqi'
+    """)
+    partitions = []
+    for (name,) in cursor.fetchall():
+        start = _partition_start(name)
+        if start is not None:
+            partitions.append((name, start, _partition_end(name, start)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def apply_retention(conn, now=None):
+    """Downsample and drop (or detach) partitions that ended before the retention cutoff
+
+    Returns the names of the partitions removed from tempo_aqi.
+    """
+    now = now or dt.datetime.now(dt.timezone.utc)
+    cutoff = _retention_cutoff(now)
+    cursor = conn.cursor()
+    expired = []
+    try:
+        for name, start, end in list_partitions(cursor):
+            if end > cutoff:
+                continue
+            days = _downsample(cursor, name, end)
+            if RETENTION_MODE == 'detach':
+                cursor.execute(f"ALTER TABLE tempo_aqi DETACH PARTITION {name}")
+                cursor.execute(f"ALTER TABLE {name} RENAME TO {name.replace('tempo_aqi_p', 'tempo_aqi_archive_')}")
+            else:
+                cursor.execute(f"DROP TABLE {name}")
+            conn.commit()
+            expired.append(name)
+            print(f"🗄️  Retention: {name} downsampled into {days} daily rows and {'detached' if RETENTION_MODE == 'detach' else 'dropped'}")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return expired
+
+
+def swap_reprocessed(conn, rows, now=None):
+    """Replace tempo_aqi rows (and affected tempo_aqi_daily days) with reprocessed data in one transaction
+
+    rows yields (timestamp, data_json) pairs. They are staged first, so the
+    swap itself is a single commit: readers see either the old or the new
+    results, never a mix. Rows that retention already moved out of tempo_aqi
+    are re-downsampled into tempo_aqi_daily instead, but only for days where
+    every granule was reprocessed: a daily row built from more granules than
+    were staged for its day is kept as it is.
+    Returns (rows replaced, daily rows rebuilt).
+    """
+    now = now or dt.datetime.now(dt.timezone.utc)
+    cutoff = f"{_retention_cutoff(now).isoformat()} 00:00:00+00"
+    staging = f"tempo_aqi_reprocess_{os.getpid()}"
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        cursor.execute(f"CREATE UNLOGGED TABLE {staging} (timestamp TIMESTAMP WITH TIME ZONE PRIMARY KEY, data JSONB)")
+        conn.commit()
+        staged = 0
+        for timestamp, data in rows:
+            cursor.execute(f"""
+                INSERT INTO {staging} (timestamp, data) VALUES (%s, %s::jsonb)
+                ON CONFLICT (timestamp) DO UPDATE SET data = EXCLUDED.data
+            """, (timestamp, data))
+            conn.commit()
+            staged += 1
+        print(f"   Staged {staged:,} reprocessed granules")
+
+        cursor.execute(f"""
+            UPDATE tempo_aqi t SET data = s.data
+            FROM {staging} s WHERE t.timestamp = s.timestamp
+        """)
+        replaced = cursor.rowcount
+        cursor.execute(f"""
+            SELECT s.day, s.granules, d.granules
+            FROM (
+                SELECT (timestamp AT TIME ZONE 'UTC')::date AS day, count(*) AS granules
+                FROM {staging} WHERE timestamp < %s GROUP BY 1
+            ) s
+            LEFT JOIN tempo_aqi_daily d ON d.day = s.day
+        """, (cutoff,))
+        complete = []
+        for day, staged_granules, daily_granules in cursor.fetchall():
+            if daily_granules is None or staged_granules >= daily_granules:
+                complete.append(day)
+            else:
+                print(f"   ⚠️  Keeping tempo_aqi_daily for {day}: only {staged_granules} of its "
+                      f"{daily_granules} granules were reprocessed")
+        # Days still holding a row are skipped by _downsample (ON CONFLICT DO NOTHING)
+        cursor.execute("DELETE FROM tempo_aqi_daily WHERE day = ANY(%s)", (complete,))
+        days = _downsample(cursor, staging, _retention_cutoff(now))
+        cursor.execute(f"DROP TABLE {staging}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        conn.commit()
+        raise
+    finally:
+        cursor.close()
+    return replaced, days
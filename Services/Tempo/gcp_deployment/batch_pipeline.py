@@ -0,0 +1,93 @@
+import os
+import time
+import queue
+import threading
+
+# Batches buffered per sink; a full queue blocks the producer (backpressure)
+QUEUE_BATCHES = int(os.getenv("PIPELINE_QUEUE_BATCHES", 4))
+
+_DONE = object()
+_ABORT = object()
+
+
+class Sink:
+    """One consumer of the batch pipeline
+
+    handle(batch) is called for every batch, in order, on the sink's own
+    thread; finish() is called once after the last batch and its return
+    value becomes the sink's result. finish() also runs when the producer
+    fails partway, so the sink can release what it holds (the batches it got
+    are then incomplete). Batches are shared between sinks and must not be
+    modified.
+    """
+
+    def __init__(self, name, handle, finish=None):
+        self.name = name
+        self.handle = handle
+        self.finish = finish
+
+
+def _consume(sink, batches, status):
+    started = time.monotonic()
+    while True:
+        batch = batches.get()
+        if batch is _DONE or batch is _ABORT:
+            break
+        # A failed sink keeps draining its queue so it never stalls the producer
+        if status['error'] is not None:
+            continue
+        try:
+            sink.handle(batch)
+            status['batches'] += 1
+        except Exception as e:
+            status['error'] = e
+            print(f"⚠️  {sink.name} sink failed, dropping its remaining batches: {e}")
+
+    if status['error'] is None and sink.finish is not None:
+        try:
+            status['result'] = sink.finish()
+        except Exception as e:
+            status['error'] = e
+            print(f"⚠️  {sink.name} sink failed while finishing: {e}")
+    status['seconds'] = time.monotonic() - started
+
+
+def run_pipeline(batches, sinks, queue_batches=QUEUE_BATCHES):
+    """Fan batches from one producer out to sinks running concurrently
+
+    Each sink gets its own thread and bounded queue, so a slow sink applies
+    backpressure and a failing sink does not affect the others. Returns
+    {sink name: {'batches', 'error', 'result', 'seconds'}}. If the producer
+    raises, sinks are stopped and finished with the batches they got, then
+    the producer's error propagates.
+    """
+    queues = [queue.Queue(maxsize=queue_batches) for _ in sinks]
+    statuses = {sink.name: {'batches': 0, 'error': None, 'result': None, 'seconds': None} for sink in sinks}
+    threads = [
+        threading.Thread(target=_consume, args=(sink, q, statuses[sink.name]), name=f"sink-{sink.name}", daemon=True)
+        for sink, q in zip(sinks, queues)
+    ]
+    for thread in threads:
+        thread.start()
+
+    started = time.monotonic()
+    end_marker = _ABORT
+    try:
+        for batch in batches:
+            for q in queues:
+                q.put(batch)
+        end_marker = _DONE
+    finally:
+        # Sinks finish either way; a producer error is re-raised once they have
+        for q in queues:
+            q.put(end_marker)
+        for thread in threads:
+            thread.join()
+        if end_marker is _ABORT:
+            print(f"⚠️  Batch producer failed after {time.monotonic() - started:.1f}s, sinks stopped")
+
+    print(f"✅ Batch pipeline finished in {time.monotonic() - started:.1f}s")
+    for name, status in statuses.items():
+        outcome = f"failed ({status['error']})" if status['error'] is not None else "ok"
+        print(f"   {name}: {status['batches']} batches in {status['seconds']:.1f}s, {outcome}")
+    return statuses
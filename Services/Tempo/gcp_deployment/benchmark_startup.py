@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Measure API cold start: import time, time until /ready, and the first request
+
+Each run is a fresh Python process, like a new Cloud Run instance (the page
+cache stays warm, so disk reads are cheaper than on a real cold start):
+
+    python benchmark_startup.py --runs 5
+    python benchmark_startup.py --runs 5 --no-preload --path "/latest-aqi?lat=34.05&lon=-118.24"
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Runs inside the fresh process; prints one JSON line of timings
+_CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import endpoint
+imported = time.perf_counter()
+endpoint._ready.wait(60)
+ready = time.perf_counter()
+response = endpoint.app.test_client().get(sys.argv[1])
+done = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - started,
+    'ready_s': ready - started,
+    'first_request_ms': (done - ready) * 1000,
+    'status': response.status_code
+}))
+"""
+
+
+def run_once(path, preload):
+    env = dict(os.environ, API_PRELOAD='true' if preload else 'false')
+    result = subprocess.run([sys.executable, '-c', _CHILD, path], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark(runs, path, preload):
+    timings = [run_once(path, preload) for _ in range(runs)]
+    print(f"{'preload' if preload else 'no preload'}: {runs} runs of {path} (status {timings[-1]['status']})")
+    for name in ('import_s', 'ready_s', 'first_request_ms'):
+        values = [t[name] for t in timings]
+        print(f"   {name:<18} median {statistics.median(values):8.3f}   min {min(values):8.3f}   max {max(values):8.3f}")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark API cold start")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/latest-aqi?limit=100', help="First request after startup")
+    parser.add_argument('--no-preload', action='store_true', help="Skip the background warm-up (API_PRELOAD=false)")
+    args = parser.parse_args()
+    benchmark(args.runs, args.path, not args.no_preload)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Build zones.geojson (the boundary polygons of /aqi-zone) from the US Census
+cartographic boundary files: one "state" and one "county" zone per feature,
+id = GEOID (2 digits for states, 5 for counties, so they never collide).
+
+Run at image build time (see the Dockerfile), or by hand:
+
+    python build_zones.py --year 2023 --resolution 20m --output zones.geojson
+"""
+import io
+import os
+import json
+import zipfile
+import argparse
+import urllib.request
+
+import shapefile
+
+# Cartographic boundary vintage and generalization (500k, 5m or 20m)
+ZONES_YEAR = os.getenv("ZONES_YEAR", "2023")
+ZONES_RESOLUTION = os.getenv("ZONES_RESOLUTION", "20m")
+CENSUS_URL = "https://www2.census.gov/geo/tiger/GENZ{year}/shp/cb_{year}_us_{layer}_{resolution}.zip"
+# Coordinates are rounded to this many decimals (~1 m), far below the TEMPO grid
+COORDINATE_DECIMALS = 5
+
+
+def _round(coordinates):
+    if isinstance(coordinates[0], (int, float)):
+        return [round(value, COORDINATE_DECIMALS) for value in coordinates]
+    return [_round(part) for part in coordinates]
+
+
+def read_layer(url, layer):
+    """Zone features of one boundary shapefile (zipped, as published by the Census Bureau)"""
+    print(f"Downloading {layer} boundaries: {url}")
+    with urllib.request.urlopen(url, timeout=120) as response:
+        archive = zipfile.ZipFile(io.BytesIO(response.read()))
+    stem = os.path.splitext(next(name for name in archive.namelist() if name.endswith('.shp')))[0]
+    reader = shapefile.Reader(shp=io.BytesIO(archive.read(stem + '.shp')),
+                              dbf=io.BytesIO(archive.read(stem + '.dbf')),
+                              shx=io.BytesIO(archive.read(stem + '.shx')))
+    features = []
+    for record in reader.iterShapeRecords():
+        properties = record.record.as_dict()
+        name = properties.get('NAMELSAD') or properties['NAME']
+        if properties.get('STATE_NAME') and layer != 'state':
+            name = f"{name}, {properties['STATE_NAME']}"
+        # pyshp groups the rings into (Multi)Polygons with their holes
+        geometry = record.shape.__geo_interface__
+        features.append({
+            'type': 'Feature',
+            'properties': {'id': properties['GEOID'], 'name': name, 'layer': layer},
+            'geometry': {'type': geometry['type'], 'coordinates': _round(geometry['coordinates'])}
+        })
+    print(f"✅ {len(features):,} {layer} zones")
+    return features
+
+
+def build(output, year=ZONES_YEAR, resolution=ZONES_RESOLUTION, layers=('state', 'county')):
+    features = []
+    for layer in layers:
+        features += read_layer(CENSUS_URL.format(year=year, layer=layer, resolution=resolution), layer)
+    with open(output + '.tmp', 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f, separators=(',', ':'))
+    os.replace(output + '.tmp', output)
+    print(f"✅ Wrote {len(features):,} zones to {output} ({os.path.getsize(output) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build zones.geojson from Census cartographic boundaries")
+    parser.add_argument('--year', default=ZONES_YEAR)
+    parser.add_argument('--resolution', default=ZONES_RESOLUTION, choices=['500k', '5m', '20m'])
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "zones.geojson"))
+    args = parser.parse_args()
+    build(args.output, args.year, args.resolution)
@@ -0,0 +1,289 @@
+import os
+import numpy as np
+
+import serialization
+from aqi_categories import CATEGORIES, CATEGORY_BOUNDS, CATEGORY_DTYPE, CATEGORY_INVALID
+
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+# Simplification tolerances (degrees), one polygon product per tolerance / zoom band
+CONTOUR_TOLERANCES = [float(t) for t in os.getenv("CONTOUR_TOLERANCES", "0.02,0.05,0.1,0.25").split(',')]
+# Output coordinates are snapped to this grid (degrees)
+CONTOUR_PRECISION = float(os.getenv("CONTOUR_PRECISION", 0.0001))
+
+# Redis key prefix of the latest polygons per tolerance index
+CONTOURS_KEY_PREFIX = 'aqi_contours:'
+
+# Marching squares segments per 2x2 case (bits: tl=1, tr=2, br=4, bl=8), oriented
+# so the inside is on the left on screen; saddles (5, 10) keep the two corners apart
+_T, _R, _B, _L = range(4)
+_CASE_SEGMENTS = {
+    1: [(_L, _T)], 2: [(_T, _R)], 3: [(_L, _R)], 4: [(_R, _B)], 5: [(_L, _T), (_R, _B)],
+    6: [(_T, _B)], 7: [(_L, _B)], 8: [(_B, _L)], 9: [(_B, _T)], 10: [(_T, _R), (_B, _L)],
+    11: [(_B, _R)], 12: [(_R, _L)], 13: [(_R, _T)], 14: [(_T, _L)]
+}
+# Edge midpoints in doubled cell coordinates (row, col)
+_EDGE_OFFSETS = {_T: (0, 1), _R: (1, 2), _B: (2, 1), _L: (1, 0)}
+
+
+def contours_key(level):
+    return f"{CONTOURS_KEY_PREFIX}{level}"
+
+
+def category_grid(sparse):
+    """Full grid of category codes (CATEGORY_INVALID where there is no valid pixel)"""
+    grid = np.full(sparse['shape'], CATEGORY_INVALID, dtype=CATEGORY_DTYPE)
+    grid.reshape(-1)[sparse['index']] = sparse['category']
+    return grid
+
+
+def _ring_order(start_keys, end_keys):
+    """Group boundary segments into closed rings
+
+    Returns (order, ring_id): segment positions ring by ring in walking
+    order, and the ring of each ordered segment. Uses pointer jumping, so the
+    cost is O(n log n) array work instead of a Python walk per segment.
+    """
+    n = len(start_keys)
+    by_start = np.argsort(start_keys)
+    following = by_start[np.searchsorted(start_keys, end_keys, sorter=by_start)]
+    steps = max(1, int(np.ceil(np.log2(max(n, 2)))) + 1)
+
+    # Ring id: smallest segment index on the cycle
+    ring = np.arange(n)
+    jump = following.copy()
+    for _ in range(steps):
+        ring = np.minimum(ring, ring[jump])
+        jump = jump[jump]
+
+    # Cut each cycle before its representative and rank by distance to the cut
+    last = following == ring
+    jump = np.where(last, np.arange(n), following)
+    rank = (~last).astype(np.int64)
+    for _ in range(steps):
+        rank = rank + rank[jump]
+        jump = jump[jump]
+
+    order = np.lexsort((-rank, ring))
+    return order, ring[order]
+
+
+def _drop_collinear(keys, ring, width):
+    """Ring vertices without the midpoints along straight runs (most of them on smooth fields)
+
+    Returns (points, ring_starts) with points as fractional (row, col) pixel coordinates.
+    """
+    ring_starts = np.flatnonzero(np.concatenate(([True], ring[1:] != ring[:-1])))
+    ring_ends = np.append(ring_starts[1:], len(keys))
+    next_index = np.arange(1, len(keys) + 1)
+    next_index[ring_ends - 1] = ring_starts
+    step = keys[next_index] - keys
+    previous_step = np.empty_like(step)
+    previous_step[1:] = step[:-1]
+    previous_step[ring_starts] = step[ring_ends - 1]
+    corner = step != previous_step
+
+    kept = np.cumsum(corner)
+    keys = keys[corner]
+    ring_starts = kept[ring_starts] - corner[ring_starts]
+    # Back from doubled padded coordinates to pixel coordinates
+    return np.column_stack([keys // width / 2.0 - 1.0, keys % width / 2.0 - 1.0]), ring_starts
+
+
+def trace_rings(mask):
+    """Marching squares over a boolean grid, fully vectorized
+
+    Returns (points, ring_starts, signed_area): ring vertices as fractional
+    (row, col) grid coordinates concatenated ring by ring, the start offset of
+    each ring and its signed area in cells (shells and holes have opposite signs).
+    """
+    padded = np.zeros((mask.shape[0] + 2, mask.shape[1] + 2), dtype=np.uint8)
+    padded[1:-1, 1:-1] = mask
+    case = padded[:-1, :-1] | (padded[:-1, 1:] << 1) | (padded[1:, 1:] << 2) | (padded[1:, :-1] << 3)
+
+    width = 2 * padded.shape[1] + 1
+    starts, ends = [], []
+    for code, segments in _CASE_SEGMENTS.items():
+        rows, cols = np.nonzero(case == code)
+        if not len(rows):
+            continue
+        for begin, end in segments:
+            starts.append((2 * rows + _EDGE_OFFSETS[begin][0]) * width + 2 * cols + _EDGE_OFFSETS[begin][1])
+            ends.append((2 * rows + _EDGE_OFFSETS[end][0]) * width + 2 * cols + _EDGE_OFFSETS[end][1])
+    if not starts:
+        return np.zeros((0, 2)), np.zeros(0, dtype=np.int64), np.zeros(0)
+    start_keys = np.concatenate(starts).astype(np.int64)
+    end_keys = np.concatenate(ends).astype(np.int64)
+
+    order, ring = _ring_order(start_keys, end_keys)
+    points, ring_starts = _drop_collinear(start_keys[order], ring, width)
+
+    # Shoelace per ring, closing each ring onto its own first vertex
+    next_index = np.arange(1, len(points) + 1)
+    ring_ends = np.append(ring_starts[1:], len(points))
+    next_index[ring_ends - 1] = ring_starts
+    y, x = points[:, 0], points[:, 1]
+    signed_area = np.add.reduceat(x * y[next_index] - x[next_index] * y, ring_starts) / 2.0
+    return points, ring_starts, signed_area
+
+
+def _axis_coordinates(axis, index):
+    """Coordinates at fractional indices of a regular axis (extrapolated half a cell past the edges)"""
+    step = (axis[-1] - axis[0]) / (len(axis) - 1) if len(axis) > 1 else 0.0
+    return axis[0] + index * step
+
+
+def level_polygons(rings, lat_axis, lon_axis, tolerance):
+    """Simplified (multi)polygon of traced rings (trace_rings output), in lon/lat
+
+    Rings smaller than a square twice the tolerance across are dropped (they
+    would collapse under simplification anyway), holes are attached to the
+    smallest shell containing them, and the result is simplified with GEOS'
+    topology-preserving simplifier (rings never cross or collapse).
+    """
+    points, ring_starts, signed_area = rings
+    if not len(ring_starts):
+        return shapely.MultiPolygon()
+    lat = _axis_coordinates(np.asarray(lat_axis, dtype=np.float64), points[:, 0])
+    lon = _axis_coordinates(np.asarray(lon_axis, dtype=np.float64), points[:, 1])
+
+    ring_sizes = np.diff(np.append(ring_starts, len(points)))
+    cell_area = abs(_axis_coordinates(np.asarray(lat_axis, dtype=np.float64), 1) - lat_axis[0]) * abs(_axis_coordinates(np.asarray(lon_axis, dtype=np.float64), 1) - lon_axis[0])
+    keep = np.abs(signed_area) * cell_area >= (2 * tolerance) ** 2
+    if not keep.any():
+        return shapely.MultiPolygon()
+
+    # Kept rings renumbered 0..k-1, as linearrings expects consecutive indices
+    ring_index = np.repeat(np.cumsum(keep) - 1, ring_sizes)
+    kept_vertices = np.repeat(keep, ring_sizes)
+    rings = shapely.linearrings(np.column_stack([lon[kept_vertices], lat[kept_vertices]]),
+                                indices=ring_index[kept_vertices])
+    # The inside is on the left in (row, col) order, so shells and holes have opposite signs
+    is_shell = signed_area[keep] < 0
+
+    shells = shapely.polygons(rings[is_shell])
+    holes = rings[~is_shell]
+    shell_holes = {}
+    if len(holes) and len(shells):
+        tree = shapely.STRtree(shells)
+        hole_index, shell_index = tree.query(shapely.get_point(holes, 0), predicate='within')
+        shell_area = shapely.area(shells)
+        # Innermost (smallest) containing shell wins for holes inside nested islands
+        for h, s in sorted(zip(hole_index.tolist(), shell_index.tolist()), key=lambda pair: shell_area[pair[1]]):
+            shell_holes.setdefault(h, s)
+    grouped = {}
+    for h, s in shell_holes.items():
+        grouped.setdefault(s, []).append(holes[h])
+    polygons = [shapely.Polygon(shapely.get_exterior_ring(shell), grouped.get(i, []))
+                for i, shell in enumerate(shells)]
+
+    area = shapely.MultiPolygon(polygons)
+    simplified = shapely.simplify(area, tolerance, preserve_topology=True)
+    return shapely.set_precision(simplified, CONTOUR_PRECISION)
+
+
+def build_contours(sparse, tolerances=CONTOUR_TOLERANCES):
+    """Category polygons of a granule at every tolerance, as GeoJSON FeatureCollections
+
+    Level c is the area where the category is c or worse, so levels nest and
+    are drawn in order (each paints over the previous one), like filled
+    contours; level 0 is the valid-data footprint.
+    """
+    if shapely is None:
+        raise ImportError("shapely is not installed")
+    grid = category_grid(sparse)
+    valid = grid != CATEGORY_INVALID
+    lower_bounds = [0] + [int(bound) + 1 for bound in CATEGORY_BOUNDS]
+
+    # Rings are traced once per level and simplified at every tolerance
+    levels = [(code, trace_rings(valid & (grid >= code))) for code in range(len(CATEGORIES))]
+
+    timestamp = sparse['timestamp']
+    timestamp = timestamp.isoformat() if hasattr(timestamp, 'isoformat') else str(timestamp)
+    products = []
+    for tolerance in tolerances:
+        features = []
+        vertices = 0
+        for code, rings in levels:
+            name, color = CATEGORIES[code]
+            geometry = level_polygons(rings, sparse['latitude'], sparse['longitude'], tolerance)
+            if geometry.is_empty:
+                continue
+            vertices += int(shapely.get_num_coordinates(geometry))
+            features.append({
+                'type': 'Feature',
+                'properties': {'category': code, 'name': name, 'color': color, 'min_aqi': lower_bounds[code]},
+                'geometry': serialization.loads(shapely.to_geojson(geometry))
+            })
+        products.append({
+            'type': 'FeatureCollection',
+            'properties': {'timestamp': timestamp, 'tolerance': tolerance},
+            'features': features
+        })
+        print(f"   Tolerance {tolerance}°: {len(features)} levels, {vertices:,} vertices")
+    return products
+
+
+def store_contours(products, redis_client=None, db_conn=None, ttl=None):
+    """Store a granule's polygons: latest per tolerance in Redis, every granule in PostgreSQL"""
+    if redis_client is not None:
+        try:
+            pipe = redis_client.pipeline()
+            for level, product in enumerate(products):
+                pipe.set(contours_key(level), serialization.dumps(product), ex=ttl)
+            pipe.execute()
+            print(f"✅ Cached {len(products)} polygon levels in Redis")
+        except Exception as e:
+            print(f"⚠️  Redis polygon caching failed: {e}")
+
+    if db_conn is not None:
+        try:
+            cursor = db_conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS tempo_aqi_contours (
+                    timestamp TIMESTAMP WITH TIME ZONE,
+                    tolerance DOUBLE PRECISION,
+                    data JSONB,
+                    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (timestamp, tolerance)
+                )
+            """)
+            for product in products:
+                cursor.execute("""
+                    INSERT INTO tempo_aqi_contours (timestamp, tolerance, data)
+                    VALUES (%s, %s, %s::jsonb)
+                    ON CONFLICT (timestamp, tolerance) DO UPDATE SET data = EXCLUDED.data
+                """, (product['properties']['timestamp'], product['properties']['tolerance'],
+                      serialization.dumps(product).decode()))
+            db_conn.commit()
+            cursor.close()
+            print(f"✅ Stored {len(products)} polygon levels in PostgreSQL")
+        except Exception as e:
+            db_conn.rollback()
+            print(f"⚠️  PostgreSQL polygon storage failed: {e}")
+
+
+def get_contours(level, redis_client=None, db_conn=None):
+    """Latest polygons for a tolerance index as serialized GeoJSON bytes (Redis first, then PostgreSQL)"""
+    if redis_client is not None:
+        try:
+            value = redis_client.get(contours_key(level))
+            if value:
+                return value
+        except Exception as e:
+            print(f"⚠️  Redis polygon lookup failed: {e}")
+
+    if db_conn is not None and 0 <= level < len(CONTOUR_TOLERANCES):
+        cursor = db_conn.cursor()
+        cursor.execute("""
+            SELECT data FROM tempo_aqi_contours WHERE tolerance = %s
+            ORDER BY timestamp DESC LIMIT 1
+        """, (CONTOUR_TOLERANCES[level],))
+        row = cursor.fetchone()
+        cursor.close()
+        if row:
+            return serialization.dumps(row[0])
+    return None
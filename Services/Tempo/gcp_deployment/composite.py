@@ -0,0 +1,113 @@
+import os
+import datetime as dt
+import numpy as np
+
+import granule_snapshot
+import sparse_granule
+from aqi_categories import pack_mask, mask_bits
+
+# Snapshot channel holding the rolling composite
+CHANNEL = 'composite'
+# Pixels not observed again within this many seconds drop out of the composite
+COMPOSITE_MAX_AGE = int(os.getenv("COMPOSITE_MAX_AGE", 6 * 3600))
+
+# Value columns carried per pixel (besides 'index' and 'observed')
+COLUMNS = ('aqi', 'category', 'no2')
+
+
+def epoch_seconds(timestamp):
+    """Granule time (datetime, datetime64 or ISO string) as Unix seconds"""
+    if hasattr(timestamp, 'timestamp'):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=dt.timezone.utc)
+        return int(timestamp.timestamp())
+    return int(np.datetime64(str(timestamp).replace('Z', ''), 's').astype(np.int64))
+
+
+def merge(previous, sparse, observed_at, max_age=COMPOSITE_MAX_AGE):
+    """Merge a granule's valid pixels into the previous composite: (arrays, composite time, pixels taken)
+
+    One vectorized pass over the grid, whatever the history length: the
+    granule's pixels replace older ones, pixels it did not cover keep
+    their last valid value and observation time, and pixels older than
+    max_age (relative to the newest observation) are dropped. A previous
+    composite on another grid is discarded. Pixels taken counts the granule's
+    pixels that made it into the composite.
+    """
+    index = np.asarray(sparse['index'])
+    columns = {name: np.asarray(sparse[name]) for name in COLUMNS}
+    columns['no2'] = columns['no2'].astype(np.float32)
+    observed = np.full(len(index), observed_at, dtype=np.uint32)
+    composite_time = observed_at
+
+    if (previous is not None and np.array_equal(previous['latitude'], sparse['latitude']) and
+            np.array_equal(previous['longitude'], sparse['longitude'])):
+        prev_index = previous['index']
+        prev_observed = previous['observed']
+        composite_time = max(observed_at, int(previous.meta['composite_time']))
+        covered = mask_bits(sparse['valid_bits'], prev_index)
+        # A granule older than the composite (reprocessing) does not overwrite newer pixels
+        newer = covered & (prev_observed > observed_at)
+        keep = (~covered | newer) & (prev_observed.astype(np.int64) >= composite_time - max_age)
+        if newer.any():
+            taken = np.ones(len(index), dtype=bool)
+            taken[sparse_granule.positions(index, prev_index[newer])] = False
+            index, observed = index[taken], observed[taken]
+            columns = {name: values[taken] for name, values in columns.items()}
+        if observed_at < composite_time - max_age:
+            index, observed = index[:0], observed[:0]
+            columns = {name: values[:0] for name, values in columns.items()}
+    else:
+        keep = np.zeros(0, dtype=bool)
+
+    # The two index sets are disjoint: mark both on the grid, and each pixel's
+    # merged position is its rank among the marked cells (no sort or search)
+    n_rows, n_cols = len(sparse['latitude']), len(sparse['longitude'])
+    valid = np.zeros(n_rows * n_cols, dtype=bool)
+    valid[index] = True
+    kept = np.flatnonzero(keep)
+    if len(kept):
+        valid[previous['index'][kept]] = True
+    rank = np.cumsum(valid, dtype=np.int32) - 1
+    merged_index = np.flatnonzero(valid).astype(np.uint32)
+
+    arrays = {'index': merged_index}
+    new_pos = rank[index]
+    kept_pos = rank[previous['index'][kept]] if len(kept) else kept
+    for name, new_values in [('observed', observed)] + list(columns.items()):
+        arrays[name] = np.empty(len(merged_index), dtype=new_values.dtype)
+        arrays[name][new_pos] = new_values
+        if len(kept):
+            arrays[name][kept_pos] = previous[name][kept]
+    arrays.update({
+        'row_ptr': np.concatenate(([0], rank[n_cols - 1::n_cols] + 1)).astype(np.uint32),
+        'valid_bits': pack_mask(valid),
+        'latitude': sparse['latitude'],
+        'longitude': sparse['longitude']
+    })
+    return arrays, composite_time, len(index)
+
+
+def publish(sparse, version, max_age=COMPOSITE_MAX_AGE, directory=granule_snapshot.SNAPSHOT_DIR):
+    """Merge the granule into the current composite and publish it as the 'composite' channel"""
+    observed_at = epoch_seconds(sparse['timestamp'])
+    previous = granule_snapshot.current(CHANNEL, directory, refresh=True)
+    arrays, composite_time, taken = merge(previous, sparse, observed_at, max_age)
+    meta = {
+        'version': str(version),
+        'granule_time': str(sparse['timestamp']),
+        'composite_time': composite_time,
+        'max_age': max_age,
+        'shape': [len(sparse['latitude']), len(sparse['longitude'])],
+        'valid_points': int(arrays['index'].size)
+    }
+    print(f"Composite: {arrays['index'].size:,} pixels with a value, {taken:,} from this granule "
+          f"(of its {int(np.asarray(sparse['index']).size):,})")
+    return granule_snapshot.publish(arrays, meta, channel=CHANNEL, directory=directory)
+
+
+def min_observed(snapshot, max_age):
+    """Oldest observation time served for a requested max_age (seconds, None for the composite's own)"""
+    if max_age is None:
+        return None
+    return int(snapshot.meta['composite_time']) - max_age
@@ -1,15 +1,53 @@
 import os
-import json
-import redis
-import psycopg2
-from psycopg2.extras import Json
-from flask import Flask, jsonify, request
-from math import radians, cos, sin, asin, sqrt
+import time
+import datetime as dt
+import threading
+from flask import Flask, Response, g, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from math import radians, cos, sin, asin, sqrt, isfinite
+
+import aqi_cache
+import response_cache
+import serialization
+# Modules needing numpy, h3, shapely or the database drivers are imported in the
+# views and helpers that use them (the warm-up thread loads the common ones), so
+# importing the app stays cheap on a cold start
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Route jsonify through the shared serializer (orjson when installed)"""
+
+    def dumps(self, obj, **kwargs):
+        return serialization.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return serialization.loads(s)
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
+
+# Seconds a request waits for a shared cache rebuild before falling back to the database
+CACHE_REBUILD_WAIT = float(os.getenv("CACHE_REBUILD_WAIT", 5))
+
+# Upper bound on ids accepted by the bulk place lookup
+MAX_BULK_PLACES = 1000
+
+# Upper bound on coordinates accepted by /aqi-batch
+MAX_BATCH_POINTS = int(os.getenv("MAX_BATCH_POINTS", 5000))
+
+# Cap on H3 cells returned by /aqi-hex (ask for a coarser resolution beyond it)
+MAX_HEX_CELLS = int(os.getenv("MAX_HEX_CELLS", 20000))
+# Largest ?k= whose disk (3k(k+1) + 1 cells) fits in MAX_HEX_CELLS; checked before the disk is built
+MAX_HEX_K = int((sqrt(12 * MAX_HEX_CELLS - 3) - 3) // 6)
+
+# Warm the process in the background at import (snapshot maps, Redis pool, point
+# index) so the first request after a scale-up does not pay for it; /ready
+# answers 200 once done
+API_PRELOAD = os.getenv("API_PRELOAD", "true").lower() != "false"
 
 def get_db_connection():
     """Connect to PostgreSQL"""
+    # Imported on first use to keep container startup short
+    import psycopg2
     return psycopg2.connect(
         host=os.getenv("DB_HOST"),
         port=int(os.getenv("DB_PORT", 5432)),
@@ -19,14 +57,49 @@ def get_db_connection():
         connect_timeout=5  # 5 second timeout
     )
 
+_redis_client = None
+
 def get_redis_client():
-    return redis.Redis(
-        host=os.getenv("REDIS_HOST"),
-        port=int(os.getenv("REDIS_PORT", 6379)),
-        password=os.getenv("REDIS_PASSWORD"),
-        socket_connect_timeout=2,  # 2 second timeout
-        socket_timeout=2
-    )
+    """Shared Redis client; its connection pool is reused by every request of the process"""
+    global _redis_client
+    if _redis_client is None:
+        # Imported on first use (normally by the warm-up thread) to keep container startup short
+        import redis
+        _redis_client = redis.Redis(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            password=os.getenv("REDIS_PASSWORD"),
+            socket_connect_timeout=2,  # 2 second timeout
+            socket_timeout=2
+        )
+    return _redis_client
+
+_ready = threading.Event()
+
+def warm_up():
+    """Load what the first requests need; readiness is set even if a step fails"""
+    import aqi_index
+    import composite
+    import granule_snapshot
+    import h3_aggregate
+    started = time.monotonic()
+    try:
+        # Map the snapshots and touch their pages so lookups do not fault them in one by one
+        for channel in ('granule', h3_aggregate.CHANNEL, composite.CHANNEL):
+            snapshot = granule_snapshot.current(channel)
+            if snapshot is not None:
+                for array in snapshot.arrays.values():
+                    array.sum()
+    except Exception as e:
+        print(f"⚠️  Snapshot preload failed: {e}")
+    try:
+        redis_client = get_redis_client()
+        redis_client.ping()
+        aqi_index.get_index(redis_client)
+    except Exception as e:
+        print(f"⚠️  Redis preload failed: {e}")
+    _ready.set()
+    print(f"🔥 API warm in {time.monotonic() - started:.2f}s")
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """Calculate the great circle distance between two points in kilometers"""
@@ -41,46 +114,89 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     r = 6371  # Radius of earth in kilometers
     return c * r
 
+def json_response(body, status=200):
+    """Response for an already-serialized JSON body"""
+    return Response(body, status=status, mimetype='application/json')
+
+def _current_version():
+    """Version of the granule currently cached (used for ETags and response caching)"""
+    version = get_redis_client().get(aqi_cache.VERSION_KEY)
+    return version.decode() if isinstance(version, bytes) else version
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness for the Cloud Run startup probe: 503 until the warm-up has finished"""
+    if _ready.is_set():
+        return jsonify({"ready": True})
+    return jsonify({"ready": False}), 503
+
 @app.route('/latest-aqi', methods=['GET'])
+@response_cache.conditional(_current_version)
 def get_latest_aqi():
     """Get the latest AQI data, optionally filtered by location"""
+    import aqi_index
+    import granule_snapshot
+    from aqi_categories import expand_point
     lat = request.args.get('lat', type=float)
     lon = request.args.get('lon', type=float)
     radius = request.args.get('radius', default=50, type=float)  # Default 50km radius
     limit = request.args.get('limit', default=100, type=int)  # Limit results
+    if not isfinite(radius) or radius < 0:
+        return jsonify({"error": "radius must be a non-negative number of km"}), 400
+
+    if request.args.get('mode') == 'bilinear':
+        # One value interpolated at the coordinate instead of the raw pixels around it
+        if lat is None or lon is None:
+            return jsonify({"error": "mode=bilinear needs lat and lon"}), 400
+        snapshot = granule_snapshot.current()
+        if snapshot is None:
+            return jsonify({"error": "Interpolation needs the granule snapshot, which is not available"}), 503
+        return jsonify({
+            'source': 'snapshot',
+            'mode': 'bilinear',
+            'timestamp': snapshot.version,
+            'data': _interpolated_results(snapshot, [lat], [lon])[0]
+        })
 
     # Try Redis cache first (much faster!)
     try:
         redis_client = get_redis_client()
-        cached_data = redis_client.get('latest_aqi_data')
-        
-        if cached_data:
-            print("✅ Serving from Redis cache (FAST)")
-            cache_obj = json.loads(cached_data)
-            data_points = cache_obj['data_points']
-            
-            # Filter by location if requested
+        index = aqi_index.get_index(redis_client)
+
+        if index is None:
+            # Nothing cached anywhere: join a single shared rebuild instead of
+            # sending every concurrent request to the database
+            aqi_cache.trigger_refresh(get_redis_client, get_db_connection, wait=CACHE_REBUILD_WAIT)
+            index = aqi_index.get_index(redis_client)
+        elif index.is_stale():
+            # Serve the last good snapshot now, rebuild in the background
+            aqi_cache.trigger_refresh(get_redis_client, get_db_connection)
+
+        if index is not None:
+            is_stale = index.is_stale()
+            if is_stale:
+                # The reported age keeps changing, so do not cache this body
+                g.skip_response_cache = True
+            print("✅ Serving from Redis cache (FAST)" + (" [stale]" if is_stale else ""))
+
+            # Splice the pre-serialized points instead of re-encoding them
             if lat is not None and lon is not None:
-                filtered_points = []
-                for point in data_points:
-                    if 'latitude' in point and 'longitude' in point:
-                        dist = haversine_distance(lat, lon, point['latitude'], point['longitude'])
-                        if dist <= radius:
-                            point['distance_km'] = round(dist, 2)
-                            filtered_points.append(point)
-                
-                filtered_points.sort(key=lambda x: x.get('distance_km', float('inf')))
-                data_points = filtered_points[:limit]
+                indices, distances = index.within(lat, lon, radius, limit)
+                fragments = [
+                    serialization.with_fields(index.fragments[i], distance_km=round(float(d), 2))
+                    for i, d in zip(indices, distances)
+                ]
             else:
-                data_points = data_points[:limit]
-            
-            return jsonify({
+                fragments = index.fragments[:limit]
+
+            return json_response(serialization.splice({
                 'source': 'redis_cache',
-                'timestamp': cache_obj['timestamp'],
-                'total_available': cache_obj['total_points'],
-                'returned': len(data_points),
-                'data': data_points
-            })
+                'timestamp': index.version,
+                'stale': is_stale,
+                'age_seconds': round(index.age()),
+                'total_available': index.total_points,
+                'returned': len(fragments)
+            }, 'data', fragments))
     except Exception as e:
         print(f"⚠️  Redis cache miss or error: {e}")
 
@@ -130,7 +246,7 @@ def get_latest_aqi():
                                     distance = haversine_distance(lat, lon, data_lat, data_lon)
 
                                     if distance <= radius:
-                                        point = data.copy()
+                                        point = expand_point(data).copy()
                                         point['distance_km'] = round(distance, 2)
                                         closest_points.append(point)
                                     
@@ -168,7 +284,7 @@ def get_latest_aqi():
                         'source': 'database',
                         'total': len(data_array),
                         'returned': min(limit, len(data_array)),
-                        'data': data_array[:limit]
+                        'data': [expand_point(point) for point in data_array[:limit]]
                     })
                 else:
                     return jsonify({"error": "No data available"}), 404
@@ -179,7 +295,498 @@ def get_latest_aqi():
         print(f"Database connection failed: {e}")
         return jsonify({"error": f"Database connection failed: {str(e)}"}), 500
 
+def _nearest_results(snapshot, lats, lons, radii, min_observed=None):
+    """Nearest valid cell of a mapped snapshot per coordinate; composite cells also carry their age"""
+    import granule_snapshot
+    import sparse_granule
+    from aqi_categories import expand_category
+    rows, cols, distances, matches, searched = granule_snapshot.lookup_points(snapshot, lats, lons, radii,
+                                                                              min_observed=min_observed)
+    lat_axis, lon_axis = snapshot['latitude'], snapshot['longitude']
+    value_pos = sparse_granule.cell_positions(snapshot, rows, cols)
+    results = []
+    for i in range(len(lats)):
+        # Radii beyond the snapshot search reach are clamped; the radius searched is echoed
+        result = {'lat': lats[i], 'lon': lons[i], 'radius': min(radii[i], round(float(searched[i]), 2)),
+                  'matches': int(matches[i]), 'nearest': None}
+        if searched[i] < radii[i]:
+            result['requested_radius'] = radii[i]
+        if rows[i] >= 0:
+            result['nearest'] = {
+                'latitude': float(lat_axis[rows[i]]),
+                'longitude': float(lon_axis[cols[i]]),
+                'aqi': int(snapshot['aqi'][value_pos[i]]),
+                'no2_concentration': float(snapshot['no2'][value_pos[i]]),
+                'category': expand_category(int(snapshot['category'][value_pos[i]])),
+                'distance_km': round(float(distances[i]), 2)
+            }
+            if 'observed' in snapshot:
+                observed = int(snapshot['observed'][value_pos[i]])
+                result['nearest']['observed_at'] = dt.datetime.fromtimestamp(observed, dt.timezone.utc).isoformat()
+                result['nearest']['age_seconds'] = int(snapshot.meta['composite_time']) - observed
+        results.append(result)
+    return results
+
+def _interpolated_results(snapshot, lats, lons, min_observed=None):
+    """Bilinear AQI/NO2 per coordinate; 'aqi' is null where no surrounding cell is valid"""
+    import granule_snapshot
+    from aqi_categories import category_code, expand_category
+    aqi, no2, neighbours = granule_snapshot.interpolate_points(snapshot, lats, lons, min_observed=min_observed)
+    results = []
+    for i in range(len(lats)):
+        result = {'lat': lats[i], 'lon': lons[i], 'neighbors': int(neighbours[i]),
+                  'aqi': None, 'no2_concentration': None, 'category': None}
+        if neighbours[i]:
+            result.update({
+                'aqi': round(float(aqi[i]), 1),
+                'no2_concentration': float(no2[i]),
+                'category': expand_category(category_code(round(float(aqi[i]))))
+            })
+        results.append(result)
+    return results
+
+def _composite_version():
+    import composite
+    import granule_snapshot
+    snapshot = granule_snapshot.current(composite.CHANNEL)
+    return snapshot.version if snapshot is not None else None
+
+@app.route('/aqi-composite', methods=['GET'])
+@response_cache.conditional(_composite_version)
+def get_composite_aqi():
+    """Latest valid AQI at a coordinate from the rolling composite, filling cloud and quality gaps
+
+    Query: lat, lon, radius (km, default 50), mode (nearest|bilinear) and
+    max_age (seconds; default: every cell the composite holds).
+    """
+    import composite
+    import granule_snapshot
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    radius = request.args.get('radius', default=50, type=float)
+    max_age = request.args.get('max_age', type=float)
+    mode = request.args.get('mode', 'nearest')
+    if lat is None or lon is None:
+        return jsonify({"error": "lat and lon are required"}), 400
+    if not isfinite(radius) or radius < 0:
+        return jsonify({"error": "radius must be a non-negative number of km"}), 400
+    if mode not in ('nearest', 'bilinear'):
+        return jsonify({"error": "mode must be 'nearest' or 'bilinear'"}), 400
+
+    snapshot = granule_snapshot.current(composite.CHANNEL)
+    if snapshot is None:
+        return jsonify({"error": "No composite available yet"}), 503
+    min_observed = composite.min_observed(snapshot, max_age)
+    if mode == 'bilinear':
+        result = _interpolated_results(snapshot, [lat], [lon], min_observed)[0]
+    else:
+        result = _nearest_results(snapshot, [lat], [lon], [radius], min_observed)[0]
+    return jsonify({
+        'source': 'composite',
+        'mode': mode,
+        'timestamp': snapshot.version,
+        'max_age': max_age if max_age is not None else snapshot.meta['max_age'],
+        'data': result
+    })
+
+@app.route('/aqi-batch', methods=['POST'])
+def get_batch_aqi():
+    """Resolve AQI for many coordinates in one vectorized pass
+
+    Body: {"points": [{"lat": .., "lon": .., "radius": ..}, ...], "radius": 50}
+    Results are returned in input order; each holds the nearest point within its radius,
+    or with "mode": "bilinear" the value interpolated at the coordinate itself. With
+    "layer": "composite" points are resolved on the rolling composite of recent granules
+    (optionally limited to cells observed within "max_age" seconds).
+    """
+    import aqi_index
+    import composite
+    import granule_snapshot
+    from aqi_categories import expand_point
+    body = request.get_json(silent=True) or {}
+    queries = body.get('points')
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"error": "Body must contain a non-empty 'points' array"}), 400
+    if len(queries) > MAX_BATCH_POINTS:
+        return jsonify({"error": f"At most {MAX_BATCH_POINTS} points per request"}), 400
+
+    mode = body.get('mode', 'nearest')
+    if mode not in ('nearest', 'bilinear'):
+        return jsonify({"error": "mode must be 'nearest' or 'bilinear'"}), 400
+
+    default_radius = body.get('radius', 50)
+    try:
+        lats = [float(q['lat']) for q in queries]
+        lons = [float(q['lon']) for q in queries]
+        radii = [float(q.get('radius', default_radius)) for q in queries]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Each point needs numeric 'lat' and 'lon' (and optional 'radius')"}), 400
+    if not all(isfinite(radius) and radius >= 0 for radius in radii):
+        return jsonify({"error": "Each 'radius' must be a non-negative number of km"}), 400
+
+    layer = body.get('layer', 'granule')
+    if layer not in ('granule', composite.CHANNEL):
+        return jsonify({"error": "layer must be 'granule' or 'composite'"}), 400
+    if layer == composite.CHANNEL:
+        try:
+            max_age = float(body['max_age']) if body.get('max_age') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({"error": "max_age must be a number of seconds"}), 400
+        snapshot = granule_snapshot.current(composite.CHANNEL)
+        if snapshot is None:
+            return jsonify({"error": "No composite available yet"}), 503
+        min_observed = composite.min_observed(snapshot, max_age)
+        if mode == 'bilinear':
+            data = _interpolated_results(snapshot, lats, lons, min_observed)
+        else:
+            data = _nearest_results(snapshot, lats, lons, radii, min_observed)
+        return jsonify({
+            'source': 'composite',
+            'mode': mode,
+            'timestamp': snapshot.version,
+            'max_age': max_age if max_age is not None else snapshot.meta['max_age'],
+            'returned': len(data),
+            'data': data
+        })
+
+    # Prefer the memory-mapped granule: full resolution, no Redis round trip
+    snapshot = granule_snapshot.current()
+    if mode == 'bilinear':
+        if snapshot is None:
+            return jsonify({"error": "Interpolation needs the granule snapshot, which is not available"}), 503
+        return jsonify({
+            'source': 'snapshot',
+            'mode': 'bilinear',
+            'timestamp': snapshot.version,
+            'returned': len(lats),
+            'data': _interpolated_results(snapshot, lats, lons)
+        })
+    if snapshot is not None:
+        results = _nearest_results(snapshot, lats, lons, radii)
+        return jsonify({
+            'source': 'snapshot',
+            'timestamp': snapshot.version,
+            'returned': len(results),
+            'data': results
+        })
+
+    try:
+        index = aqi_index.get_index(get_redis_client())
+    except Exception as e:
+        print(f"⚠️  Point index unavailable: {e}")
+        index = None
+    if index is None:
+        return jsonify({"error": "No cached AQI data available"}), 503
+
+    indices, distances, matches = index.nearest(lats, lons, radii)
+
+    results = []
+    for i, idx in enumerate(indices):
+        result = {'lat': lats[i], 'lon': lons[i], 'radius': radii[i], 'matches': int(matches[i])}
+        if idx >= 0:
+            result['nearest'] = dict(expand_point(index.points[idx]), distance_km=round(float(distances[i]), 2))
+        else:
+            result['nearest'] = None
+        results.append(result)
+
+    return jsonify({
+        'source': 'redis_cache',
+        'timestamp': index.version,
+        'returned': len(results),
+        'data': results
+    })
+
+def _hex_version():
+    """Version of the current H3 aggregate snapshot"""
+    import granule_snapshot
+    import h3_aggregate
+    snapshot = granule_snapshot.current(h3_aggregate.CHANNEL)
+    return snapshot.version if snapshot is not None else None
+
+@app.route('/aqi-hex', methods=['GET'])
+@response_cache.conditional(_hex_version)
+def get_hex_aqi():
+    """H3 cell aggregates (mean/max AQI, pixel count, dominant category)
+
+    Either ?bbox=west,south,east,north or ?lat=..&lon=..&k=.. (cells within k
+    steps of the point's cell); ?res= picks the H3 resolution (default: finest).
+    """
+    import granule_snapshot
+    import h3_aggregate
+    from aqi_categories import expand_category
+    snapshot = granule_snapshot.current(h3_aggregate.CHANNEL)
+    if snapshot is None or h3_aggregate.h3 is None:
+        return jsonify({"error": "No H3 aggregates available"}), 503
+
+    resolutions = snapshot.meta['resolutions']
+    res = request.args.get('res', default=max(resolutions), type=int)
+    if res not in resolutions:
+        return jsonify({"error": f"res must be one of {resolutions}"}), 400
+
+    bbox = request.args.get('bbox')
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if bbox:
+        try:
+            west, south, east, north = (float(v) for v in bbox.split(','))
+        except ValueError:
+            return jsonify({"error": "bbox must be west,south,east,north"}), 400
+        positions = h3_aggregate.cells_in_bbox(snapshot, res, west, south, east, north)
+    elif lat is not None and lon is not None:
+        k = request.args.get('k', default=1, type=int)
+        if k < 0 or k > MAX_HEX_K:
+            return jsonify({"error": f"k must be between 0 and {MAX_HEX_K} "
+                                     f"(larger disks exceed {MAX_HEX_CELLS:,} cells)"}), 400
+        positions = h3_aggregate.cells_in_ring(snapshot, res, lat, lon, k)
+    else:
+        return jsonify({"error": "Provide bbox or lat/lon (and optional k)"}), 400
+
+    if len(positions) > MAX_HEX_CELLS:
+        return jsonify({"error": f"{len(positions):,} cells exceed the limit of {MAX_HEX_CELLS:,}; "
+                                 f"use a smaller area or a coarser res"}), 400
+
+    cells = h3_aggregate.records(snapshot, res, positions)
+    for cell in cells:
+        cell['category'] = expand_category(cell['category'])
+    return jsonify({
+        'source': 'snapshot',
+        'timestamp': snapshot.version,
+        'resolution': res,
+        'returned': len(cells),
+        'data': cells
+    })
+
+@app.route('/aqi-contours', methods=['GET'])
+def get_aqi_contours():
+    """Simplified AQI category polygons of the latest granule (GeoJSON FeatureCollection)
+
+    ?level= picks the simplification level (index into the configured
+    tolerances, 0 = most detailed) and ?tolerance= picks it by value;
+    default is the coarsest. Features are nested levels: draw them in order.
+    """
+    import category_polygons
+    tolerances = category_polygons.CONTOUR_TOLERANCES
+    tolerance = request.args.get('tolerance', type=float)
+    if tolerance is not None:
+        if tolerance not in tolerances:
+            return jsonify({"error": f"tolerance must be one of {tolerances}"}), 400
+        level = tolerances.index(tolerance)
+    else:
+        level = request.args.get('level', default=len(tolerances) - 1, type=int)
+        if not 0 <= level < len(tolerances):
+            return jsonify({"error": f"level must be between 0 and {len(tolerances) - 1}"}), 400
+
+    try:
+        contours = category_polygons.get_contours(level, redis_client=get_redis_client())
+        if contours is None:
+            conn = get_db_connection()
+            try:
+                contours = category_polygons.get_contours(level, db_conn=conn)
+            finally:
+                conn.close()
+    except Exception as e:
+        print(f"Contour lookup error: {e}")
+        return jsonify({"error": "Failed to retrieve AQI polygons"}), 500
+
+    if contours is None:
+        return jsonify({"error": "No AQI polygons available"}), 404
+    return json_response(contours)
+
+@app.route('/aqi-stream', methods=['GET'])
+def stream_updates():
+    """Server-Sent Events announcing each new granule, instead of polling /latest-aqi
+
+    ?bbox=west,south,east,north streams the changed cells inside the box
+    ('delta' events) instead of version notices only.
+    """
+    import update_stream
+    bbox = request.args.get('bbox')
+    if bbox:
+        try:
+            bbox = tuple(float(v) for v in bbox.split(','))
+        except ValueError:
+            bbox = ()
+        if len(bbox) != 4:
+            return jsonify({"error": "bbox must be west,south,east,north"}), 400
+    else:
+        bbox = None
+
+    notices = update_stream.subscribe(get_redis_client)
+    if notices is None:
+        response = jsonify({"error": "Too many open streams, poll /latest-aqi instead"})
+        response.headers['Retry-After'] = '60'
+        return response, 503
+
+    redis_client = get_redis_client()
+    try:
+        current_version = _current_version()
+    except Exception as e:
+        print(f"Stream version lookup error: {e}")
+        current_version = None
+
+    response = Response(update_stream.events(notices, redis_client, bbox=bbox, current_version=current_version,
+                                             last_version=request.headers.get('Last-Event-ID')),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(lambda: update_stream.unsubscribe(notices))
+    return response
+
+@app.route('/alerts', methods=['POST'])
+def create_alert():
+    """Subscribe to category crossings at a point or for a zone
+
+    Body: {"lat": .., "lon": .., "threshold": 2} or {"zone_id": "06037", "threshold": "Unhealthy"},
+    optionally "target" (opaque, passed through to the alert events). threshold
+    is a category code or name; an alert fires whenever AQI enters or leaves
+    that category or worse.
+    """
+    import alerts
+    import granule_snapshot
+    from aqi_categories import CATEGORIES
+    body = request.get_json(silent=True) or {}
+    names = [name.lower() for name, _ in CATEGORIES]
+    threshold = body.get('threshold')
+    if isinstance(threshold, str) and threshold.lower() in names:
+        threshold = names.index(threshold.lower())
+    if not isinstance(threshold, int) or isinstance(threshold, bool) or not 1 <= threshold < len(CATEGORIES):
+        return jsonify({"error": f"threshold must be a category code (1-{len(CATEGORIES) - 1}) or name"}), 400
+
+    zone_id = body.get('zone_id')
+    lat = lon = None
+    zone_record = None
+    if zone_id is not None:
+        # A subscription to a zone without statistics could never fire
+        zone_id = str(zone_id)
+        try:
+            found = _lookup_zones([zone_id])
+        except Exception as e:
+            print(f"Zone lookup error: {e}")
+            return jsonify({"error": "Failed to retrieve zone"}), 500
+        if zone_id not in found:
+            return jsonify({"error": f"Unknown zone: {zone_id}"}), 400
+        zone_record = serialization.loads(found[zone_id])
+    else:
+        try:
+            lat, lon = float(body['lat']), float(body['lon'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": "Provide lat and lon, or zone_id"}), 400
+
+    try:
+        conn = get_db_connection()
+        try:
+            subscription_id = alerts.add_subscription(conn, threshold, latitude=lat, longitude=lon,
+                                                      zone_id=zone_id, target=body.get('target'),
+                                                      snapshot=granule_snapshot.current(),
+                                                      zone_record=zone_record)
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Alert subscription error: {e}")
+        return jsonify({"error": "Failed to store alert subscription"}), 500
+    return jsonify({'id': subscription_id, 'threshold': threshold, 'zone_id': zone_id,
+                    'latitude': lat, 'longitude': lon}), 201
+
+@app.route('/alerts/<subscription_id>', methods=['DELETE'])
+def delete_alert(subscription_id):
+    """Remove an alert subscription"""
+    import alerts
+    try:
+        conn = get_db_connection()
+        try:
+            removed = alerts.remove_subscription(conn, subscription_id)
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Alert subscription error: {e}")
+        return jsonify({"error": "Failed to remove alert subscription"}), 500
+    if not removed:
+        return jsonify({"error": f"Unknown subscription: {subscription_id}"}), 404
+    return '', 204
+
+@app.route('/aqi-place/<place_id>', methods=['GET'])
+def get_place_aqi(place_id):
+    """Get precomputed AQI for a named place from the gazetteer"""
+    try:
+        found = _lookup_places([place_id])
+    except Exception as e:
+        print(f"Place lookup error: {e}")
+        return jsonify({"error": "Failed to retrieve place"}), 500
+
+    if place_id not in found:
+        return jsonify({"error": f"Unknown place: {place_id}"}), 404
+    return json_response(_expand_record(found[place_id]))
+
+@app.route('/aqi-places', methods=['GET', 'POST'])
+def get_places_aqi():
+    """Get precomputed AQI for many places: ?ids=a,b,c or a JSON body {"ids": [...]}"""
+    if request.method == 'POST':
+        place_ids = (request.get_json(silent=True) or {}).get('ids', [])
+    else:
+        place_ids = [i for i in request.args.get('ids', '').split(',') if i]
+
+    if not place_ids:
+        return jsonify({"error": "No place ids given"}), 400
+    if len(place_ids) > MAX_BULK_PLACES:
+        return jsonify({"error": f"At most {MAX_BULK_PLACES} place ids per request"}), 400
+
+    try:
+        found = _lookup_places(place_ids)
+    except Exception as e:
+        print(f"Place lookup error: {e}")
+        return jsonify({"error": "Failed to retrieve places"}), 500
+
+    return json_response(serialization.splice({
+        'returned': len(found),
+        'missing': [place_id for place_id in place_ids if place_id not in found]
+    }, 'data', [_expand_record(found[place_id]) for place_id in place_ids if place_id in found]))
+
+def _expand_record(record):
+    """Serialized place or zone record with its stored category code expanded for the response"""
+    from aqi_categories import expand_point
+    return serialization.dumps(expand_point(serialization.loads(record)))
+
+def _lookup_places(place_ids):
+    """Read place records from Redis, only opening a database connection for misses"""
+    import places
+    found = places.get_places(place_ids, redis_client=get_redis_client())
+    if len(found) < len(place_ids):
+        conn = get_db_connection()
+        try:
+            missing = [place_id for place_id in place_ids if place_id not in found]
+            found.update(places.get_places(missing, db_conn=conn))
+        finally:
+            conn.close()
+    return found
+
+def _lookup_zones(zone_ids):
+    """Read zone records from Redis, only opening a database connection for misses"""
+    import zonal_stats
+    found = zonal_stats.get_zones(zone_ids, redis_client=get_redis_client())
+    if len(found) < len(zone_ids):
+        conn = get_db_connection()
+        try:
+            missing = [zone_id for zone_id in zone_ids if zone_id not in found]
+            found.update(zonal_stats.get_zones(missing, db_conn=conn))
+        finally:
+            conn.close()
+    return found
+
+@app.route('/aqi-zone/<zone_id>', methods=['GET'])
+def get_zone_aqi(zone_id):
+    """Get precomputed zonal AQI statistics for a boundary polygon (state, county, ...)"""
+    try:
+        found = _lookup_zones([zone_id])
+    except Exception as e:
+        print(f"Zone lookup error: {e}")
+        return jsonify({"error": "Failed to retrieve zone"}), 500
+
+    if zone_id not in found:
+        return jsonify({"error": f"Unknown zone: {zone_id}"}), 404
+    return json_response(_expand_record(found[zone_id]))
+
 @app.route('/aqi-locations', methods=['GET'])
+@response_cache.conditional(_current_version)
 def get_aqi_locations():
     """Get all available AQI locations"""
     try:
@@ -212,4 +819,9 @@ def get_aqi_locations():
 
     except Exception as e:
         print(f"Database error: {e}")
-        return jsonify({"error": "Failed to retrieve locations"}), 500
\ No newline at end of file
+        return jsonify({"error": "Failed to retrieve locations"}), 500
+
+if API_PRELOAD:
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+else:
+    _ready.set()
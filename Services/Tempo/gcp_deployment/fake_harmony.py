@@ -0,0 +1,146 @@
+"""Local stand-in for the Harmony API, for exercising job orchestration and downloads
+
+Run it and point the pipeline at it with HARMONY_ENV=LOCAL (the client expects port 3000):
+
+    python fake_harmony.py --port 3000 --data-dir ./granules --job-seconds 20
+
+Jobs finish after --job-seconds (or per granule, e.g. --job-seconds 5,30 for the
+first and second granule submitted). Output files are served from --data-dir by
+granule name, with Range support; unknown granules get generated bytes.
+Jobs for the granules listed in --fail end as failed, and jobs for those in
+--pause wait as paused until resumed (their time starts on resume).
+"""
+import io
+import os
+import time
+import uuid
+import argparse
+import datetime as dt
+import threading
+from flask import Flask, jsonify, request, send_file
+
+app = Flask(__name__)
+
+JOB_SECONDS = [float(s) for s in os.getenv("FAKE_HARMONY_JOB_SECONDS", "5").split(',')]
+DATA_DIR = os.getenv("FAKE_HARMONY_DATA_DIR", "")
+RANDOM_FILE_BYTES = int(os.getenv("FAKE_HARMONY_FILE_BYTES", 16 * 1024 * 1024))
+FAIL_GRANULES = set(filter(None, os.getenv("FAKE_HARMONY_FAIL", "").split(',')))
+PAUSE_GRANULES = set(filter(None, os.getenv("FAKE_HARMONY_PAUSE", "").split(',')))
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _iso(timestamp):
+    return dt.datetime.fromtimestamp(timestamp, dt.timezone.utc).isoformat()
+
+
+def _job_json(job_id):
+    job = _jobs[job_id]
+    elapsed = time.time() - job['created']
+    progress = min(100, int(100 * elapsed / job['seconds'])) if job['seconds'] else 100
+    if job['paused']:
+        status, progress, message = 'paused', 0, 'The job is paused'
+    elif progress < 100:
+        status, message = 'running', 'The job is being processed'
+    elif job['fails']:
+        status, message = 'failed', 'WorkItem failed: granule could not be processed'
+    else:
+        status, message = 'successful', 'The job has completed successfully'
+    body = {
+        'jobID': job_id,
+        'status': status,
+        'message': message,
+        'progress': progress,
+        'createdAt': _iso(job['created']),
+        'updatedAt': _iso(time.time()),
+        'request': job['request'],
+        'numInputGranules': len(job['granules']),
+        'links': []
+    }
+    if status == 'successful':
+        body['links'] = [{'rel': 'data', 'href': f"{request.host_url}data/{job_id}/{name}", 'title': name}
+                         for name in job['granules']]
+    return body
+
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    # Also answers the client's credential validation request
+    return jsonify({'count': len(_jobs), 'jobs': [_job_json(job_id) for job_id in list(_jobs)]})
+
+
+@app.route('/<collection>/ogc-api-coverages/1.0.0/collections/<path:variables>/coverage/rangeset',
+           methods=['GET', 'POST'])
+def submit_job(collection, variables):
+    granules = request.values.getlist('granuleName') or ['granule.nc']
+    granules = [name for value in granules for name in value.split(',')]
+    with _jobs_lock:
+        index = len(_jobs)
+        job_id = str(uuid.uuid4())
+        _jobs[job_id] = {
+            'created': time.time(),
+            'seconds': JOB_SECONDS[min(index, len(JOB_SECONDS) - 1)],
+            'granules': granules,
+            'request': request.url,
+            'fails': any(name in FAIL_GRANULES for name in granules),
+            'paused': any(name in PAUSE_GRANULES for name in granules)
+        }
+    return jsonify(_job_json(job_id))
+
+
+@app.route('/jobs/status', methods=['POST'])
+def batch_status():
+    job_ids = (request.get_json(silent=True) or {}).get('jobIDs', [])
+    statuses = []
+    for job_id in job_ids:
+        if job_id in _jobs:
+            body = _job_json(job_id)
+            statuses.append({'jobID': job_id, 'status': body['status'], 'progress': body['progress']})
+    return jsonify({'jobStatuses': statuses, 'notFoundJobIDs': [job_id for job_id in job_ids if job_id not in _jobs]})
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    if job_id not in _jobs:
+        return jsonify({'code': 'harmony.NotFoundError', 'description': f'Unable to find job {job_id}'}), 404
+    return jsonify(_job_json(job_id))
+
+
+@app.route('/jobs/<job_id>/resume', methods=['GET', 'POST'])
+def resume_job(job_id):
+    if job_id not in _jobs:
+        return jsonify({'code': 'harmony.NotFoundError', 'description': f'Unable to find job {job_id}'}), 404
+    with _jobs_lock:
+        job = _jobs[job_id]
+        if not job['paused']:
+            return jsonify({'code': 'harmony.ConflictError', 'description': 'Job is not paused'}), 409
+        job.update(paused=False, created=time.time())
+    return jsonify(_job_json(job_id))
+
+
+@app.route('/data/<job_id>/<name>', methods=['GET'])
+def job_output(job_id, name):
+    path = os.path.join(DATA_DIR, name) if DATA_DIR else None
+    if path and os.path.exists(path):
+        return send_file(path, conditional=True, etag=True)
+
+    # Deterministic per job, so ranged and resumed requests see the same bytes
+    seed = uuid.UUID(job_id).bytes
+    data = (seed * (RANDOM_FILE_BYTES // len(seed) + 1))[:RANDOM_FILE_BYTES]
+    return send_file(io.BytesIO(data), download_name=name, conditional=True, etag=job_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Harmony server")
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--job-seconds', default=','.join(str(s) for s in JOB_SECONDS))
+    parser.add_argument('--fail', default=','.join(FAIL_GRANULES), help="Granule names whose jobs fail")
+    parser.add_argument('--pause', default=','.join(PAUSE_GRANULES), help="Granule names whose jobs wait paused")
+    args = parser.parse_args()
+    DATA_DIR = args.data_dir
+    FAIL_GRANULES = set(filter(None, args.fail.split(',')))
+    PAUSE_GRANULES = set(filter(None, args.pause.split(',')))
+    JOB_SECONDS = [float(s) for s in args.job_seconds.split(',')]
+    app.run(host='127.0.0.1', port=args.port, threaded=True)
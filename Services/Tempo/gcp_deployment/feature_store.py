@@ -0,0 +1,206 @@
+"""Columnar feature store of valid TEMPO pixels for model training
+
+One chunk per granule: a directory of .npy columns (valid pixels only, in
+grid order) plus a line in an append-only manifest with the chunk's time,
+row count and bounding box. Reads prune chunks by the manifest, memory-map
+the columns and cut each chunk to a bbox with a binary search on its
+latitude column, so training loads contiguous typed arrays:
+
+    python feature_store.py --start 2025-10-01 --end 2025-10-08 --bbox -125,32,-114,42
+"""
+import os
+import json
+import shutil
+import argparse
+import datetime as dt
+import numpy as np
+
+import raw_store
+
+# Root of the store; mount a volume (or sync to a bucket) to keep it across runs
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", "/tmp/tempo_features")
+
+MANIFEST = 'manifest.jsonl'
+
+# Columns per pixel and their on-disk dtype; 'time' is per chunk and filled in on read
+FEATURES = {
+    'latitude': np.float32,
+    'longitude': np.float32,
+    'no2': np.float32,
+    'aqi': np.int16,
+    'uncertainty': np.float32,
+    'surface_pressure': np.float32,
+    'terrain_height': np.float32,
+    'pbl_height': np.float32,
+}
+
+# Extracted variable behind each support column (see main.extract_key_tempo_data)
+SUPPORT_VARIABLES = ('uncertainty', 'surface_pressure', 'terrain_height', 'pbl_height')
+
+
+def chunk_dir(when):
+    return os.path.join(when.strftime('%Y/%m/%d'), f"chunk-{when:%Y%m%dT%H%M%SZ}")
+
+
+def feature_columns(key_data, sparse):
+    """The feature columns of a granule's valid pixels, in grid (row-major) order"""
+    index = np.asarray(sparse['index'])
+    n_cols = len(sparse['longitude'])
+    columns = {
+        'latitude': np.asarray(sparse['latitude'])[index // n_cols],
+        'longitude': np.asarray(sparse['longitude'])[index % n_cols],
+        'no2': sparse['no2'],
+        'aqi': sparse['aqi']
+    }
+    for name in SUPPORT_VARIABLES:
+        columns[name] = np.asarray(key_data[name].values).reshape(-1)[index]
+    return {name: np.asarray(columns[name]).astype(dtype, copy=False) for name, dtype in FEATURES.items()}
+
+
+def write_chunk(key_data, sparse, directory=FEATURE_STORE_DIR):
+    """Write a granule's chunk under directory, replacing any previous one: its manifest entry (not yet recorded)"""
+    when = raw_store.granule_time(key_data['timestamp'])
+    columns = feature_columns(key_data, sparse)
+    relative = chunk_dir(when)
+    path = os.path.join(directory, relative)
+
+    os.makedirs(path + '.tmp', exist_ok=True)
+    for name, values in columns.items():
+        np.save(os.path.join(path + '.tmp', f"{name}.npy"), values)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(path + '.tmp', path)
+
+    rows = len(columns['aqi'])
+    return {
+        'chunk': relative,
+        'time': when.isoformat(),
+        'rows': rows,
+        'bbox': [float(columns['longitude'].min()), float(columns['latitude'].min()),
+                 float(columns['longitude'].max()), float(columns['latitude'].max())] if rows else None,
+        'columns': {name: np.dtype(dtype).str for name, dtype in FEATURES.items()}
+    }
+
+
+def _record(entries, directory):
+    # One short line per chunk; readers keep the last entry of each chunk
+    with open(os.path.join(directory, MANIFEST), 'a') as f:
+        f.writelines(json.dumps(entry) + '\n' for entry in entries)
+
+
+def append(key_data, sparse, directory=FEATURE_STORE_DIR):
+    """Write a granule's chunk and record it in the manifest; a rerun of the granule replaces its chunk"""
+    entry = write_chunk(key_data, sparse, directory)
+    _record([entry], directory)
+    print(f"🧮 Stored {entry['rows']:,} feature rows for {dt.datetime.fromisoformat(entry['time']):%Y-%m-%d %H:%M:%S}")
+    return os.path.join(directory, entry['chunk'])
+
+
+def staging_dir(directory=FEATURE_STORE_DIR):
+    """Private directory inside the store for chunks written ahead of publish_staged (same filesystem)"""
+    return os.path.join(directory, f".staging-{os.getpid()}")
+
+
+def publish_staged(staging, entries, directory=FEATURE_STORE_DIR):
+    """Move chunks written under staging (by write_chunk) into the store, record them and remove staging"""
+    for entry in entries:
+        path = os.path.join(directory, entry['chunk'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(os.path.join(staging, entry['chunk']), path)
+    if entries:
+        _record(entries, directory)
+    shutil.rmtree(staging, ignore_errors=True)
+    print(f"🧮 Published {len(entries):,} feature chunks ({sum(entry['rows'] for entry in entries):,} rows)")
+
+
+def manifest(directory=FEATURE_STORE_DIR):
+    """Chunk entries, oldest first (a replaced chunk appears once, with its latest entry)"""
+    entries = {}
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry['chunk']] = entry
+    except FileNotFoundError:
+        return []
+    return sorted(entries.values(), key=lambda entry: entry['time'])
+
+
+def _overlaps(entry_bbox, bbox):
+    if bbox is None:
+        return True
+    if entry_bbox is None:
+        return False
+    west, south, east, north = bbox
+    return not (entry_bbox[0] > east or entry_bbox[2] < west or entry_bbox[1] > north or entry_bbox[3] < south)
+
+
+def _latitude_range(latitude, south, north):
+    """Row range [start, end) of a chunk's grid-ordered (monotonic) latitude column within [south, north]"""
+    if len(latitude) and latitude[0] > latitude[-1]:
+        start = len(latitude) - np.searchsorted(latitude[::-1], north, side='right')
+        end = len(latitude) - np.searchsorted(latitude[::-1], south, side='left')
+    else:
+        start = np.searchsorted(latitude, south, side='left')
+        end = np.searchsorted(latitude, north, side='right')
+    return int(start), int(end)
+
+
+def read(start, end, bbox=None, columns=None, directory=FEATURE_STORE_DIR):
+    """Feature rows with start <= granule time < end inside bbox (west, south, east, north)
+
+    Returns a dict of concatenated column arrays plus 'time' (datetime64[s]);
+    columns limits which stored columns are loaded.
+    """
+    names = list(columns or FEATURES)
+    parts = {name: [] for name in names + ['time']}
+    for entry in manifest(directory):
+        when = dt.datetime.fromisoformat(entry['time'])
+        if not (start <= when < end) or not entry['rows'] or not _overlaps(entry['bbox'], bbox):
+            continue
+        path = os.path.join(directory, entry['chunk'])
+
+        def column(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+
+        rows = slice(None)
+        keep = None
+        if bbox is not None:
+            west, south, east, north = bbox
+            # Memory-mapped: the binary search and the lon mask touch only the rows in the band
+            lat_start, lat_end = _latitude_range(column('latitude'), south, north)
+            rows = slice(lat_start, lat_end)
+            longitude = column('longitude')[rows]
+            keep = (longitude >= west) & (longitude <= east)
+        count = None
+        for name in names:
+            values = column(name)[rows]
+            values = np.asarray(values[keep] if keep is not None else values)
+            parts[name].append(values)
+            count = len(values)
+        if count is None:
+            count = int(keep.sum()) if keep is not None else entry['rows']
+        parts['time'].append(np.full(count, np.datetime64(when.replace(tzinfo=None), 's')))
+
+    return {name: np.concatenate(values) if values else
+            np.zeros(0, dtype='datetime64[s]' if name == 'time' else FEATURES[name])
+            for name, values in parts.items()}
+
+
+def _parse_day(value):
+    return dt.datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=dt.timezone.utc)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize feature rows for a time window and bbox")
+    parser.add_argument('--start', type=_parse_day, required=True, help="First day (YYYY-MM-DD, UTC)")
+    parser.add_argument('--end', type=_parse_day, required=True, help="Day after the last one (YYYY-MM-DD, UTC)")
+    parser.add_argument('--bbox', help="west,south,east,north")
+    args = parser.parse_args()
+    bbox = [float(v) for v in args.bbox.split(',')] if args.bbox else None
+    features = read(args.start, args.end, bbox)
+    print(f"{len(features['aqi']):,} rows from {len(np.unique(features['time'])):,} granules")
+    for name, values in features.items():
+        if len(values) and name != 'time':
+            print(f"   {name:<18} {values.dtype}  min {values.min():.4g}  max {values.max():.4g}")
@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Local on-disk cache of downloaded granules, shared by reruns and reprocessing
+GRANULE_CACHE_DIR = os.getenv("GRANULE_CACHE_DIR", "/tmp/tempo_granules")
+# Total size kept in the cache; least recently used granules are evicted beyond it
+GRANULE_CACHE_MAX_BYTES = int(float(os.getenv("GRANULE_CACHE_MAX_GB", 10)) * 1024 ** 3)
+# Parallel byte ranges per download (when the server supports Range requests)
+DOWNLOAD_RANGES = int(os.getenv("DOWNLOAD_RANGES", 4))
+# Files smaller than this are fetched in a single stream
+MIN_RANGE_BYTES = 8 * 1024 * 1024
+CHUNK_BYTES = 1024 * 1024
+
+_index_lock = threading.Lock()
+
+
+def _paths(directory):
+    return {
+        'index': os.path.join(directory, 'index.json'),
+        'objects': os.path.join(directory, 'objects'),
+        'partial': os.path.join(directory, 'partial')
+    }
+
+
+def _safe_name(granule_id):
+    return re.sub(r'[^0-9A-Za-z._-]+', '_', granule_id)
+
+
+def _load_index(directory):
+    try:
+        with open(_paths(directory)['index']) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_index(directory, index):
+    path = _paths(directory)['index']
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(path + '.tmp', path)
+
+
+def _object_path(directory, entry):
+    return os.path.join(_paths(directory)['objects'], f"{entry['sha256']}{entry.get('suffix', '')}")
+
+
+def lookup(granule_id, directory=GRANULE_CACHE_DIR):
+    """Path of a cached granule, or None; a hit marks the granule as recently used"""
+    with _index_lock:
+        entry = _load_index(directory).get(granule_id)
+        if entry is None:
+            return None
+        path = _object_path(directory, entry)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return path
+
+
+def _evict(directory, index, keep, budget):
+    """Drop least recently used objects until the cache fits the budget"""
+    objects = {}
+    for granule_id, entry in index.items():
+        path = _object_path(directory, entry)
+        if os.path.exists(path):
+            objects.setdefault(path, []).append(granule_id)
+    total = sum(os.path.getsize(path) for path in objects)
+    for path in sorted(objects, key=os.path.getmtime):
+        if total <= budget:
+            break
+        if path == keep:
+            continue
+        total -= os.path.getsize(path)
+        os.remove(path)
+        for granule_id in objects[path]:
+            del index[granule_id]
+        print(f"🧹 Evicted {os.path.basename(path)} from granule cache")
+
+
+def add(granule_id, source_path, directory=GRANULE_CACHE_DIR, budget=GRANULE_CACHE_MAX_BYTES):
+    """Move a downloaded file into the cache under its SHA-256 and record it for granule_id"""
+    paths = _paths(directory)
+    os.makedirs(paths['objects'], exist_ok=True)
+    digest = hashlib.sha256()
+    with open(source_path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_BYTES), b''):
+            digest.update(block)
+    entry = {
+        'sha256': digest.hexdigest(),
+        'suffix': os.path.splitext(source_path)[1],
+        'size': os.path.getsize(source_path)
+    }
+    path = _object_path(directory, entry)
+    # Identical content under another id is stored once
+    if os.path.exists(path):
+        os.remove(source_path)
+    else:
+        os.replace(source_path, path)
+
+    with _index_lock:
+        index = _load_index(directory)
+        index[granule_id] = entry
+        _evict(directory, index, keep=path, budget=budget)
+        _save_index(directory, index)
+    return path
+
+
+def _probe(session, url):
+    """Size, validator and range support of a remote file (also establishes auth cookies)"""
+    response = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=60)
+    response.raise_for_status()
+    response.close()
+    validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+    if response.status_code == 206:
+        match = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+        if match:
+            return int(match.group(1)), validator, True
+    size = response.headers.get('Content-Length')
+    return (int(size) if size else None), validator, False
+
+
+def _fetch_range(session, url, part_path, start, end):
+    """Fetch bytes [start, end] into part_path, resuming from what is already there"""
+    have = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if end is not None and start + have > end:
+        return
+    headers = {'Range': f"bytes={start + have}-{'' if end is None else end}"} if (have or end is not None) else {}
+    with session.get(url, headers=headers, stream=True, timeout=300) as response:
+        response.raise_for_status()
+        if have and response.status_code != 206:
+            # Server ignored the range; start this part over
+            have = 0
+        with open(part_path, 'ab' if have else 'wb') as f:
+            for block in response.iter_content(CHUNK_BYTES):
+                f.write(block)
+
+
+def download(session, url, destination, ranges=DOWNLOAD_RANGES, work_dir=None):
+    """Resumable download of url to destination, split into parallel byte ranges when possible
+
+    Partial data lives in work_dir (one file per range plus a meta file); an
+    interrupted download picks up where it stopped as long as the remote file's
+    size and ETag/Last-Modified are unchanged.
+    """
+    work_dir = work_dir or destination + '.parts'
+    os.makedirs(work_dir, exist_ok=True)
+    size, validator, ranged = _probe(session, url)
+
+    meta_path = os.path.join(work_dir, 'meta.json')
+    meta = {'url': url.split('?')[0], 'size': size, 'validator': validator}
+    try:
+        with open(meta_path) as f:
+            previous = json.load(f)
+    except (FileNotFoundError, ValueError):
+        previous = None
+    if previous != meta:
+        # Remote file changed (or first attempt): discard stale parts
+        shutil.rmtree(work_dir)
+        os.makedirs(work_dir)
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+    if ranged and size and size >= MIN_RANGE_BYTES and ranges > 1:
+        step = -(-size // ranges)
+        spans = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+    else:
+        spans = [(0, size - 1 if ranged and size else None)]
+    part_paths = [os.path.join(work_dir, f"range-{i:03d}") for i in range(len(spans))]
+
+    if len(spans) == 1:
+        _fetch_range(session, url, part_paths[0], *spans[0])
+    else:
+        print(f"Downloading {size / 1024 ** 2:.1f} MB in {len(spans)} parallel ranges...")
+        with ThreadPoolExecutor(max_workers=len(spans)) as pool:
+            for future in [pool.submit(_fetch_range, session, url, path, *span) for path, span in zip(part_paths, spans)]:
+                future.result()
+
+    with open(destination + '.tmp', 'wb') as out:
+        for path in part_paths:
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, out, CHUNK_BYTES)
+    if size is not None and os.path.getsize(destination + '.tmp') != size:
+        raise IOError(f"Incomplete download of {url}: {os.path.getsize(destination + '.tmp')} of {size} bytes")
+    os.replace(destination + '.tmp', destination)
+    shutil.rmtree(work_dir)
+    return destination
+
+
+def fetch(granule_id, url, session, directory=GRANULE_CACHE_DIR):
+    """Return the cached granule for granule_id, downloading url into the cache on a miss"""
+    path = lookup(granule_id, directory)
+    if path:
+        print(f"✅ Granule cache hit: {granule_id}")
+        return path
+
+    partial_dir = _paths(directory)['partial']
+    os.makedirs(partial_dir, exist_ok=True)
+    name = _safe_name(granule_id)
+    destination = os.path.join(partial_dir, name)
+    download(session, url, destination, work_dir=destination + '.parts')
+    path = add(granule_id, destination, directory)
+    print(f"✅ Cached granule {granule_id} ({os.path.getsize(path) / 1024 ** 2:.1f} MB)")
+    return path
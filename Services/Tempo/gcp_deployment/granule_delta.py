@@ -0,0 +1,144 @@
+import re
+import numpy as np
+
+import serialization
+import sparse_granule
+from granule_snapshot import nearest_axis_index
+
+# Granule version the per-location aqi_{lat}_{lon} keys currently mirror.
+# Deltas are only applied on top of exactly that version.
+LOCATIONS_VERSION_KEY = 'aqi_locations_version'
+# Changed cells of each run, kept for incremental consumers
+DELTA_KEY_PREFIX = 'aqi_delta:'
+# Pub/sub channel announcing each new version and its delta key (see update_stream)
+UPDATES_CHANNEL = 'aqi_updates'
+
+_LOCATION_KEY_RE = re.compile(r'^aqi_(-?\d+\.\d+)_(-?\d+\.\d+)$')
+
+
+def location_key(lat, lon):
+    return f"aqi_{lat:.4f}_{lon:.4f}"
+
+
+def key_location(key):
+    """(lat, lon) of a location key, or None for other keys"""
+    match = _LOCATION_KEY_RE.match(key)
+    return (float(match.group(1)), float(match.group(2))) if match else None
+
+
+def delta_key(version):
+    return f"{DELTA_KEY_PREFIX}{version}"
+
+
+def same_grid(previous, sparse):
+    """True if a published snapshot and a sparse granule share the same lat/lon axes"""
+    return (previous is not None and
+            np.array_equal(previous['latitude'], sparse['latitude']) and
+            np.array_equal(previous['longitude'], sparse['longitude']))
+
+
+def diff_granules(previous, sparse):
+    """Compare the new sparse granule with the previous snapshot, cell by cell
+
+    Returns (changed, removed): changed is a boolean mask over the sparse
+    value columns (cells that are new or whose AQI differs), removed holds the
+    flat grid indices of cells that were valid before and are not any more.
+    Both granules must be on the same grid (see same_grid).
+    """
+    _, new_pos, prev_pos = np.intersect1d(sparse['index'], previous['index'],
+                                          assume_unique=True, return_indices=True)
+    changed = np.ones(len(sparse['index']), dtype=bool)
+    changed[new_pos] = sparse['aqi'][new_pos] != previous['aqi'][prev_pos]
+    still_valid = np.zeros(len(previous['index']), dtype=bool)
+    still_valid[prev_pos] = True
+    removed = np.asarray(previous['index'])[~still_valid]
+
+    print(f"Granule delta vs {previous.version}: {int(changed.sum()):,} of {len(changed):,} cells changed, "
+          f"{len(removed):,} removed")
+    return changed, removed
+
+
+def removed_location_keys(sparse, removed):
+    """Redis location keys of removed cells"""
+    n_cols = sparse['shape'][1]
+    lats = sparse['latitude'][removed // n_cols].tolist()
+    lons = sparse['longitude'][removed % n_cols].tolist()
+    return [location_key(lat, lon) for lat, lon in zip(lats, lons)]
+
+
+def orphan_location_keys(redis_client, sparse, batch_size=10000):
+    """Yield location keys that do not belong to a valid cell of this granule
+
+    Used after a full rewrite, when there is no delta to say which keys went away.
+    """
+    lat_axis, lon_axis = sparse['latitude'], sparse['longitude']
+    keys = []
+
+    def check(batch):
+        lats = np.array([float(m.group(1)) for _, m in batch])
+        lons = np.array([float(m.group(2)) for _, m in batch])
+        rows = nearest_axis_index(lat_axis, lats)
+        cols = nearest_axis_index(lon_axis, lons)
+        on_grid = (np.abs(lat_axis[rows] - lats) < 5e-5) & (np.abs(lon_axis[cols] - lons) < 5e-5)
+        current = on_grid & sparse_granule.is_valid(sparse, rows, cols)
+        return [key for (key, _), keep in zip(batch, current) if not keep]
+
+    for key in redis_client.scan_iter(match='aqi_*', count=batch_size):
+        key = key.decode() if isinstance(key, bytes) else key
+        match = _LOCATION_KEY_RE.match(key)
+        if match:
+            keys.append((key, match))
+        if len(keys) >= batch_size:
+            yield from check(keys)
+            keys = []
+    if keys:
+        yield from check(keys)
+
+
+def plan_delta(redis_client, sparse, previous):
+    """Decide whether this run can be applied as a delta on top of the previous granule
+
+    Returns (previous_version, changed, removed), or None when every location
+    has to be rewritten: no previous snapshot, a different grid, or Redis
+    location keys that do not mirror the previous granule.
+    """
+    if not same_grid(previous, sparse):
+        print("No comparable previous granule, rewriting all locations")
+        return None
+    mirrored = redis_client.get(LOCATIONS_VERSION_KEY)
+    mirrored = mirrored.decode() if isinstance(mirrored, bytes) else mirrored
+    if mirrored != previous.version:
+        print(f"Redis locations mirror {mirrored}, not {previous.version}; rewriting all locations")
+        return None
+    changed, removed = diff_granules(previous, sparse)
+    return previous.version, changed, removed
+
+
+def store_delta(redis_client, version, previous_version, changed_points, removed_keys, ttl):
+    """Store the run's delta for incremental consumers; returns the update notice for announce()
+
+    previous_version is None for a full rewrite; the delta then only marks the
+    run as full and consumers should reload.
+    """
+    key = delta_key(version)
+    delta = {
+        'version': version,
+        'previous_version': previous_version,
+        'full': previous_version is None,
+        'changed': changed_points if previous_version is not None else [],
+        'removed': removed_keys
+    }
+    redis_client.set(key, serialization.dumps(delta), ex=ttl)
+    return {
+        'version': version,
+        'previous_version': previous_version,
+        'full': delta['full'],
+        'changed': len(changed_points),
+        'removed': len(removed_keys),
+        'delta_key': key
+    }
+
+
+def announce(redis_client, notice):
+    """Publish an update notice to streaming consumers (call once the new version is readable everywhere)"""
+    return redis_client.publish(UPDATES_CHANNEL, serialization.dumps(notice))
@@ -0,0 +1,326 @@
+import os
+import re
+import json
+import mmap
+import time
+import threading
+import numpy as np
+
+import sparse_granule
+
+# Directory shared by the pipeline (writer) and API workers (readers).
+# In Cloud Run both services mount the same volume here.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "/tmp/tempo_snapshots")
+
+# How often readers look for a newer snapshot (seconds)
+CHECK_INTERVAL = float(os.getenv("SNAPSHOT_CHECK_INTERVAL", 2))
+
+# Snapshot files kept per channel; older ones are unlinked (mapped readers keep working)
+KEEP_FILES = 3
+
+# Point lookups search at most this many cells (~2 km each) around the query
+MAX_SEARCH_CELLS = int(os.getenv("SNAPSHOT_MAX_SEARCH_CELLS", 50))
+# Cap on (queries x window cells) gathered at once
+WINDOW_BLOCK_CELLS = 4_000_000
+
+MAGIC = b'TSNAP001'
+ALIGNMENT = 64
+
+_open_snapshots = {}
+_open_lock = threading.Lock()
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot_file(path, arrays, meta):
+    """Write arrays into one flat file: magic, header length, JSON header, 64-byte aligned arrays
+
+    Array offsets in the header are relative to the aligned end of the header.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _align(offset + array.nbytes)
+    header_bytes = json.dumps({'meta': meta, 'arrays': layout}).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class GranuleSnapshot:
+    """Read-only, memory-mapped view of a published snapshot file
+
+    Arrays are NumPy views straight onto the page cache, so every worker
+    process shares one copy and nothing is deserialized.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a TEMPO snapshot file")
+        header_len = int.from_bytes(self._mmap[len(MAGIC):len(MAGIC) + 8], 'little')
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._mmap[header_start:header_start + header_len])
+        data_start = _align(header_start + header_len)
+
+        self.meta = header['meta']
+        self.version = self.meta['version']
+        self.arrays = {}
+        for name, entry in header['arrays'].items():
+            dtype = np.dtype(entry['dtype'])
+            count = int(np.prod(entry['shape'])) if entry['shape'] else 1
+            self.arrays[name] = np.frombuffer(
+                self._mmap, dtype=dtype, count=count, offset=data_start + entry['offset']
+            ).reshape(entry['shape'])
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+
+def nearest_axis_index(axis, values):
+    """Index of the nearest axis coordinate for each value (axis may be ascending or descending)"""
+    if axis[0] > axis[-1]:
+        return len(axis) - 1 - nearest_axis_index(axis[::-1], values)
+    idx = np.clip(np.searchsorted(axis, values), 1, len(axis) - 1)
+    left_closer = (values - axis[idx - 1]) < (axis[idx] - values)
+    return idx - left_closer
+
+
+def window_search(lat_axis, lon_axis, is_valid, lats, lons, half_width):
+    """Gather a (2n+1) x (2n+1) window of cells around each query's nearest grid cell
+
+    is_valid(rows, cols) returns a boolean array for the gathered cells.
+    Returns rows, cols, window_valid and distance_km, each shaped
+    (queries, window); distance is inf for invalid cells.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    # Queries outside the grid extent have no coverage
+    in_grid = ((lats >= lat_axis.min()) & (lats <= lat_axis.max()) &
+               (lons >= lon_axis.min()) & (lons <= lon_axis.max()))
+
+    offsets = np.arange(-half_width, half_width + 1)
+    d_row, d_col = [a.ravel() for a in np.meshgrid(offsets, offsets, indexing='ij')]
+    rows = nearest_axis_index(lat_axis, lats)[:, None] + d_row
+    cols = nearest_axis_index(lon_axis, lons)[:, None] + d_col
+    inside = (rows >= 0) & (rows < len(lat_axis)) & (cols >= 0) & (cols < len(lon_axis))
+    rows = np.clip(rows, 0, len(lat_axis) - 1)
+    cols = np.clip(cols, 0, len(lon_axis) - 1)
+
+    window_valid = inside & in_grid[:, None] & is_valid(rows, cols)
+
+    # Equirectangular distance is accurate enough at window scale
+    dy = (lat_axis[rows] - lats[:, None]) * 111.32
+    dx = (lon_axis[cols] - lons[:, None]) * 111.32 * np.cos(np.radians(lats))[:, None]
+    distance_km = np.where(window_valid, np.hypot(dx, dy), np.inf)
+    return rows, cols, window_valid, distance_km
+
+
+def _pointer_path(directory, channel):
+    return os.path.join(directory, f"{channel}.current")
+
+
+def publish(arrays, meta, channel='granule', directory=SNAPSHOT_DIR):
+    """Write a snapshot file and atomically point the channel at it"""
+    os.makedirs(directory, exist_ok=True)
+    safe_version = re.sub(r'[^0-9A-Za-z]+', '', str(meta['version']))
+    filename = f"{channel}-{safe_version}-{int(time.time())}.tsnap"
+    path = os.path.join(directory, filename)
+
+    write_snapshot_file(path + '.tmp', arrays, meta)
+    os.replace(path + '.tmp', path)
+
+    pointer = _pointer_path(directory, channel)
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(filename)
+    os.replace(pointer + '.tmp', pointer)
+
+    # Drop old files; workers that still map them keep a valid view until they switch
+    old_files = sorted(
+        (name for name in os.listdir(directory) if name.startswith(f"{channel}-") and name.endswith('.tsnap')),
+        key=lambda name: os.path.getmtime(os.path.join(directory, name))
+    )
+    for name in old_files[:-KEEP_FILES]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    print(f"✅ Published {channel} snapshot {filename} ({size_mb:.1f} MB)")
+    return path
+
+
+def current(channel='granule', directory=SNAPSHOT_DIR, refresh=False):
+    """Return the channel's current snapshot, switching to a newer file when one is published
+
+    Returns None if nothing has been published yet. refresh checks for a newer
+    file now rather than after CHECK_INTERVAL (writers building on the last file).
+    """
+    now = time.monotonic()
+    key = (directory, channel)
+    entry = _open_snapshots.get(key)
+    if entry is not None and not refresh and now - entry['checked'] < CHECK_INTERVAL:
+        return entry['snapshot']
+
+    with _open_lock:
+        entry = _open_snapshots.get(key)
+        try:
+            with open(_pointer_path(directory, channel)) as f:
+                filename = f.read().strip()
+        except FileNotFoundError:
+            return entry['snapshot'] if entry else None
+
+        if entry is None or entry['filename'] != filename:
+            try:
+                snapshot = GranuleSnapshot(os.path.join(directory, filename))
+                print(f"Mapped {channel} snapshot {filename}")
+            except Exception as e:
+                print(f"⚠️  Failed to map snapshot {filename}: {e}")
+                return entry['snapshot'] if entry else None
+            entry = {'filename': filename, 'snapshot': snapshot, 'checked': now}
+        else:
+            entry = dict(entry, checked=now)
+        _open_snapshots[key] = entry
+        return entry['snapshot']
+
+
+def publish_granule(sparse, version, directory=SNAPSHOT_DIR):
+    """Publish the processed granule in its sparse form: value columns for valid pixels only,
+    their flat grid indices, the CSR row pointer, validity bits and the axes"""
+    arrays = {name: sparse[name] for name in
+              ('index', 'row_ptr', 'aqi', 'category', 'valid_bits', 'latitude', 'longitude')}
+    arrays['no2'] = sparse['no2'].astype(np.float32)
+    meta = {
+        'version': str(version),
+        'granule_time': str(sparse['timestamp']),
+        'shape': list(sparse['shape']),
+        'valid_points': int(sparse['index'].size)
+    }
+    return publish(arrays, meta, channel='granule', directory=directory)
+
+
+def _axis_position(axis, values):
+    """Lower cell index and fractional offset of each value on a regular axis, and whether it is inside"""
+    n = len(axis)
+    if n < 2:
+        return np.zeros(len(values), dtype=np.int64), np.zeros(len(values)), values == axis[0]
+    step = (float(axis[-1]) - float(axis[0])) / (n - 1)
+    position = (values - float(axis[0])) / step
+    inside = (position >= 0) & (position <= n - 1)
+    lower = np.clip(np.floor(position), 0, n - 2).astype(np.int64)
+    return lower, np.clip(position - lower, 0.0, 1.0), inside
+
+
+def interpolate_points(snapshot, lats, lons, min_observed=None):
+    """Bilinear AQI and NO2 at arbitrary coordinates from the four surrounding grid cells
+
+    Cells are located by index arithmetic on the regular L3 axes, so there is
+    no search. Invalid neighbours are dropped and the remaining weights
+    renormalized. Returns (aqi, no2, neighbours): float arrays that are NaN
+    where no neighbour is valid or the point is off the grid, and the number
+    of valid cells used. With min_observed (composite snapshots), cells
+    observed before that Unix time count as invalid.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    row, row_frac, row_inside = _axis_position(snapshot['latitude'], lats)
+    col, col_frac, col_inside = _axis_position(snapshot['longitude'], lons)
+    n_rows, n_cols = len(snapshot['latitude']), len(snapshot['longitude'])
+
+    # Corners (queries, 4): (r, c), (r, c+1), (r+1, c), (r+1, c+1)
+    rows = np.minimum(row[:, None] + [0, 0, 1, 1], n_rows - 1)
+    cols = np.minimum(col[:, None] + [0, 1, 0, 1], n_cols - 1)
+    row_weight = np.column_stack([1 - row_frac, 1 - row_frac, row_frac, row_frac])
+    col_weight = np.column_stack([1 - col_frac, col_frac, 1 - col_frac, col_frac])
+
+    value_pos = sparse_granule.cell_positions(snapshot, rows, cols)
+    valid = (value_pos >= 0) & (row_inside & col_inside)[:, None]
+    if min_observed is not None:
+        valid &= snapshot['observed'][np.maximum(value_pos, 0)] >= min_observed
+    weights = np.where(valid, row_weight * col_weight, 0.0)
+    total = weights.sum(axis=1)
+    found = total > 0
+    weights[found] /= total[found, None]
+
+    safe_pos = np.where(valid, value_pos, 0)
+    aqi = np.where(found, (weights * snapshot['aqi'][safe_pos]).sum(axis=1), np.nan)
+    no2 = np.where(found, (weights * snapshot['no2'][safe_pos]).sum(axis=1), np.nan)
+    return aqi, no2, (weights > 0).sum(axis=1)
+
+
+def lookup_points(snapshot, lats, lons, radii, max_half_width=MAX_SEARCH_CELLS, min_observed=None):
+    """Nearest valid grid cell within each query's radius, straight from the mapped arrays
+
+    Searches are capped at max_half_width cells around each query, so radii
+    beyond that reach are clamped to it. Returns (rows, cols, distances_km,
+    matches, radii_km) with the effective radius per query; rows/cols are -1
+    where no valid cell lies within it.
+    Values for the found cells come from sparse_granule.cell_positions.
+    With min_observed (composite snapshots), cells observed before that Unix
+    time count as invalid.
+    """
+    lat_axis, lon_axis = snapshot['latitude'], snapshot['longitude']
+
+    def is_valid(r, c):
+        if min_observed is None:
+            return sparse_granule.is_valid(snapshot, r, c)
+        value_pos = sparse_granule.cell_positions(snapshot, r, c)
+        return (value_pos >= 0) & (snapshot['observed'][np.maximum(value_pos, 0)] >= min_observed)
+
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    radii = np.asarray(radii, dtype=np.float64)
+    n = len(lats)
+    if not np.isfinite(radii).all():
+        raise ValueError("Search radii must be finite")
+
+    # Grid step in km at each query (the east-west step shrinks with latitude);
+    # max_half_width of the shorter step is the farthest the window reaches
+    lat_km = abs(float(lat_axis[1] - lat_axis[0])) * 111.32 if len(lat_axis) > 1 else 1.0
+    lon_km = abs(float(lon_axis[1] - lon_axis[0])) * 111.32 if len(lon_axis) > 1 else 1.0
+    cell_km = np.minimum(lat_km, lon_km * np.cos(np.radians(np.clip(lats, -89.0, 89.0))))
+    radii = np.minimum(radii, max_half_width * cell_km)
+    half_width = max(0, int(np.ceil((radii / cell_km).max() - 1e-9))) if n else 0
+    window = (2 * half_width + 1) ** 2
+
+    rows = np.full(n, -1, dtype=np.int64)
+    cols = np.full(n, -1, dtype=np.int64)
+    distances = np.full(n, np.nan)
+    matches = np.zeros(n, dtype=np.int64)
+
+    block = max(1, WINDOW_BLOCK_CELLS // window)
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        w_rows, w_cols, _, dist = window_search(
+            lat_axis, lon_axis, is_valid, lats[start:end], lons[start:end], half_width
+        )
+        within = dist <= radii[start:end, None]
+        matches[start:end] = within.sum(axis=1)
+        best = np.argmin(dist, axis=1)
+        picked = np.arange(end - start)
+        found = within[picked, best]
+        rows[start:end] = np.where(found, w_rows[picked, best], -1)
+        cols[start:end] = np.where(found, w_cols[picked, best], -1)
+        distances[start:end] = np.where(found, dist[picked, best], np.nan)
+
+    return rows, cols, distances, matches, radii
@@ -0,0 +1,169 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from aqi_categories import AQI_DTYPE
+
+
+def _default_workers():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Threads used for grid stages; NumPy releases the GIL inside its kernels,
+# so row blocks run truly in parallel
+GRID_WORKERS = int(os.getenv("GRID_WORKERS", _default_workers()))
+# Rows per block (~128 rows x 2378 columns keeps a block's float32 inputs near 1 MB)
+ROW_BLOCK_ROWS = int(os.getenv("GRID_ROW_BLOCK_ROWS", 128))
+# "numpy" (default) or "numba" for the fused JIT kernel, when numba is installed
+GRID_KERNEL = os.getenv("GRID_KERNEL", "numpy").lower()
+
+# numba takes ~150 ms to import, so only processes that use the kernel pay for it
+numba = None
+if GRID_KERNEL == 'numba':
+    try:
+        import numba
+    except ImportError:
+        pass
+
+# EPA breakpoints for NO2 (ppb to AQI)
+NO2_BREAKPOINTS = [
+    (0, 53, 0, 50),           # Good
+    (54, 100, 51, 100),       # Moderate
+    (101, 360, 101, 150),     # Unhealthy for Sensitive
+    (361, 649, 151, 200),     # Unhealthy
+    (650, 1249, 201, 300),    # Very Unhealthy
+    (1250, 1649, 301, 400),   # Hazardous
+    (1650, 2049, 401, 500),   # Hazardous
+]
+
+# Constants for conversion
+AVOGADRO = 6.022e23
+ATMOSPHERIC_FACTOR = 1e12  # Conservative factor for molecules/cm² to ppb
+
+
+def conversion_id(conversion):
+    """Short stable hash identifying the conversion constants and breakpoints"""
+    key = json.dumps([conversion['avogadro'], conversion['atmospheric_factor'], conversion['breakpoints']])
+    return hashlib.sha1(key.encode()).hexdigest()[:10]
+
+
+def load_conversion(path=None):
+    """NO2 column to AQI conversion config: the defaults above, overridden by a JSON file
+
+    The file may set any of "avogadro", "atmospheric_factor" and "breakpoints"
+    (a list of [conc_lo, conc_hi, aqi_lo, aqi_hi] rows in integer ppb, ascending).
+    """
+    conversion = {'avogadro': AVOGADRO, 'atmospheric_factor': ATMOSPHERIC_FACTOR, 'breakpoints': NO2_BREAKPOINTS}
+    if path:
+        with open(path) as f:
+            conversion.update(json.load(f))
+    conversion['avogadro'] = float(conversion['avogadro'])
+    conversion['atmospheric_factor'] = float(conversion['atmospheric_factor'])
+    conversion['breakpoints'] = [[int(v) for v in row] for row in conversion['breakpoints']]
+    if any(len(row) != 4 for row in conversion['breakpoints']):
+        raise ValueError("Each breakpoint needs [conc_lo, conc_hi, aqi_lo, aqi_hi]")
+    conversion['id'] = conversion_id(conversion)
+    return conversion
+
+
+# Conversion used by the pipeline (AQI_CONVERSION_CONFIG points at a JSON override file)
+CONVERSION = load_conversion(os.getenv("AQI_CONVERSION_CONFIG"))
+
+
+def row_blocks(n_rows, block_rows=ROW_BLOCK_ROWS):
+    """(start, end) row ranges covering n_rows"""
+    return [(start, min(start + block_rows, n_rows)) for start in range(0, n_rows, block_rows)]
+
+
+def map_row_blocks(fn, n_rows, workers=None, block_rows=ROW_BLOCK_ROWS):
+    """Run fn(start, end) over row blocks in a thread pool; results come back in block order"""
+    workers = GRID_WORKERS if workers is None else workers
+    blocks = row_blocks(n_rows, block_rows)
+    if workers <= 1 or len(blocks) <= 1:
+        return [fn(start, end) for start, end in blocks]
+    with ThreadPoolExecutor(max_workers=min(workers, len(blocks))) as pool:
+        return list(pool.map(lambda block: fn(*block), blocks))
+
+
+def _aqi_block_numpy(no2, quality, out, conversion):
+    valid = (~np.isnan(no2)) & (quality == 0)
+
+    # Handle negative/zero values first
+    out[(no2 <= 0) & valid] = 0
+
+    positive = (no2 > 0) & valid
+    positive_count = int(positive.sum())
+    if positive_count:
+        # Convert to ppb, then to integer concentrations for the breakpoint table
+        breakpoints = conversion['breakpoints']
+        top = breakpoints[-1][1]
+        ppb_values = (no2[positive] / conversion['avogadro']) * conversion['atmospheric_factor']
+        conc_values = np.clip(ppb_values.astype(int), 0, top + 1)
+
+        aqi_values = np.zeros_like(conc_values, dtype=float)
+        for bp_lo, bp_hi, aqi_lo, aqi_hi in breakpoints:
+            mask = (conc_values >= bp_lo) & (conc_values <= bp_hi)
+            aqi_values[mask] = ((aqi_hi - aqi_lo) / (bp_hi - bp_lo)) * (conc_values[mask] - bp_lo) + aqi_lo
+
+        # Values above the maximum breakpoint
+        aqi_values[conc_values > top] = 500
+
+        out[positive] = np.round(np.clip(aqi_values, 0, 500)).astype(AQI_DTYPE)
+    return int(valid.sum()), positive_count
+
+
+_aqi_block_fused = None
+
+if numba is not None:
+    @numba.njit(nogil=True, cache=True)
+    def _aqi_block_fused(no2, quality, out, avogadro, factor, breakpoints):
+        # One pass per pixel instead of a mask per breakpoint; arithmetic
+        # mirrors the NumPy path (no2 dtype for ppb, float64 for AQI)
+        valid_count = 0
+        positive_count = 0
+        top = breakpoints[breakpoints.shape[0] - 1, 1]
+        for i in range(no2.shape[0]):
+            for j in range(no2.shape[1]):
+                value = no2[i, j]
+                if np.isnan(value) or quality[i, j] != 0:
+                    continue
+                valid_count += 1
+                if value <= 0:
+                    out[i, j] = 0
+                    continue
+                positive_count += 1
+                conc = min(max(int((value / avogadro) * factor), 0), top + 1)
+                # Like the NumPy path: 0 for concentrations between breakpoints,
+                # 500 above the table, and the last matching breakpoint wins
+                aqi = 0.0
+                for k in range(breakpoints.shape[0]):
+                    bp_lo, bp_hi, aqi_lo, aqi_hi = breakpoints[k, 0], breakpoints[k, 1], breakpoints[k, 2], breakpoints[k, 3]
+                    if bp_lo <= conc <= bp_hi:
+                        aqi = ((aqi_hi - aqi_lo) / (bp_hi - bp_lo)) * (conc - bp_lo) + aqi_lo
+                if conc > top:
+                    aqi = 500.0
+                out[i, j] = np.round(min(max(aqi, 0.0), 500.0))
+        return valid_count, positive_count
+
+
+# Kernel actually in use (falls back to NumPy when numba is missing)
+ACTIVE_KERNEL = 'numba' if GRID_KERNEL == 'numba' and _aqi_block_fused is not None else 'numpy'
+
+
+def aqi_block(no2, quality, out, conversion=None):
+    """Write AQI for one block of rows into out (pre-filled with AQI_INVALID)
+
+    conversion defaults to CONVERSION. Returns (valid_count, positive_count) for the block.
+    """
+    conversion = conversion or CONVERSION
+    if ACTIVE_KERNEL == 'numba':
+        scalar = no2.dtype.type
+        return _aqi_block_fused(no2, quality, out, scalar(conversion['avogadro']),
+                                scalar(conversion['atmospheric_factor']),
+                                np.array(conversion['breakpoints'], dtype=np.int64))
+    return _aqi_block_numpy(no2, quality, out, conversion)
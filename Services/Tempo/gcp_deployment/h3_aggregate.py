@@ -0,0 +1,179 @@
+import os
+import hashlib
+import numpy as np
+
+import granule_snapshot
+from aqi_categories import AQI_DTYPE, CATEGORIES
+
+try:
+    import h3
+    import h3.api.basic_int as h3_int
+except ImportError:
+    h3 = None
+
+# H3 resolutions aggregated per granule (res 6 cells are ~36 km², about 9 TEMPO pixels)
+H3_RESOLUTIONS = sorted({int(res) for res in os.getenv("H3_RESOLUTIONS", "3,4,5,6").split(',')})
+# Pixel-to-cell maps, computed once per grid and reused by every granule on it
+H3_CACHE_DIR = os.getenv("H3_CACHE_DIR", "/tmp/tempo_h3")
+
+# Snapshot channel holding the per-cell aggregates
+CHANNEL = 'h3'
+
+_cell_maps = {}
+
+
+def _grid_key(lat_axis, lon_axis, resolutions):
+    digest = hashlib.sha1(np.ascontiguousarray(lat_axis, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(lon_axis, dtype=np.float64).tobytes())
+    digest.update(repr(resolutions).encode())
+    return digest.hexdigest()[:16]
+
+
+def _compute_cell_map(lat_axis, lon_axis, resolutions):
+    finest = max(resolutions)
+    lats = np.repeat(np.asarray(lat_axis, dtype=np.float64), len(lon_axis)).tolist()
+    lons = np.tile(np.asarray(lon_axis, dtype=np.float64), len(lat_axis)).tolist()
+    pixel_cells = np.fromiter((h3_int.latlng_to_cell(lat, lon, finest) for lat, lon in zip(lats, lons)),
+                              dtype=np.uint64, count=len(lats))
+    fine_cells, fine_inverse = np.unique(pixel_cells, return_inverse=True)
+
+    arrays = {}
+    for res in resolutions:
+        if res == finest:
+            cells, inverse = fine_cells, fine_inverse
+        else:
+            # Coarser resolutions come from the parents of the (far fewer) fine cells
+            parents = np.fromiter((h3_int.cell_to_parent(int(cell), res) for cell in fine_cells),
+                                  dtype=np.uint64, count=len(fine_cells))
+            cells, parent_pos = np.unique(parents, return_inverse=True)
+            inverse = parent_pos[fine_inverse]
+        centers = np.array([h3_int.cell_to_latlng(int(cell)) for cell in cells], dtype=np.float64).reshape(-1, 2)
+        arrays[f"r{res}_cells"] = cells
+        arrays[f"r{res}_pixel_cell"] = inverse.astype(np.uint32)
+        arrays[f"r{res}_lat"] = centers[:, 0].astype(np.float32)
+        arrays[f"r{res}_lon"] = centers[:, 1].astype(np.float32)
+    return arrays
+
+
+def cell_map(lat_axis, lon_axis, resolutions=H3_RESOLUTIONS, directory=H3_CACHE_DIR):
+    """H3 cells of a lat/lon grid, per resolution
+
+    For each resolution: r{res}_cells (sorted uint64 H3 indexes touched by the
+    grid), r{res}_pixel_cell (position in cells of every flat pixel) and the
+    cell centres. Computed once per grid, then served from memory or disk.
+    """
+    key = _grid_key(lat_axis, lon_axis, resolutions)
+    if key in _cell_maps:
+        return _cell_maps[key]
+
+    path = os.path.join(directory, f"cellmap-{key}.npz")
+    try:
+        with np.load(path) as stored:
+            arrays = dict(stored)
+    except (FileNotFoundError, ValueError, OSError):
+        print(f"Mapping {len(lat_axis) * len(lon_axis):,} grid pixels to H3 resolutions {resolutions}...")
+        arrays = _compute_cell_map(lat_axis, lon_axis, resolutions)
+        os.makedirs(directory, exist_ok=True)
+        np.savez(path + '.tmp.npz', **arrays)
+        os.replace(path + '.tmp.npz', path)
+    _cell_maps[key] = arrays
+    return arrays
+
+
+def aggregate(sparse, resolutions=H3_RESOLUTIONS):
+    """Bin the valid pixels of a sparse granule into H3 cells at every resolution
+
+    Per resolution and occupied cell: mean and max AQI, pixel count and the
+    dominant category (most pixels; ties go to the less severe category).
+    Coarser cells hold the pixels of their finest-resolution children, so
+    the levels nest exactly.
+    """
+    cells_by_res = cell_map(sparse['latitude'], sparse['longitude'], resolutions)
+    aqi = np.asarray(sparse['aqi'])
+    category = np.asarray(sparse['category']).astype(np.int64)
+    n_categories = len(CATEGORIES)
+
+    arrays = {}
+    for res in resolutions:
+        cell_pos = cells_by_res[f"r{res}_pixel_cell"][sparse['index']]
+        used, local = np.unique(cell_pos, return_inverse=True)
+        count = np.bincount(local, minlength=len(used))
+        mean = np.bincount(local, weights=aqi, minlength=len(used)) / np.maximum(count, 1)
+
+        order = np.argsort(local, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+        peak = np.maximum.reduceat(aqi[order], starts) if len(used) else np.zeros(0, dtype=AQI_DTYPE)
+
+        per_category = np.bincount(local * n_categories + category, minlength=len(used) * n_categories)
+        dominant = per_category.reshape(-1, n_categories).argmax(axis=1)
+
+        arrays[f"r{res}_cells"] = cells_by_res[f"r{res}_cells"][used]
+        arrays[f"r{res}_lat"] = cells_by_res[f"r{res}_lat"][used]
+        arrays[f"r{res}_lon"] = cells_by_res[f"r{res}_lon"][used]
+        arrays[f"r{res}_aqi_mean"] = mean.astype(np.float32)
+        arrays[f"r{res}_aqi_max"] = peak.astype(AQI_DTYPE)
+        arrays[f"r{res}_count"] = count.astype(np.uint32)
+        arrays[f"r{res}_category"] = dominant.astype(np.uint8)
+        print(f"   H3 res {res}: {len(used):,} cells")
+    return arrays
+
+
+def publish(sparse, version, resolutions=H3_RESOLUTIONS, directory=granule_snapshot.SNAPSHOT_DIR):
+    """Aggregate the granule into H3 cells and publish them as the 'h3' snapshot channel"""
+    if h3 is None:
+        raise ImportError("h3 is not installed")
+    arrays = aggregate(sparse, resolutions)
+    meta = {
+        'version': str(version),
+        'granule_time': str(sparse['timestamp']),
+        'resolutions': list(resolutions)
+    }
+    return granule_snapshot.publish(arrays, meta, channel=CHANNEL, directory=directory)
+
+
+def records(snapshot, res, positions):
+    """Cell aggregates at the given positions as JSON-ready dicts (category as a code)"""
+    positions = np.asarray(positions, dtype=np.int64)
+    cells = snapshot[f"r{res}_cells"][positions].tolist()
+    return [
+        {
+            'h3': h3_int.int_to_str(cell),
+            'latitude': round(lat, 5),
+            'longitude': round(lon, 5),
+            'aqi_mean': round(mean, 1),
+            'aqi_max': peak,
+            'count': count,
+            'category': category
+        }
+        for cell, lat, lon, mean, peak, count, category in zip(
+            cells,
+            snapshot[f"r{res}_lat"][positions].tolist(),
+            snapshot[f"r{res}_lon"][positions].tolist(),
+            snapshot[f"r{res}_aqi_mean"][positions].tolist(),
+            snapshot[f"r{res}_aqi_max"][positions].tolist(),
+            snapshot[f"r{res}_count"][positions].tolist(),
+            snapshot[f"r{res}_category"][positions].tolist()
+        )
+    ]
+
+
+def cells_in_bbox(snapshot, res, west, south, east, north):
+    """Positions of the cells at res covering a bbox (cells whose centre lies within
+    one cell edge of it)"""
+    lat_margin = h3.average_hexagon_edge_length(res, 'km') / 111.0
+    lon_margin = lat_margin / max(np.cos(np.radians(min(max(abs(south), abs(north)), 89.0))), 0.01)
+    lat, lon = snapshot[f"r{res}_lat"], snapshot[f"r{res}_lon"]
+    inside = ((lat >= south - lat_margin) & (lat <= north + lat_margin) &
+              (lon >= west - lon_margin) & (lon <= east + lon_margin))
+    return np.flatnonzero(inside)
+
+
+def cells_in_ring(snapshot, res, lat, lon, k):
+    """Positions of the cells at res within k steps of the cell containing (lat, lon)"""
+    center = h3_int.latlng_to_cell(lat, lon, res)
+    ring = np.array(sorted(h3_int.grid_disk(center, k)), dtype=np.uint64)
+    cells = snapshot[f"r{res}_cells"]
+    pos = np.minimum(np.searchsorted(cells, ring), max(len(cells) - 1, 0))
+    if not len(cells):
+        return pos[:0]
+    return pos[cells[pos] == ring]
@@ -0,0 +1,127 @@
+import os
+import time
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+
+# Polling starts at HARMONY_POLL_INITIAL seconds per job and backs off to HARMONY_POLL_MAX
+POLL_INITIAL_SECONDS = float(os.getenv("HARMONY_POLL_INITIAL", 2))
+POLL_MAX_SECONDS = float(os.getenv("HARMONY_POLL_MAX", 30))
+POLL_BACKOFF = 1.5
+# Jobs still running after this long are given up on
+JOB_TIMEOUT_SECONDS = float(os.getenv("HARMONY_JOB_TIMEOUT", 3600))
+# Threads for job submission and for handling finished jobs (download/processing)
+MAX_WORKERS = int(os.getenv("HARMONY_MAX_WORKERS", 4))
+
+SUCCESSFUL = {'successful', 'complete_with_errors'}
+FAILED = {'failed', 'canceled'}
+# Paused jobs are resumed and kept polling (Harmony pauses large jobs until resumed)
+PAUSED = 'paused'
+
+
+def _submit(client, key, request):
+    job_id = client.submit(request)
+    print(f"Harmony job submitted for {key}: {job_id}")
+    return job_id
+
+
+def _resume(client, key, job_id):
+    try:
+        client.resume(job_id)
+        print(f"▶️  Resumed paused Harmony job for {key}")
+    except Exception as e:
+        print(f"⚠️  Could not resume Harmony job for {key}, polling until it resumes: {e}")
+
+
+def download_session(client):
+    """Authenticated requests session for downloading the outputs of client's jobs
+
+    harmony-py only downloads whole files (Client.download), so the resumable
+    ranged downloads of granule_cache need a session of their own: this is
+    built with harmony's public create_session from the client's config and
+    credentials, and handles the Earthdata login redirects like the client's.
+    """
+    from harmony.auth import create_session
+    return create_session(client.config, auth=client.auth, token=client.token)
+
+
+def run_jobs(client, requests, on_complete, workers=MAX_WORKERS, timeout=JOB_TIMEOUT_SECONDS,
+             while_running=None):
+    """Submit Harmony requests concurrently and handle each job as soon as it finishes
+
+    requests maps a key (e.g. granule name) to a harmony Request. Jobs are
+    polled with per-job exponential backoff; when one succeeds,
+    on_complete(key, urls) runs on a worker thread while the others keep
+    processing, so total latency follows the slowest job rather than the sum.
+    while_running() (e.g. processing already cached inputs) runs on a worker
+    thread once every job has been submitted, overlapping with the jobs; its
+    exceptions propagate after all jobs are handled.
+
+    Returns {key: {'job_id', 'status', 'result', 'error', 'seconds'}}.
+    """
+    started = time.monotonic()
+    outcomes = {key: {'job_id': None, 'status': None, 'result': None, 'error': None, 'seconds': None}
+                for key in requests}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        submissions = {key: pool.submit(_submit, client, key, request) for key, request in requests.items()}
+
+        # (next poll time, key, current interval)
+        schedule = []
+        for key, future in submissions.items():
+            try:
+                outcomes[key]['job_id'] = future.result()
+                heapq.heappush(schedule, (time.monotonic() + POLL_INITIAL_SECONDS, key, POLL_INITIAL_SECONDS))
+            except Exception as e:
+                outcomes[key].update(status='submit_failed', error=e)
+                print(f"⚠️  Harmony submission failed for {key}: {e}")
+
+        background = pool.submit(while_running) if while_running is not None else None
+        handlers = {}
+        resumed = set()
+        while schedule:
+            due, key, interval = heapq.heappop(schedule)
+            time.sleep(max(0.0, due - time.monotonic()))
+            outcome = outcomes[key]
+            try:
+                status = client.status(outcome['job_id'])
+            except Exception as e:
+                # Transient status errors are retried on the normal schedule
+                print(f"⚠️  Harmony status check failed for {key}: {e}")
+                status = {'status': 'unknown', 'progress': None}
+            outcome['status'] = status['status']
+
+            if status['status'] in SUCCESSFUL:
+                outcome['seconds'] = time.monotonic() - started
+                print(f"✅ Harmony job for {key} finished after {outcome['seconds']:.0f}s")
+                try:
+                    # The job is already known to be done; skip the client's own blocking wait
+                    urls = list(client.result_urls(outcome['job_id'], allow_incomplete=True))
+                except Exception as e:
+                    outcome['error'] = e
+                    print(f"⚠️  Could not list Harmony outputs for {key}: {e}")
+                    continue
+                handlers[key] = pool.submit(on_complete, key, urls)
+            elif status['status'] in FAILED:
+                outcome['error'] = RuntimeError(status.get('message') or status['status'])
+                print(f"⚠️  Harmony job for {key} ended as {status['status']}: {status.get('message')}")
+            elif status['status'] == PAUSED and key not in resumed:
+                resumed.add(key)
+                _resume(client, key, outcome['job_id'])
+                heapq.heappush(schedule, (time.monotonic() + POLL_INITIAL_SECONDS, key, POLL_INITIAL_SECONDS))
+            elif time.monotonic() - started > timeout:
+                outcome.update(status='timeout', error=TimeoutError(f"Harmony job for {key} still {status['status']}"))
+                print(f"⚠️  Giving up on Harmony job for {key} after {timeout:.0f}s")
+            else:
+                next_interval = min(interval * POLL_BACKOFF, POLL_MAX_SECONDS)
+                heapq.heappush(schedule, (time.monotonic() + interval, key, next_interval))
+
+        for key, handler in handlers.items():
+            try:
+                outcomes[key]['result'] = handler.result()
+            except Exception as e:
+                outcomes[key]['error'] = e
+                print(f"⚠️  Handling Harmony output for {key} failed: {e}")
+        if background is not None:
+            background.result()
+
+    return outcomes
@@ -0,0 +1,79 @@
+import datetime as dt
+
+import serialization
+
+
+def store_records(records, key, table, id_column, columns, label, redis_client=None, db_conn=None, ttl=None):
+    """Store records as a keyed table in Redis (hash) and PostgreSQL (one row per record id)
+
+    The Redis hash key is replaced as a whole, so ids missing from records
+    disappear. columns maps extra table columns (filled from the record field
+    of the same name) to their SQL type, besides the id, data and updated_at.
+    """
+    if redis_client is not None:
+        try:
+            pipe = redis_client.pipeline()
+            pipe.delete(key)
+            pipe.hset(key, mapping={r['id']: serialization.dumps(r) for r in records})
+            if ttl:
+                pipe.expire(key, ttl)
+            pipe.execute()
+            print(f"✅ Cached {len(records):,} {label} in Redis hash '{key}'")
+        except Exception as e:
+            print(f"⚠️  Redis {label} caching failed: {e}")
+
+    if db_conn is not None:
+        # Imported here so the API, which only reads records, does not load it at startup
+        from psycopg2.extras import execute_values
+        names = list(columns)
+        try:
+            cursor = db_conn.cursor()
+            definitions = ''.join(f"{name} {sql_type}, " for name, sql_type in columns.items())
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {id_column} TEXT PRIMARY KEY, {definitions}
+                    data JSONB,
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            updated_at = dt.datetime.now(dt.timezone.utc)
+            updates = ''.join(f"{name} = EXCLUDED.{name}, " for name in names)
+            execute_values(cursor, f"""
+                INSERT INTO {table} ({id_column}, {''.join(name + ', ' for name in names)}data, updated_at)
+                VALUES %s
+                ON CONFLICT ({id_column}) DO UPDATE SET {updates}
+                    data = EXCLUDED.data,
+                    updated_at = EXCLUDED.updated_at
+            """, [(r['id'], *(r[name] for name in names), serialization.dumps(r).decode(), updated_at)
+                  for r in records])
+            db_conn.commit()
+            cursor.close()
+            print(f"✅ Stored {len(records):,} {label} in PostgreSQL")
+        except Exception as e:
+            db_conn.rollback()
+            print(f"⚠️  PostgreSQL {label} storage failed: {e}")
+
+
+def get_records(ids, key, table, id_column, label, redis_client=None, db_conn=None):
+    """Look up records by id: Redis hash first, PostgreSQL for any misses
+
+    Records are returned as serialized JSON bytes keyed by id, so Redis hits
+    can go straight into a response without a decode/encode round trip.
+    """
+    found = {}
+    if redis_client is not None:
+        try:
+            for record_id, value in zip(ids, redis_client.hmget(key, ids)):
+                if value:
+                    found[record_id] = value
+        except Exception as e:
+            print(f"⚠️  Redis {label} lookup failed: {e}")
+
+    missing = [record_id for record_id in ids if record_id not in found]
+    if missing and db_conn is not None:
+        cursor = db_conn.cursor()
+        cursor.execute(f"SELECT {id_column}, data FROM {table} WHERE {id_column} = ANY(%s)", (missing,))
+        for record_id, data in cursor.fetchall():
+            found[record_id] = serialization.dumps(data)
+        cursor.close()
+    return found
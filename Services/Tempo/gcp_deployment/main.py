@@ -1,6 +1,6 @@
 import os
+import threading
 import datetime as dt
-import json
 import redis
 import psycopg2
 from psycopg2.extras import Json
@@ -9,6 +9,39 @@ import xarray as xr
 from harmony import BBox, Client, Collection, Request
 from harmony.config import Environment
 
+import aqi_cache
+import alerts
+import aqi_storage
+import batch_pipeline
+import category_polygons
+import composite
+import granule_cache
+import granule_delta
+import granule_snapshot
+import feature_store
+import harmony_jobs
+import h3_aggregate
+import grid_kernels
+import places
+import raw_store
+from aqi_categories import AQI_DTYPE, AQI_INVALID, CATEGORIES
+from sparse_granule import build_sparse_granule
+import serialization
+import zonal_stats
+
+# Commands sent per Redis pipeline round trip
+REDIS_BATCH_SIZE = 5000
+
+# Granules processed per run (comma separated); each becomes its own Harmony job
+TEMPO_GRANULES = [name.strip() for name in os.getenv(
+    "TEMPO_GRANULES", "TEMPO_NO2_L3_V04_20251003T193122Z_S010.nc").split(',') if name.strip()]
+# Harmony environment: PROD, or LOCAL for fake_harmony.py (served on localhost:3000)
+HARMONY_ENV = os.getenv("HARMONY_ENV", "PROD").upper()
+
+def _json_dumps(obj):
+    """JSON encoder for psycopg2 Json adapters"""
+    return serialization.dumps(obj).decode()
+
 def get_db_connection():
     """Connect to PostgreSQL"""
     return psycopg2.connect(
@@ -27,9 +60,43 @@ def get_redis_client():
         password=os.getenv("REDIS_PASSWORD")
     )
 
-def download_tempo_data():
-    """Download latest TEMPO data from NASA Harmony API"""
-    print("Downloading latest TEMPO data from NASA...")
+def tempo_request(granule_name):
+    """Harmony request for one TEMPO NO2 granule"""
+    return Request(
+        collection=Collection(id="C3685896708-LARC_CLOUD"),
+        granule_name=[granule_name],
+    )
+
+def fetch_tempo_granules(granule_names, on_ready):
+    """Get TEMPO granules and call on_ready(granule_name, path) as soon as each one is on disk
+
+    The missing granules are requested from NASA Harmony as concurrent jobs
+    first; granules already in the local cache are then handed over while those
+    jobs run, and each job's granule is downloaded and handed over when it
+    completes. Returns per-granule outcomes
+    ({'status', 'result', 'error', ...}).
+    """
+    outcomes = {}
+    cached = {}
+    missing = []
+    for granule_name in granule_names:
+        # Reruns and reprocessing read the granule from the local cache instead of Harmony
+        cached_path = granule_cache.lookup(granule_name)
+        if cached_path:
+            print(f"✅ Using cached granule {granule_name}: {cached_path}")
+            cached[granule_name] = cached_path
+        else:
+            missing.append(granule_name)
+
+    def process_cached():
+        for granule_name, cached_path in cached.items():
+            outcomes[granule_name] = {'status': 'cached', 'result': on_ready(granule_name, cached_path), 'error': None}
+
+    if not missing:
+        process_cached()
+        return outcomes
+
+    print(f"Downloading {len(missing)} TEMPO granules from NASA...")
 
     # Get Earthdata credentials from environment
     username = os.getenv("EARTHDATA_USERNAME")
@@ -41,33 +108,26 @@ def download_tempo_data():
     print(f"Using Earthdata credentials for user: {username}")
 
     # Initialize Harmony client
-    harmony_client = Client(env=Environment.PROD, auth=(username, password))
-
-    # Request latest TEMPO NO2 data - get the most recent available
-    # For now, we'll use a recent known good granule. In production, you'd query for the latest.
-    request = Request(
-        collection=Collection(id="C3685896708-LARC_CLOUD"),
-        granule_name=["TEMPO_NO2_L3_V04_20251003T193122Z_S010.nc"],
-    )
-
-    if not request.is_valid():
-        raise ValueError("Invalid Harmony request")
+    harmony_client = Client(env=Environment[HARMONY_ENV], auth=(username, password))
 
-    print("Submitting Harmony request...")
-    job_id = harmony_client.submit(request)
-    print(f"Harmony job submitted: {job_id}")
+    requests = {}
+    for granule_name in missing:
+        request = tempo_request(granule_name)
+        if not request.is_valid():
+            raise ValueError(f"Invalid Harmony request for {granule_name}")
+        requests[granule_name] = request
 
-    print("Waiting for processing to complete...")
-    harmony_client.wait_for_processing(job_id, show_progress=True)
+    session = harmony_jobs.download_session(harmony_client)
 
-    # Download results
-    results = list(harmony_client.download_all(job_id, directory="/tmp"))
-    print(f"Downloaded {len(results)} files")
+    def on_complete(granule_name, urls):
+        if not urls:
+            raise ValueError(f"No files produced by Harmony for {granule_name}")
+        # Resumable, parallel-range download into the cache
+        return on_ready(granule_name, granule_cache.fetch(granule_name, urls[0], session))
 
-    if not results:
-        raise ValueError("No files downloaded from Harmony")
-
-    return results[0].result()  # Return path to downloaded file
+    # Cached granules are processed while the jobs for the missing ones run
+    outcomes.update(harmony_jobs.run_jobs(harmony_client, requests, on_complete, while_running=process_cached))
+    return outcomes
 
 def extract_key_tempo_data(datatree, region_filter=None):
     """Extract only the data important for SkyAware AQI processing
@@ -143,77 +203,33 @@ def extract_key_tempo_data(datatree, region_filter=None):
         'pbl_height': pbl_height
     }
 
-def calculate_aqi_from_tempo(key_data):
-    """Convert TEMPO NO2 data to EPA AQI - Memory optimized version"""
-    print("Converting TEMPO NO2 to EPA AQI (memory optimized)...")
-
-    no2_data = key_data['no2_concentration']  # molecules/cm²
-    quality_flag = key_data['quality_flag']
-
-    # EPA breakpoints for NO2 (ppb to AQI)
-    breakpoints = [
-        (0, 53, 0, 50),           # Good
-        (54, 100, 51, 100),       # Moderate
-        (101, 360, 101, 150),     # Unhealthy for Sensitive
-        (361, 649, 151, 200),     # Unhealthy
-        (650, 1249, 201, 300),    # Very Unhealthy
-        (1250, 1649, 301, 400),   # Hazardous
-        (1650, 2049, 401, 500),   # Hazardous
-    ]
-
-    # Constants for conversion
-    AVOGADRO = 6.022e23
-    atmospheric_factor = 1e12  # Conservative factor for molecules/cm² to ppb
+def calculate_aqi_from_tempo(key_data, conversion=None):
+    """Convert TEMPO NO2 data to EPA AQI - Memory optimized version
 
-    # Get valid data mask
-    valid_mask = (~np.isnan(no2_data.values)) & (quality_flag.values == 0)
-    print(f"Valid data points: {valid_mask.sum():,}")
-
-    # Use vectorized operations instead of nested loops for better memory efficiency
-    no2_values = no2_data.values
-
-    # Initialize AQI grid
-    aqi_grid = np.full_like(no2_values, np.nan, dtype=np.float32)  # Use float32 to save memory
-
-    # Handle negative/zero values first
-    negative_mask = (no2_values <= 0) & valid_mask
-    aqi_grid[negative_mask] = 0
-
-    # Process positive values using vectorized operations
-    positive_mask = (no2_values > 0) & valid_mask
-
-    if positive_mask.sum() > 0:
-        print(f"Processing {positive_mask.sum():,} positive NO2 values...")
-
-        # Convert to ppb using vectorized operations
-        molecules_cm2 = no2_values[positive_mask]
-        mol_cm2 = molecules_cm2 / AVOGADRO
-        ppb_values = mol_cm2 * atmospheric_factor
-
-        # Convert to integer concentrations for AQI calculation
-        conc_values = np.clip(ppb_values.astype(int), 0, 2050)
-
-        # Vectorized AQI calculation using numpy operations
-        aqi_values = np.zeros_like(conc_values, dtype=float)
-
-        # Apply EPA breakpoints using vectorized conditions
-        for bp_lo, bp_hi, aqi_lo, aqi_hi in breakpoints:
-            mask = (conc_values >= bp_lo) & (conc_values <= bp_hi)
-            if mask.sum() > 0:
-                aqi_values[mask] = ((aqi_hi - aqi_lo) / (bp_hi - bp_lo)) * (conc_values[mask] - bp_lo) + aqi_lo
+    conversion is a grid_kernels.load_conversion config (default: the pipeline's CONVERSION)
+    """
+    conversion = conversion or grid_kernels.CONVERSION
+    print(f"Converting TEMPO NO2 to EPA AQI (memory optimized, conversion {conversion['id']})...")
 
-        # Handle values above maximum breakpoint
-        high_mask = conc_values > 2049
-        aqi_values[high_mask] = 500
+    no2_values = key_data['no2_concentration'].values  # molecules/cm²
+    quality_values = key_data['quality_flag'].values
 
-        # Round and clip to valid range
-        aqi_values = np.round(np.clip(aqi_values, 0, 500))
+    # Initialize AQI grid: uint16 with a sentinel for invalid pixels (AQI is an integer 0-500)
+    aqi_grid = np.full(no2_values.shape, AQI_INVALID, dtype=AQI_DTYPE)
 
-        # Assign back to grid
-        aqi_grid[positive_mask] = aqi_values
+    # Row blocks are converted concurrently; each writes its own slice of the grid
+    block_counts = grid_kernels.map_row_blocks(
+        lambda start, end: grid_kernels.aqi_block(no2_values[start:end], quality_values[start:end], aqi_grid[start:end], conversion),
+        no2_values.shape[0]
+    )
+    valid_count = sum(valid for valid, _ in block_counts)
+    positive_count = sum(positive for _, positive in block_counts)
+    print(f"Valid data points: {valid_count:,}")
+    print(f"Processed {positive_count:,} positive NO2 values "
+          f"({grid_kernels.GRID_WORKERS} workers, {grid_kernels.ACTIVE_KERNEL} kernel)")
 
     # Count results
-    valid_aqi = aqi_grid[~np.isnan(aqi_grid)]
+    valid_aqi = aqi_grid[aqi_grid != AQI_INVALID]
     if len(valid_aqi) > 0:
         print(f"✅ AQI calculation complete!")
         print(f"   Valid AQI points: {len(valid_aqi):,}")
@@ -222,80 +238,35 @@ def calculate_aqi_from_tempo(key_data):
 
     return aqi_grid
 
-def get_aqi_category(aqi_value):
-    """Get AQI category and color"""
-    if aqi_value <= 50:
-        return "Good", "#00E400"
-    elif aqi_value <= 100:
-        return "Moderate", "#FFFF00"
-    elif aqi_value <= 150:
-        return "Unhealthy for Sensitive Groups", "#FF7E00"
-    elif aqi_value <= 200:
-        return "Unhealthy", "#FF0000"
-    elif aqi_value <= 300:
-        return "Very Unhealthy", "#8F3F97"
-    else:
-        return "Hazardous", "#7E0023"
+def extract_data_points(sparse, timestamp, chunk_size=5000):
+    """Extract data points from the sparse granule, yielding one batch (list) per chunk
 
-def extract_data_points(key_data, aqi_grid, chunk_size=5000, progressive_storage=False, db_conn=None):
-    """Extract data points from TEMPO arrays - Memory efficient chunked processing
-    
     Args:
-        key_data: Dictionary with TEMPO data arrays
-        aqi_grid: Calculated AQI values
-        chunk_size: Number of points to process per chunk
-        progressive_storage: If True, stores data to DB incrementally
-        db_conn: Database connection for progressive storage
+        sparse: Sparse granule from build_sparse_granule (valid pixels only)
+        timestamp: Run timestamp stored on every point (and used as the tempo_aqi row key)
+        chunk_size: Number of points per batch
     """
-    print("Extracting data points from TEMPO arrays (chunked processing)...")
-
-    lat_data = key_data['latitude']
-    lon_data = key_data['longitude']
-    no2_data = key_data['no2_concentration']
-    quality_flag = key_data['quality_flag']
-
-    # Create valid data mask
-    valid_mask = (~np.isnan(aqi_grid)) & (quality_flag.values == 0) & (~np.isnan(no2_data.values))
-    total_valid = valid_mask.sum()
-    print(f"Extracting {total_valid:,} valid data points...")
-
-    # Initialize data collection
-    processed_data = []
-    timestamp = dt.datetime.now(dt.timezone.utc).isoformat()
-
-    # Create coordinate grids - TEMPO has 1D lat/lon arrays that need meshgrid
-    # meshgrid(lon, lat) creates proper 2D grids
-    lon_grid, lat_grid = np.meshgrid(lon_data.values, lat_data.values)
-
-    # Flatten arrays for easier processing
-    lat_flat = lat_grid.flatten()
-    lon_flat = lon_grid.flatten()
-    aqi_flat = aqi_grid.flatten()
-    no2_flat = no2_data.values.flatten()
-    valid_flat = valid_mask.flatten()
-
-    # Process only valid points in chunks
-    valid_indices = np.where(valid_flat)[0]
-    
-    # For progressive storage
-    total_stored = 0
-    cursor = None
-    if progressive_storage and db_conn:
-        cursor = db_conn.cursor()
-
-    for start_idx in range(0, len(valid_indices), chunk_size):
-        end_idx = min(start_idx + chunk_size, len(valid_indices))
-        chunk_indices = valid_indices[start_idx:end_idx]
-        
-        chunk_data = []
-        for idx in chunk_indices:
-            lat = float(lat_flat[idx])
-            lon = float(lon_flat[idx])
-            aqi = float(aqi_flat[idx])
-            no2_conc = float(no2_flat[idx])
+    total_valid = len(sparse['index'])
+    print(f"Extracting {total_valid:,} valid data points from sparse granule...")
+
+    lat_axis = sparse['latitude']
+    lon_axis = sparse['longitude']
+
+    for start_idx in range(0, total_valid, chunk_size):
+        end_idx = min(start_idx + chunk_size, total_valid)
+
+        # Categories travel as uint8 codes; names/colours are added at the API edge
+        chunk_columns = zip(
+            lat_axis[sparse['rows'][start_idx:end_idx]].tolist(),
+            lon_axis[sparse['cols'][start_idx:end_idx]].tolist(),
+            sparse['aqi'][start_idx:end_idx].tolist(),
+            sparse['no2'][start_idx:end_idx].tolist(),
+            sparse['category'][start_idx:end_idx].tolist()
+        )
 
+        chunk_data = []
+        for lat, lon, aqi, no2_conc, category in chunk_columns:
             location = f"TEMPO_{lat:.4f}_{lon:.4f}"
-            category = get_aqi_category(aqi)
 
             data_point = {
                 'timestamp': timestamp,
@@ -308,46 +279,135 @@ def extract_data_points(key_data, aqi_grid, chunk_size=5000, progressive_storage
             }
 
             chunk_data.append(data_point)
-        
-        # Store chunk progressively if enabled
-        if progressive_storage and cursor:
-            try:
-                # Insert or update this chunk
-                cursor.execute("""
-                    INSERT INTO tempo_aqi (timestamp, data)
-                    VALUES (%s, %s)
-                    ON CONFLICT (timestamp) DO UPDATE SET
-                        data = tempo_aqi.data || EXCLUDED.data
-                """, (timestamp, Json(chunk_data)))
-                db_conn.commit()
-                total_stored += len(chunk_data)
-                print(f"  💾 Stored chunk: {total_stored:,} of {total_valid:,} points ({100*total_stored/total_valid:.1f}%)")
-            except Exception as e:
-                print(f"  ⚠️  Warning: Failed to store chunk: {e}")
-        
-        processed_data.extend(chunk_data)
 
-    if cursor:
-        cursor.close()
+        yield chunk_data
+
+def postgres_sink(conn, timestamp, total_points):
+    """Sink storing batches progressively in tempo_aqi (one row per run, appended per chunk)"""
+    cursor = conn.cursor()
+    stored = 0
+    failed_batches = []
+
+    def insert(points):
+        cursor.execute("""
+            INSERT INTO tempo_aqi (timestamp, data)
+            VALUES (%s, %s)
+            ON CONFLICT (timestamp) DO UPDATE SET
+                data = tempo_aqi.data || EXCLUDED.data
+        """, (timestamp, Json(points, dumps=_json_dumps)))
+        conn.commit()
+
+    def handle(batch):
+        nonlocal stored
+        try:
+            insert(batch)
+            stored += len(batch)
+            print(f"  💾 Stored chunk: {stored:,} of {total_points:,} points ({100*stored/total_points:.1f}%)")
+        except Exception as e:
+            conn.rollback()
+            failed_batches.append(batch)
+            print(f"  ⚠️  Warning: Failed to store chunk: {e}")
+
+    def finish():
+        nonlocal stored
+        try:
+            # Retry chunks that failed so the row ends up complete
+            if failed_batches:
+                print(f"Retrying {len(failed_batches)} failed chunks...")
+                retry = [point for batch in failed_batches for point in batch]
+                try:
+                    insert(retry)
+                except Exception:
+                    conn.rollback()
+                    raise
+                stored += len(retry)
+        finally:
+            cursor.close()
+            conn.close()
+        print(f"✅ Progressive storage: Stored {stored:,} points to database")
+        return stored
+
+    return batch_pipeline.Sink('postgres', handle, finish)
+
+def redis_sink(redis_client, sparse, version, delta=None):
+    """Sink caching individual locations for location-based queries (pipelined per batch)
+
+    With a delta from granule_delta.plan_delta only cells whose AQI changed are
+    written and removed cells are deleted; without one every location is
+    rewritten and keys of cells that are no longer valid are cleaned up.
+    Location keys carry no TTL: they mirror the granule named by
+    LOCATIONS_VERSION_KEY, which is cleared while they are being updated.
+    The sink's result is (written, update notice), see announce_update.
+    """
+    previous_version, changed, removed = delta if delta is not None else (None, None, None)
+    written = 0
+    offset = 0
+    changed_points = []
+
+    def handle(batch):
+        nonlocal written, offset
+        if offset == 0:
+            redis_client.delete(granule_delta.LOCATIONS_VERSION_KEY)
+        if changed is not None:
+            batch_changed = changed[offset:offset + len(batch)]
+            offset += len(batch)
+            batch = [batch[i] for i in np.flatnonzero(batch_changed)]
+            changed_points.extend(batch)
+        else:
+            offset += len(batch)
+
+        pipe = redis_client.pipeline(transaction=False)
+        for i, data_point in enumerate(batch, 1):
+            location_key = granule_delta.location_key(data_point['latitude'], data_point['longitude'])
+            pipe.set(location_key, serialization.dumps(data_point))
+            if i % REDIS_BATCH_SIZE == 0:
+                pipe.execute()
+        pipe.execute()
+        written += len(batch)
+
+    def finish():
+        if offset < len(sparse['index']):
+            # The producer failed partway: leave the version unset rather than publish partial locations
+            print(f"⚠️  Redis location caching stopped after {written:,} locations, version not published")
+            return written, None
+        if removed is not None:
+            removed_keys = granule_delta.removed_location_keys(sparse, removed)
+        else:
+            removed_keys = list(granule_delta.orphan_location_keys(redis_client, sparse))
+        for start in range(0, len(removed_keys), REDIS_BATCH_SIZE):
+            redis_client.delete(*removed_keys[start:start + REDIS_BATCH_SIZE])
 
-    print(f"✅ Data extraction complete! Processed {len(processed_data):,} points")
-    if progressive_storage:
-        print(f"✅ Progressive storage: Stored {total_stored:,} points to database")
-    return processed_data
+        redis_client.set(granule_delta.LOCATIONS_VERSION_KEY, version)
+        notice = granule_delta.store_delta(redis_client, version, previous_version, changed_points, removed_keys,
+                                           ttl=aqi_cache.STALE_SECONDS)
+        mode = "delta" if delta is not None else "full rewrite"
+        print(f"✅ Cached {written:,} locations in Redis ({mode}, {len(removed_keys):,} removed)")
+        return written, notice
 
-def create_geojson_from_tempo(key_data, aqi_grid, chunk_size=1000):
-    """Create GeoJSON from TEMPO data - Memory optimized with chunking"""
-    print("Creating GeoJSON from TEMPO data (chunked processing)...")
+    return batch_pipeline.Sink('redis', handle, finish)
 
-    lat_data = key_data['latitude']
-    lon_data = key_data['longitude']
-    quality_flag = key_data['quality_flag']
+def announce_update(redis_client, results, version):
+    """Push the new version to streaming clients (/aqi-stream) once everything it names is readable
 
-    # Create valid data mask
-    valid_mask = (~np.isnan(aqi_grid)) & (quality_flag.values == 0)
-    total_valid = valid_mask.sum()
-    print(f"Creating GeoJSON for {total_valid:,} valid data points...")
+    Announces the delta stored by the Redis sink, or a full update when the
+    sink did not run, so clients reload instead of missing the version.
+    """
+    if redis_client is None:
+        return
+    redis_result = results.get('redis')
+    if redis_result is not None and redis_result['error'] is None:
+        notice = redis_result['result'][1]
+    else:
+        notice = {'version': str(version), 'previous_version': None, 'full': True,
+                  'changed': 0, 'removed': 0, 'delta_key': None}
+    try:
+        receivers = granule_delta.announce(redis_client, notice)
+        print(f"📣 Announced version {notice['version']} to {receivers} stream subscriber(s)")
+    except Exception as e:
+        print(f"⚠️  Update announcement failed: {e}")
 
+def geojson_sink(total_points):
+    """Sink building the GeoJSON representation from the extracted points"""
     # Initialize GeoJSON structure
     geojson = {
         "type": "FeatureCollection",
@@ -357,63 +417,46 @@ def create_geojson_from_tempo(key_data, aqi_grid, chunk_size=1000):
             "parameter": "NO2 Air Quality Index",
             "units": "AQI",
             "timestamp": dt.datetime.now().isoformat(),
-            "total_points": int(total_valid)
+            "total_points": int(total_points),
+            # Feature categories are codes into this table
+            "categories": [list(category) for category in CATEGORIES]
         }
     }
 
-    # Process in chunks to avoid memory issues
-    features_added = 0
-    chunk_count = 0
-
-    # Create coordinate grids - TEMPO has 1D lat/lon arrays that need meshgrid
-    # meshgrid(lon, lat) creates proper 2D grids
-    lon_grid, lat_grid = np.meshgrid(lon_data.values, lat_data.values)
-
-    # Flatten coordinates and data for easier chunking
-    lat_flat = lat_grid.flatten()
-    lon_flat = lon_grid.flatten()
-    aqi_flat = aqi_grid.flatten()
-    valid_flat = valid_mask.flatten()
-
-    # Process only valid points
-    valid_indices = np.where(valid_flat)[0]
-
-    for start_idx in range(0, len(valid_indices), chunk_size):
-        chunk_count += 1
-        end_idx = min(start_idx + chunk_size, len(valid_indices))
-        chunk_indices = valid_indices[start_idx:end_idx]
-
-        print(f"Processing chunk {chunk_count}: points {start_idx}-{end_idx-1} of {len(valid_indices)}")
-
-        # Process chunk
-        for idx in chunk_indices:
-            lat = float(lat_flat[idx])
-            lon = float(lon_flat[idx])
-            aqi = float(aqi_flat[idx])
-
-            # Create GeoJSON feature
-            feature = {
+    def handle(batch):
+        for data_point in batch:
+            geojson["features"].append({
                 "type": "Feature",
                 "geometry": {
                     "type": "Point",
-                    "coordinates": [lon, lat]
+                    "coordinates": [data_point['longitude'], data_point['latitude']]
                 },
                 "properties": {
-                    "aqi": aqi,
-                    "category": get_aqi_category(aqi)
+                    "aqi": data_point['aqi'],
+                    "category": data_point['category']
                 }
-            }
+            })
+
+    def finish():
+        print(f"✅ GeoJSON creation complete! Features created: {len(geojson['features']):,}")
+        return geojson
 
-            geojson["features"].append(feature)
-            features_added += 1
+    return batch_pipeline.Sink('geojson', handle, finish)
 
-    print(f"✅ GeoJSON creation complete!")
-    print(f"   Features created: {features_added:,}")
-    print(f"   Chunks processed: {chunk_count}")
+def api_snapshot_sink():
+    """Sink keeping the leading points served by the API snapshot, plus the total count"""
+    data_points = []
+    total = 0
 
-    return geojson
+    def handle(batch):
+        nonlocal total
+        if len(data_points) < aqi_cache.API_POINTS:
+            data_points.extend(batch[:aqi_cache.API_POINTS - len(data_points)])
+        total += len(batch)
 
-def cache_latest_aqi_data(data_points, timestamp):
+    return batch_pipeline.Sink('api-snapshot', handle, lambda: (data_points, total))
+
+def cache_latest_aqi_data(data_points, timestamp, total_points=None):
     """Cache the latest AQI data in Redis for fast API access"""
     try:
         import redis
@@ -436,34 +479,96 @@ def cache_latest_aqi_data(data_points, timestamp):
         redis_client.ping()
         print("✅ Redis connection successful!")
         
-        # Create a simplified cache structure for fast access
-        cache_data = {
-            'timestamp': timestamp.isoformat() if hasattr(timestamp, 'isoformat') else str(timestamp),
-            'total_points': len(data_points),
-            'data_points': data_points[:10000]  # Cache first 10k points for API
-        }
-        
-        # Store with 2 hour expiration (data updates hourly)
-        redis_client.setex(
-            'latest_aqi_data',
-            7200,  # 2 hours in seconds
-            json.dumps(cache_data)
-        )
-        print(f"✅ Cached {len(data_points)} AQI points in Redis (10k available for API)")
+        # Store the API snapshot; it is served as stale (and refreshed from the
+        # database) rather than dropped if the next hourly run is late
+        aqi_cache.write_snapshot(redis_client, data_points, timestamp, total_points=total_points)
+        print(f"✅ Cached {len(data_points)} AQI points in Redis ({aqi_cache.API_POINTS // 1000}k available for API)")
         return True
     except Exception as e:
         print(f"⚠️  Redis caching failed: {e}")
         return False
 
-def process_tempo_data():
-    """Main pipeline function - downloads and processes real TEMPO data"""
-    print("Starting TEMPO data processing pipeline...")
+def is_newer_than_served(granule_timestamp):
+    """True unless the currently served granule is newer (reruns of the served granule count as newer)"""
+    served = granule_snapshot.current(refresh=True)
+    if served is None:
+        return True
+    return raw_store.granule_time(granule_timestamp) >= raw_store.granule_time(served.meta['granule_time'])
+
+def serve_granule(sparse, key_data, redis_client, results):
+    """Publish a processed granule as the served one: places, zones, alerts, snapshots, polygons, API cache"""
+    api_points, extracted_count = results['api-snapshot']['result']
+
+    # Precompute named-place AQI so the hottest queries become single key reads
+    print("📍 Precomputing AQI for named places...")
+    try:
+        place_records = places.compute_place_aqi(sparse, places.load_gazetteer())
+        conn = get_db_connection()
+        places.store_place_aqi(place_records, redis_client=redis_client, db_conn=conn,
+                               ttl=aqi_cache.STALE_SECONDS)
+        conn.close()
+    except Exception as e:
+        print(f"⚠️  Skipping place AQI precomputation: {e}")
 
+    # Zonal statistics for the boundary polygons (states, counties, ...)
+    zone_records = None
+    if os.path.exists(zonal_stats.ZONES_PATH):
+        print("🗺️  Computing zonal statistics...")
+        try:
+            zones = zonal_stats.load_zones()
+            labels = zonal_stats.label_rasters(zones, sparse['latitude'], sparse['longitude'])
+            zone_records = zonal_stats.compute_zone_stats(sparse, zones, labels)
+            conn = get_db_connection()
+            zonal_stats.store_zone_stats(zone_records, redis_client=redis_client, db_conn=conn,
+                                         ttl=aqi_cache.STALE_SECONDS)
+            conn.close()
+        except Exception as e:
+            print(f"⚠️  Skipping zonal statistics: {e}")
+
+    # Alerts are evaluated against the previous snapshot, so before it is replaced
+    if redis_client is not None:
+        print("🔔 Evaluating alert subscriptions...")
+        try:
+            conn = get_db_connection()
+            alerts.evaluate(sparse, granule_snapshot.current(), key_data['timestamp'], conn, redis_client,
+                            zone_records=zone_records)
+            conn.close()
+        except Exception as e:
+            print(f"⚠️  Alert evaluation failed: {e}")
+
+    # Publish the memory-mappable granule snapshot shared by all API workers
     try:
-        # Download latest TEMPO data
-        tempo_file = download_tempo_data()
-        print(f"Downloaded TEMPO data: {tempo_file}")
+        granule_snapshot.publish_granule(sparse, key_data['timestamp'])
+    except Exception as e:
+        print(f"⚠️  Snapshot publishing failed: {e}")
 
+    # Hexagonal aggregates at several H3 resolutions, for the map and /aqi-hex
+    try:
+        h3_aggregate.publish(sparse, key_data['timestamp'])
+    except Exception as e:
+        print(f"⚠️  H3 aggregation failed: {e}")
+
+    # Simplified category polygons, a compact vector layer for the map and /aqi-contours
+    print("🗺️  Extracting AQI category polygons...")
+    try:
+        contours = category_polygons.build_contours(sparse)
+        conn = get_db_connection()
+        category_polygons.store_contours(contours, redis_client=redis_client, db_conn=conn,
+                                         ttl=aqi_cache.STALE_SECONDS)
+        conn.close()
+    except Exception as e:
+        print(f"⚠️  Category polygon extraction failed: {e}")
+
+    # Warm the API snapshot last so it never points at data that is not yet stored
+    print("📦 Warming API snapshot in Redis...")
+    cache_latest_aqi_data(api_points, key_data['timestamp'], total_points=extracted_count)
+    announce_update(redis_client, results, key_data['timestamp'])
+
+def process_tempo_file(tempo_file):
+    """Process one downloaded TEMPO granule into the database, caches and snapshot"""
+    print(f"Processing TEMPO data: {tempo_file}")
+
+    try:
         # Load and process the data
         datatree = xr.open_datatree(tempo_file)
         
@@ -481,85 +586,82 @@ def process_tempo_data():
         # Convert to AQI
         aqi_data = calculate_aqi_from_tempo(key_data)
 
-        # Get timestamp for database storage
+        # Build the valid-pixel representation once; every later stage reads it
+        sparse = build_sparse_granule(key_data, aqi_data)
+        del aqi_data
+
+        total_points = len(sparse['index'])
+        if not total_points:
+            raise ValueError("No valid data points could be processed from TEMPO data")
+
+        serving = is_newer_than_served(key_data['timestamp'])
+
+        # Get timestamp for database storage (also stamped on every data point)
         timestamp = dt.datetime.now(dt.timezone.utc).isoformat()
 
         # Setup database connection for progressive storage
         print("Setting up database connection...")
         conn = get_db_connection()
-        cursor = conn.cursor()
 
-        # Create table if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS tempo_aqi (
-                id SERIAL PRIMARY KEY,
-                timestamp TIMESTAMP WITH TIME ZONE UNIQUE,
-                data JSONB,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
+        # Create the partitioned table (or migrate a plain one) and upcoming partitions
+        aqi_storage.ensure_storage(conn)
 
-        # Extract data points with progressive storage (stores data in chunks as it processes)
-        print("🔄 Processing data with progressive storage enabled...")
-        processed_data = extract_data_points(key_data, aqi_data, chunk_size=5000, 
-                                            progressive_storage=True, db_conn=conn)
-
-        if not processed_data:
-            raise ValueError("No valid data points could be processed from TEMPO data")
-
-        print(f"Successfully processed {len(processed_data):,} data points from TEMPO")
-
-        # Final verification - ensure all data is in database
-        cursor.execute("SELECT COUNT(*) FROM tempo_aqi WHERE timestamp = %s", (timestamp,))
-        db_count = cursor.fetchone()[0]
-        if db_count == 0:
-            print("⚠️  No data found in progressive storage, inserting all at once...")
-            cursor.execute("""
-                INSERT INTO tempo_aqi (timestamp, data)
-                VALUES (%s, %s)
-                ON CONFLICT (timestamp) DO UPDATE SET
-                    data = EXCLUDED.data
-            """, (timestamp, Json(processed_data)))
-            conn.commit()
-        
-        cursor.close()
-        conn.close()
-        print(f"✅ Successfully stored {len(processed_data):,} data points in PostgreSQL")
-        
-        # Cache the latest data in Redis for fast API access
-        print("📦 Caching data in Redis for fast API access...")
-        if processed_data:
-            cache_latest_aqi_data(processed_data, key_data['timestamp'])
-        
-        # Create GeoJSON (optional - can be skipped if memory constrained)
-        print("Creating GeoJSON representation...")
+        # Cache latest data in Redis
         try:
-            geojson_data = create_geojson_from_tempo(key_data, aqi_data)
-            print("✅ GeoJSON created successfully")
+            redis_client = get_redis_client()
         except Exception as e:
-            print(f"⚠️  Skipping GeoJSON creation due to memory constraints: {e}")
+            print(f"⚠️  Redis unavailable, skipping location caching: {e}")
+            redis_client = None
+
+        # One extractor feeds every sink concurrently through bounded queues
+        print("🔄 Extracting and storing data (Postgres, Redis and GeoJSON sinks run concurrently)...")
+        sinks = [postgres_sink(conn, timestamp, total_points), geojson_sink(total_points), api_snapshot_sink()]
+        if redis_client is not None and serving:
+            # Only cells whose AQI changed since the previous published granule are rewritten
+            try:
+                delta = granule_delta.plan_delta(redis_client, sparse, granule_snapshot.current())
+            except Exception as e:
+                print(f"⚠️  Granule diff failed, rewriting all locations: {e}")
+                delta = None
+            sinks.append(redis_sink(redis_client, sparse, str(key_data['timestamp']), delta))
+        results = batch_pipeline.run_pipeline(extract_data_points(sparse, timestamp, chunk_size=5000), sinks)
 
-        # Cache latest data in Redis
-        print("Caching latest data in Redis...")
-        redis_client = get_redis_client()
+        # Postgres is the system of record; other sink failures only cost their own output
+        if results['postgres']['error'] is not None:
+            raise RuntimeError(f"PostgreSQL storage failed: {results['postgres']['error']}")
+        print(f"✅ Successfully stored {results['postgres']['result']:,} data points in PostgreSQL")
 
-        # Cache individual locations for location-based queries
-        for data_point in processed_data:
-            location_key = f"aqi_{data_point['latitude']:.4f}_{data_point['longitude']:.4f}"
-            redis_client.set(location_key, json.dumps(data_point), ex=3600)  # 1 hour expiry
+        # Keep the extracted variables so AQI can be recomputed (reprocess.py) without re-downloading
+        try:
+            raw_store.save(key_data, timestamp)
+        except Exception as e:
+            print(f"⚠️  Raw variable store failed: {e}")
 
-        # Cache the full dataset as latest
-        redis_client.set("latest_aqi_data", json.dumps({
-            "timestamp": timestamp,
-            "data": processed_data
-        }), ex=3600)
+        # Valid pixels with their support variables as training features (NO2, AQI, pressure, terrain, PBL)
+        try:
+            feature_store.append(key_data, sparse)
+        except Exception as e:
+            print(f"⚠️  Feature store append failed: {e}")
+        # Fold the granule into the rolling composite that fills its cloud and quality gaps
+        try:
+            composite.publish(sparse, key_data['timestamp'])
+        except Exception as e:
+            print(f"⚠️  Composite update failed: {e}")
 
-        print("✅ Successfully cached data in Redis")
+        # Only a granule at least as new as the served one replaces it; older ones
+        # (completing late) are kept in the history stores above only
+        if serving:
+            serve_granule(sparse, key_data, redis_client, results)
+        else:
+            print(f"⏭️  A newer granule is already served; {key_data['timestamp']} was only added to the history")
 
-        # Clean up downloaded file
-        os.remove(tempo_file)
-        print("🧹 Cleaned up temporary files")
+        # Downsample and drop raw partitions past the retention window
+        try:
+            conn = get_db_connection()
+            aqi_storage.apply_retention(conn)
+            conn.close()
+        except Exception as e:
+            print(f"⚠️  Retention step failed: {e}")
 
         print("🎉 TEMPO data processing pipeline completed successfully!")
         return True
@@ -570,5 +672,29 @@ def process_tempo_data():
         traceback.print_exc()
         return False
 
+def process_tempo_data():
+    """Main pipeline function - downloads and processes real TEMPO data"""
+    print("Starting TEMPO data processing pipeline...")
+
+    # Downloads overlap with each other and with Harmony processing; granules
+    # are processed one at a time, in the order they arrive
+    processing_lock = threading.Lock()
+
+    def on_ready(granule_name, tempo_file):
+        with processing_lock:
+            return process_tempo_file(tempo_file)
+
+    try:
+        outcomes = fetch_tempo_granules(TEMPO_GRANULES, on_ready)
+    except Exception as e:
+        print(f"❌ Pipeline error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    succeeded = [name for name, outcome in outcomes.items() if outcome['result'] is True]
+    print(f"Processed {len(succeeded)} of {len(TEMPO_GRANULES)} granules")
+    return len(succeeded) == len(TEMPO_GRANULES)
+
 if __name__ == "__main__":
-    process_tempo_data()
\ No newline at end of file
+    process_tempo_data()
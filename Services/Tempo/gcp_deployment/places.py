@@ -0,0 +1,110 @@
+import os
+import csv
+import numpy as np
+
+import keyed_store
+import sparse_granule
+from aqi_categories import category_code
+from granule_snapshot import window_search
+
+# Redis hash holding one precomputed record per named place
+PLACES_KEY = 'aqi_places'
+
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "places.csv"))
+
+# Half-width (in grid cells) of the window searched around each place.
+# TEMPO L3 cells are ~0.02°, so 5 cells is roughly a 10 km radius.
+NEIGHBOURHOOD_CELLS = int(os.getenv("PLACE_NEIGHBOURHOOD_CELLS", 5))
+
+
+def load_gazetteer(path=GAZETTEER_PATH):
+    """Load the bundled places CSV (id, name, state, country, latitude, longitude)"""
+    with open(path, newline='') as f:
+        places = [row for row in csv.DictReader(f)]
+    for place in places:
+        place['latitude'] = float(place['latitude'])
+        place['longitude'] = float(place['longitude'])
+    print(f"Loaded {len(places):,} places from {path}")
+    return places
+
+
+def compute_place_aqi(sparse, places, neighbourhood=NEIGHBOURHOOD_CELLS):
+    """Precompute AQI for every place from the sparse granule in one vectorized pass
+
+    For each place a (2n+1) x (2n+1) window of cells is gathered around its
+    nearest grid cell. The record holds the nearest valid pixel plus the mean
+    and max AQI over the valid pixels in the window.
+    """
+    print(f"Precomputing AQI for {len(places):,} places...")
+
+    place_lat = np.array([p['latitude'] for p in places], dtype=np.float64)
+    place_lon = np.array([p['longitude'] for p in places], dtype=np.float64)
+
+    rows, cols, window_valid, distance_km = window_search(
+        sparse['latitude'], sparse['longitude'], lambda r, c: sparse_granule.is_valid(sparse, r, c),
+        place_lat, place_lon, neighbourhood
+    )
+    window_aqi = np.where(window_valid, sparse_granule.values_at(sparse, 'aqi', rows, cols).astype(np.float32), np.nan)
+    nearest = np.argmin(distance_km, axis=1)
+
+    counts = window_valid.sum(axis=1)
+    has_data = counts > 0
+    with np.errstate(invalid='ignore'):
+        aqi_mean = np.where(has_data, np.nansum(window_aqi, axis=1) / np.maximum(counts, 1), np.nan)
+    aqi_max = np.where(has_data, np.max(np.where(window_valid, window_aqi, -1), axis=1), np.nan)
+
+    place_index = np.arange(len(places))
+    nearest_rows = rows[place_index, nearest]
+    nearest_cols = cols[place_index, nearest]
+    nearest_aqi = sparse_granule.values_at(sparse, 'aqi', nearest_rows, nearest_cols)
+    nearest_no2 = sparse_granule.values_at(sparse, 'no2', nearest_rows, nearest_cols)
+    nearest_distance = distance_km[place_index, nearest]
+
+    timestamp = sparse['timestamp']
+    timestamp = timestamp.isoformat() if hasattr(timestamp, 'isoformat') else str(timestamp)
+
+    records = []
+    for i, place in enumerate(places):
+        record = {
+            'id': place['id'],
+            'name': place['name'],
+            'state': place.get('state'),
+            'country': place.get('country'),
+            'latitude': place['latitude'],
+            'longitude': place['longitude'],
+            'timestamp': timestamp,
+            'valid_pixels': int(counts[i]),
+            'aqi': None,
+            'aqi_mean': None,
+            'aqi_max': None,
+            'category': None,
+            'no2_concentration': None,
+            'nearest_distance_km': None
+        }
+        if has_data[i]:
+            aqi = int(nearest_aqi[i])
+            record.update({
+                'aqi': aqi,
+                'aqi_mean': round(float(aqi_mean[i]), 1),
+                'aqi_max': int(aqi_max[i]),
+                'category': category_code(aqi),
+                'no2_concentration': float(nearest_no2[i]),
+                'nearest_distance_km': round(float(nearest_distance[i]), 2)
+            })
+        records.append(record)
+
+    print(f"✅ Place AQI computed: {int(has_data.sum()):,} of {len(places):,} places have valid data")
+    return records
+
+
+def store_place_aqi(records, redis_client=None, db_conn=None, ttl=None):
+    """Store place records as a keyed table in Redis (hash) and PostgreSQL (one row per place)"""
+    keyed_store.store_records(records, PLACES_KEY, 'tempo_place_aqi', 'place_id',
+                              {'timestamp': 'TIMESTAMP WITH TIME ZONE'}, 'places',
+                              redis_client=redis_client, db_conn=db_conn, ttl=ttl)
+
+
+def get_places(place_ids, redis_client=None, db_conn=None):
+    """Look up place records by id (serialized JSON bytes): Redis hash first, PostgreSQL for any misses"""
+    return keyed_store.get_records(place_ids, PLACES_KEY, 'tempo_place_aqi', 'place_id', 'place',
+                                   redis_client=redis_client, db_conn=db_conn)
@@ -0,0 +1,102 @@
+import os
+import datetime as dt
+import numpy as np
+import xarray as xr
+
+import granule_snapshot
+
+# Extracted variables of every processed granule, kept so AQI can be recomputed
+# (reprocess.py) without downloading the granule again. Mount a volume here on Cloud Run.
+RAW_STORE_DIR = os.getenv("RAW_STORE_DIR", "/tmp/tempo_raw")
+
+# Stored variables and their on-disk dtype; None keeps the native dtype so that
+# reprocessing with an unchanged conversion reproduces AQI exactly
+VARIABLES = {
+    'no2_concentration': None,
+    'quality_flag': None,
+    'uncertainty': np.float32,
+    'surface_pressure': np.float32,
+    'terrain_height': np.float32,
+    'pbl_height': np.float32,
+}
+
+
+def granule_time(timestamp):
+    """UTC datetime of a granule's numpy timestamp"""
+    seconds = np.datetime64(timestamp, 's').astype(np.int64)
+    return dt.datetime.fromtimestamp(int(seconds), dt.timezone.utc)
+
+
+def granule_path(when, directory=RAW_STORE_DIR):
+    return os.path.join(directory, when.strftime('%Y/%m/%d'), f"tempo-raw-{when:%Y%m%dT%H%M%SZ}.traw")
+
+
+def save(key_data, row_timestamp, directory=RAW_STORE_DIR):
+    """Store a granule's extracted variables, for pixels with an NO2 value only
+
+    row_timestamp is the tempo_aqi row the granule was stored under; reruns of
+    the same granule add their rows so reprocessing replaces all of them.
+    """
+    no2 = np.asarray(key_data['no2_concentration'].values)
+    index = np.flatnonzero(~np.isnan(no2)).astype(np.uint32)
+    arrays = {
+        'index': index,
+        'latitude': np.asarray(key_data['latitude'].values, dtype=np.float64),
+        'longitude': np.asarray(key_data['longitude'].values, dtype=np.float64)
+    }
+    for name, dtype in VARIABLES.items():
+        values = np.asarray(key_data[name].values).reshape(-1)[index]
+        arrays[name] = values if dtype is None else values.astype(dtype)
+
+    when = granule_time(key_data['timestamp'])
+    path = granule_path(when, directory)
+    row_timestamps = []
+    if os.path.exists(path):
+        row_timestamps = granule_snapshot.GranuleSnapshot(path).meta.get('row_timestamps', [])
+    meta = {
+        'version': str(key_data['timestamp']),
+        'granule_time': when.isoformat(),
+        'shape': list(no2.shape),
+        'row_timestamps': sorted(set(row_timestamps) | {row_timestamp})
+    }
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    granule_snapshot.write_snapshot_file(path + '.tmp', arrays, meta)
+    os.replace(path + '.tmp', path)
+    print(f"🗃️  Stored raw variables for {when:%Y-%m-%d %H:%M:%S} ({os.path.getsize(path) / 1024 ** 2:.1f} MB)")
+    return path
+
+
+def list_granules(start, end, directory=RAW_STORE_DIR):
+    """Paths of stored granules with start <= granule time < end, oldest first"""
+    paths = []
+    day = start.date()
+    while day <= end.date():
+        day_dir = os.path.join(directory, day.strftime('%Y/%m/%d'))
+        if os.path.isdir(day_dir):
+            for name in os.listdir(day_dir):
+                if not name.endswith('.traw'):
+                    continue
+                when = dt.datetime.strptime(name, 'tempo-raw-%Y%m%dT%H%M%SZ.traw').replace(tzinfo=dt.timezone.utc)
+                if start <= when < end:
+                    paths.append((when, os.path.join(day_dir, name)))
+        day += dt.timedelta(days=1)
+    return [path for _, path in sorted(paths)]
+
+
+def load(path):
+    """(meta, key_data) of a stored granule; key_data matches extract_key_tempo_data's output"""
+    raw = granule_snapshot.GranuleSnapshot(path)
+    shape = tuple(raw.meta['shape'])
+    index = raw['index']
+    key_data = {
+        'latitude': xr.DataArray(np.array(raw['latitude']), dims=('latitude',)),
+        'longitude': xr.DataArray(np.array(raw['longitude']), dims=('longitude',)),
+        'timestamp': np.datetime64(raw.meta['version'])
+    }
+    for name in VARIABLES:
+        values = raw[name]
+        grid = np.full(shape, np.nan if values.dtype.kind == 'f' else 0, dtype=values.dtype)
+        grid.reshape(-1)[index] = values
+        key_data[name] = xr.DataArray(grid, dims=('latitude', 'longitude'))
+    return raw.meta, key_data
@@ -0,0 +1,196 @@
+"""Recompute AQI for stored granules with a new conversion config and swap the results in
+
+Reads the raw variables kept by the pipeline (raw_store), so nothing is downloaded:
+
+    python reprocess.py --start 2025-10-01 --end 2025-11-01 --config conversion.json
+
+Granules are recomputed in parallel worker processes and staged (rows in a
+staging table, feature store chunks in a staging directory); tempo_aqi rows (and
+tempo_aqi_daily days past retention) are then replaced in a single transaction,
+and only once it has committed do the new feature chunks replace the old ones.
+If the currently served granule is in the range, its snapshot, Redis locations
+and API snapshot are republished too.
+"""
+import os
+import time
+import shutil
+import argparse
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import aqi_cache
+import aqi_storage
+import batch_pipeline
+import category_polygons
+import composite
+import feature_store
+import granule_delta
+import granule_snapshot
+import grid_kernels
+import h3_aggregate
+import main
+import places
+import raw_store
+import serialization
+import zonal_stats
+from sparse_granule import build_sparse_granule
+
+# Granules recomputed concurrently (one process each)
+REPROCESS_WORKERS = int(os.getenv("REPROCESS_WORKERS", grid_kernels.GRID_WORKERS))
+
+
+def _init_worker():
+    # Parallelism comes from the process pool; keep each granule single-threaded
+    grid_kernels.GRID_WORKERS = 1
+
+
+def recompute(path, conversion):
+    """Recompute one stored granule: (meta, key data, sparse granule)"""
+    meta, key_data = raw_store.load(path)
+    aqi_grid = main.calculate_aqi_from_tempo(key_data, conversion)
+    sparse = build_sparse_granule(key_data, aqi_grid)
+    return meta, key_data, sparse
+
+
+def _recompute_rows(path, conversion, feature_staging):
+    """Worker: the granule's tempo_aqi rows as (timestamp, JSON text) pairs and its staged feature chunk entry"""
+    meta, key_data, sparse = recompute(path, conversion)
+    entry = feature_store.write_chunk(key_data, sparse, feature_staging)
+    rows = []
+    for row_timestamp in meta['row_timestamps']:
+        points = [point for batch in main.extract_data_points(sparse, row_timestamp) for point in batch]
+        rows.append((row_timestamp, serialization.dumps(points).decode()))
+    return rows, entry
+
+
+def recompute_all(paths, conversion, feature_staging, feature_entries, workers=REPROCESS_WORKERS):
+    """Yield reprocessed rows as granules finish, keeping at most 2 x workers granules in flight
+
+    Feature chunks are written under feature_staging and their manifest
+    entries appended to feature_entries, for feature_store.publish_staged.
+    """
+    pending = set()
+    remaining = iter(paths)
+    done_count = 0
+    with ProcessPoolExecutor(max_workers=max(1, workers), initializer=_init_worker) as pool:
+        while True:
+            for path in remaining:
+                pending.add(pool.submit(_recompute_rows, path, conversion, feature_staging))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                done_count += 1
+                print(f"  ♻️  Reprocessed {done_count:,} of {len(paths):,} granules")
+                rows, entry = future.result()
+                feature_entries.append(entry)
+                yield from rows
+
+
+def republish_latest(path, conversion):
+    """Republish the served granule (snapshot, Redis locations, API snapshot) from reprocessed data"""
+    meta, _, sparse = recompute(path, conversion)
+    version = f"{meta['version']}+{conversion['id']}"
+    row_timestamp = meta['row_timestamps'][-1]
+
+    sinks = [main.api_snapshot_sink()]
+    redis_client = None
+    try:
+        redis_client = main.get_redis_client()
+        delta = granule_delta.plan_delta(redis_client, sparse, granule_snapshot.current())
+        sinks.append(main.redis_sink(redis_client, sparse, version, delta))
+    except Exception as e:
+        print(f"⚠️  Redis unavailable, skipping location caching: {e}")
+    results = batch_pipeline.run_pipeline(main.extract_data_points(sparse, row_timestamp), sinks)
+    api_points, extracted_count = results['api-snapshot']['result']
+
+    try:
+        conn = main.get_db_connection()
+        places.store_place_aqi(places.compute_place_aqi(sparse, places.load_gazetteer()),
+                               redis_client=redis_client, db_conn=conn, ttl=aqi_cache.STALE_SECONDS)
+        conn.close()
+    except Exception as e:
+        print(f"⚠️  Skipping place AQI precomputation: {e}")
+
+    if os.path.exists(zonal_stats.ZONES_PATH):
+        try:
+            zones = zonal_stats.load_zones()
+            labels = zonal_stats.label_rasters(zones, sparse['latitude'], sparse['longitude'])
+            conn = main.get_db_connection()
+            zonal_stats.store_zone_stats(zonal_stats.compute_zone_stats(sparse, zones, labels),
+                                         redis_client=redis_client, db_conn=conn, ttl=aqi_cache.STALE_SECONDS)
+            conn.close()
+        except Exception as e:
+            print(f"⚠️  Skipping zonal statistics: {e}")
+
+    granule_snapshot.publish_granule(sparse, version)
+    try:
+        composite.publish(sparse, version)
+    except Exception as e:
+        print(f"⚠️  Composite update failed: {e}")
+    try:
+        h3_aggregate.publish(sparse, version)
+    except Exception as e:
+        print(f"⚠️  H3 aggregation failed: {e}")
+    try:
+        conn = main.get_db_connection()
+        category_polygons.store_contours(category_polygons.build_contours(sparse), redis_client=redis_client,
+                                         db_conn=conn, ttl=aqi_cache.STALE_SECONDS)
+        conn.close()
+    except Exception as e:
+        print(f"⚠️  Category polygon extraction failed: {e}")
+    main.cache_latest_aqi_data(api_points, version, total_points=extracted_count)
+    main.announce_update(redis_client, results, version)
+    print(f"✅ Republished served granule as {version}")
+
+
+def reprocess(start, end, conversion, workers=REPROCESS_WORKERS):
+    """Recompute every stored granule in [start, end) and atomically replace its stored results"""
+    started = time.time()
+    paths = raw_store.list_granules(start, end)
+    print(f"Reprocessing {len(paths):,} granules from {start:%Y-%m-%d} to {end:%Y-%m-%d} "
+          f"with conversion {conversion['id']} ({workers} workers)...")
+    if not paths:
+        return 0
+
+    feature_staging = feature_store.staging_dir()
+    feature_entries = []
+    conn = main.get_db_connection()
+    try:
+        replaced, days = aqi_storage.swap_reprocessed(
+            conn, recompute_all(paths, conversion, feature_staging, feature_entries, workers))
+    except Exception:
+        # The old feature chunks stay, matching the rows left in the database
+        shutil.rmtree(feature_staging, ignore_errors=True)
+        raise
+    finally:
+        conn.close()
+    print(f"✅ Swapped in {replaced:,} tempo_aqi rows and {days:,} daily rows")
+    feature_store.publish_staged(feature_staging, feature_entries)
+
+    # The served granule is republished only after the database holds the new results
+    served = granule_snapshot.current()
+    if served is not None:
+        served_path = raw_store.granule_path(raw_store.granule_time(served.meta['granule_time']))
+        if served_path in paths:
+            republish_latest(served_path, conversion)
+
+    print(f"🎉 Reprocessing finished in {time.time() - started:.0f}s")
+    return replaced
+
+
+def _parse_day(value):
+    return dt.datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=dt.timezone.utc)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute AQI from stored raw TEMPO variables")
+    parser.add_argument('--start', type=_parse_day, required=True, help="First day (YYYY-MM-DD, UTC)")
+    parser.add_argument('--end', type=_parse_day, required=True, help="Day after the last one (YYYY-MM-DD, UTC)")
+    parser.add_argument('--config', help="JSON conversion config (default: AQI_CONVERSION_CONFIG or built-in)")
+    parser.add_argument('--workers', type=int, default=REPROCESS_WORKERS)
+    args = parser.parse_args()
+    conversion = grid_kernels.load_conversion(args.config) if args.config else grid_kernels.CONVERSION
+    reprocess(args.start, args.end, conversion, workers=args.workers)
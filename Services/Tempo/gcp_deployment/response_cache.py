@@ -0,0 +1,226 @@
+import os
+import re
+import gzip
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, g, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+# Pre-compressed responses kept per process, bounded by count and total size
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_ENTRIES", 1024))
+MAX_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", 64 * 1024 ** 2))
+# Seconds a cached response is served even if its version is still current
+TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL", 60))
+# Longest wait (seconds) for an identical in-flight request before computing independently
+FLIGHT_TIMEOUT = float(os.getenv("RESPONSE_FLIGHT_TIMEOUT", 10))
+
+_INT_RE = re.compile(r'^[+-]?\d+$')
+
+
+class TTLCache:
+    """Thread-safe LRU of (version, value) entries with a TTL and a total size bound
+
+    Entries are only returned for the version they were stored under, so a
+    new granule invalidates them without a global flush.
+    """
+
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry_version, expires, size, value = entry
+            if entry_version != version or expires < now:
+                del self._entries[key]
+                self._bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, version, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (version, time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+_cache = TTLCache(MAX_ENTRIES, MAX_BYTES, TTL_SECONDS)
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _join_flight(key):
+    """(flight, is_leader): the first caller for a key computes, later ones wait on its flight"""
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = _flights[key] = _Flight()
+        return flight, True
+
+
+def _land_flight(key, flight, entry):
+    with _flights_lock:
+        _flights.pop(key, None)
+    flight.entry = entry
+    flight.done.set()
+
+
+def _normalized_query():
+    """Path plus sorted query parameters, with numbers in canonical form
+
+    lat=40.71280&lon=-74.006 and lon=-74.0060&lat=40.7128 share one key;
+    integers and decimals stay distinct since views parse them differently.
+    """
+    params = []
+    for name, value in sorted(request.args.items(multi=True)):
+        if not _INT_RE.match(value):
+            try:
+                value = repr(float(value))
+            except ValueError:
+                pass
+        params.append(f"{name}={value}")
+    return f"{request.path}?{'&'.join(params)}"
+
+
+def _choose_encoding():
+    """Pick the best supported Content-Encoding the client accepts"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def _etag_for(version, query):
+    """Granule-versioned ETag value for a normalized request"""
+    return hashlib.sha1(f"{version}|{query}".encode()).hexdigest()[:20]
+
+
+def _finish(response, etag, encoding):
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    if etag:
+        # Weak, so one ETag is shared by all encodings of the same body
+        response.headers['ETag'] = f'W/"{etag}"'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _serve(entry, etag):
+    body, mimetype, body_encoding = entry
+    return _finish(Response(body, status=200, mimetype=mimetype), etag, body_encoding)
+
+
+def conditional(get_version):
+    """Add ETag/If-None-Match handling, negotiated compression and request coalescing to a JSON view
+
+    get_version returns the current granule version (or None if unknown).
+    Requests are keyed by normalized query, encoding and version. Identical
+    requests arriving while one is being computed wait for it and share its
+    response (singleflight); successful responses are then cached
+    pre-compressed for TTL_SECONDS. A view can set g.skip_response_cache to
+    keep a response out of the cache (e.g. one that reports a changing age);
+    it is still shared with the requests already waiting on it.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                version = get_version()
+            except Exception as e:
+                print(f"⚠️  Version lookup failed: {e}")
+                version = None
+
+            encoding = _choose_encoding()
+            query = _normalized_query()
+            etag = _etag_for(version, query) if version else None
+
+            if etag and request.if_none_match.contains_weak(etag):
+                return _finish(Response(status=304), etag, None)
+
+            if not version:
+                return _render(view(*args, **kwargs), None, encoding)[0]
+
+            key = (query, encoding, version)
+            entry = _cache.get(key[:2], version)
+            if entry is not None:
+                return _serve(entry, etag)
+
+            flight, leader = _join_flight(key)
+            if not leader:
+                if flight.done.wait(FLIGHT_TIMEOUT) and flight.entry is not None:
+                    return _serve(flight.entry, etag)
+                # The leader failed, timed out or got an uncacheable status: compute independently
+                return _render(view(*args, **kwargs), etag, encoding)[0]
+
+            entry = None
+            try:
+                response, entry = _render(view(*args, **kwargs), etag, encoding)
+                if entry is not None and not g.get('skip_response_cache'):
+                    _cache.put(key[:2], version, entry, len(entry[0]))
+            finally:
+                _land_flight(key, flight, entry)
+            return response
+        return wrapper
+    return decorator
+
+
+def _render(response, etag, encoding):
+    """Compress a view's response; returns (response, shareable entry or None)"""
+    if isinstance(response, tuple) or response.status_code != 200:
+        return response, None
+
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_BYTES:
+        encoding = None
+    body = _compress(body, encoding)
+    response.set_data(body)
+    return _finish(response, etag, encoding), (body, response.mimetype, encoding)
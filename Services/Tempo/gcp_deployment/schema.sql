@@ -1,8 +1,24 @@
 -- Create the database schema for TEMPO AQI data
+-- (the pipeline creates this itself via aqi_storage.ensure_storage, including partitions)
+
+-- Raw granules, partitioned by day; partitions past the retention window are
+-- downsampled into tempo_aqi_daily and dropped
 CREATE TABLE IF NOT EXISTS tempo_aqi (
-    timestamp TIMESTAMP PRIMARY KEY,
-    data JSONB
-);
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,
+    data JSONB,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT tempo_aqi_timestamp_uniq UNIQUE (timestamp)
+) PARTITION BY RANGE (timestamp);
 
--- Index for faster queries
-CREATE INDEX IF NOT EXISTS idx_tempo_aqi_timestamp ON tempo_aqi (timestamp DESC);
\ No newline at end of file
+-- Example daily partition (the unique constraint provides the timestamp index)
+-- CREATE TABLE tempo_aqi_p20251003 PARTITION OF tempo_aqi
+--     FOR VALUES FROM ('2025-10-03 00:00:00+00') TO ('2025-10-04 00:00:00+00');
+
+-- Downsampled history: one row per UTC day of per-cell mean/max AQI
+CREATE TABLE IF NOT EXISTS tempo_aqi_daily (
+    day DATE PRIMARY KEY,
+    resolution_deg REAL,
+    granules INTEGER,          -- granules the day was built from
+    data JSONB,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
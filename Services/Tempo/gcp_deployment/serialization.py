@@ -0,0 +1,54 @@
+import os
+import json
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+# Set TEMPO_JSON_BACKEND=json to force the stdlib encoder
+BACKEND = 'orjson' if orjson is not None and os.getenv("TEMPO_JSON_BACKEND", "orjson") == "orjson" else 'json'
+
+_ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+
+
+def _default(obj):
+    """Convert NumPy scalars/arrays and datetimes the encoders do not handle natively"""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """Serialize to compact JSON bytes"""
+    if BACKEND == 'orjson':
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode()
+
+
+def loads(data):
+    """Parse JSON from bytes or str"""
+    if BACKEND == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def with_fields(fragment, **fields):
+    """Append fields to a pre-serialized JSON object without decoding it"""
+    if not fields:
+        return fragment
+    extra = dumps(fields)[1:-1]
+    if fragment == b'{}':
+        return b'{' + extra + b'}'
+    return fragment[:-1] + b',' + extra + b'}'
+
+
+def splice(envelope, key, fragments):
+    """Build a JSON object from an envelope dict plus an array of pre-serialized fragments under key"""
+    head = dumps(envelope)
+    array = b'"' + key.encode() + b'":[' + b','.join(fragments) + b']'
+    if head == b'{}':
+        return b'{' + array + b'}'
+    return head[:-1] + b',' + array + b'}'
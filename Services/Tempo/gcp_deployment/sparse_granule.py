@@ -0,0 +1,88 @@
+import numpy as np
+
+import grid_kernels
+from aqi_categories import AQI_INVALID, category_codes, mask_bits, pack_mask
+
+
+def _concat(blocks, column, dtype):
+    return np.concatenate([b[column] for b in blocks]) if blocks else np.zeros(0, dtype=dtype)
+
+
+def build_sparse_granule(key_data, aqi_grid):
+    """Build the sparse valid-pixel representation of a granule, once, right after AQI computation
+
+    Only pixels passing the quality/NaN/AQI checks are kept, as flat row-major
+    grid indices plus value columns. row_ptr gives a CSR-by-row view (pixels of
+    row r are index[row_ptr[r]:row_ptr[r + 1]]) and valid_bits a packed mask for
+    random access, so downstream stages scale with valid pixels, not grid size.
+    The helpers below also accept a published GranuleSnapshot, which stores the
+    same arrays.
+    """
+    no2_values = key_data['no2_concentration'].values
+    quality_values = key_data['quality_flag'].values
+    n_rows, n_cols = aqi_grid.shape
+    valid_mask = np.empty(aqi_grid.shape, dtype=bool)
+
+    def block(start, end):
+        # Mask and gather one row block; blocks are independent and come back in row order
+        valid = valid_mask[start:end]
+        np.logical_and(aqi_grid[start:end] != AQI_INVALID, quality_values[start:end] == 0, out=valid)
+        valid &= ~np.isnan(no2_values[start:end])
+        local = np.flatnonzero(valid)
+        aqi = aqi_grid[start:end].ravel()[local]
+        return (local + start * n_cols, aqi, category_codes(aqi), no2_values[start:end].ravel()[local])
+
+    blocks = grid_kernels.map_row_blocks(block, n_rows)
+    index = np.concatenate([b[0] for b in blocks]).astype(np.uint32) if blocks else np.zeros(0, dtype=np.uint32)
+    rows = (index // n_cols).astype(np.int32)
+
+    sparse = {
+        'shape': (n_rows, n_cols),
+        'latitude': np.asarray(key_data['latitude'].values, dtype=np.float64),
+        'longitude': np.asarray(key_data['longitude'].values, dtype=np.float64),
+        'timestamp': key_data['timestamp'],
+        'index': index,
+        'rows': rows,
+        'cols': (index % n_cols).astype(np.int32),
+        'row_ptr': np.searchsorted(rows, np.arange(n_rows + 1)).astype(np.uint32),
+        'valid_bits': pack_mask(valid_mask),
+        'aqi': _concat(blocks, 1, aqi_grid.dtype),
+        'category': _concat(blocks, 2, np.uint8),
+        'no2': _concat(blocks, 3, no2_values.dtype)
+    }
+    print(f"Sparse granule: {index.size:,} valid of {n_rows * n_cols:,} pixels "
+          f"({100 * index.size / max(n_rows * n_cols, 1):.1f}%)")
+    return sparse
+
+
+def positions(index, flat_index):
+    """Position of each flat grid index within a sorted sparse index (-1 where not valid)"""
+    flat_index = np.asarray(flat_index)
+    pos = np.searchsorted(index, flat_index)
+    if not len(index):
+        return np.full(flat_index.shape, -1, dtype=np.int64)
+    pos_clipped = np.minimum(pos, len(index) - 1)
+    return np.where(index[pos_clipped] == flat_index, pos_clipped, -1)
+
+
+def _flat(sparse, rows, cols):
+    return np.asarray(rows, dtype=np.int64) * len(sparse['longitude']) + np.asarray(cols, dtype=np.int64)
+
+
+def is_valid(sparse, rows, cols):
+    """Validity of grid cells (any shape of row/col arrays) from the packed mask"""
+    return mask_bits(sparse['valid_bits'], _flat(sparse, rows, cols))
+
+
+def cell_positions(sparse, rows, cols):
+    """Positions of grid cells within the value columns (-1 where not valid)"""
+    return positions(sparse['index'], _flat(sparse, rows, cols))
+
+
+def values_at(sparse, name, rows, cols, fill=0):
+    """Gather a value column at grid cells; invalid cells get fill"""
+    column = sparse[name]
+    pos = cell_positions(sparse, rows, cols)
+    if not len(column):
+        return np.full(pos.shape, fill, dtype=column.dtype)
+    return np.where(pos >= 0, column[np.maximum(pos, 0)], fill).astype(column.dtype)
@@ -25,16 +25,14 @@ echo "Current directory: $(pwd)"
 echo "Files in directory:"
 ls -la
 
-# Test Python import
-echo "Testing Python import..."
-python3 -c "import endpoint; print('endpoint module imported successfully'); print('app object:', hasattr(endpoint, 'app'))"
-
 # Check if this is a pipeline job or API service
 if [ "$RUN_PIPELINE" = "true" ]; then
     echo "Running TEMPO data processing pipeline..."
     python3 main.py
 else
-    # Start gunicorn for API service
-    echo "Starting gunicorn with command: gunicorn --bind 0.0.0.0:$PORT --workers 1 --threads 8 --timeout 0 endpoint:app"
-    exec gunicorn --bind 0.0.0.0:$PORT --workers 1 --threads 8 --timeout 0 endpoint:app
+    # Start gunicorn for API service; every open /aqi-stream holds a thread
+    # (MAX_STREAMS, default 48), the rest serve requests
+    THREADS=${GUNICORN_THREADS:-64}
+    echo "Starting gunicorn with command: gunicorn --bind 0.0.0.0:$PORT --workers 1 --threads $THREADS --timeout 0 endpoint:app"
+    exec gunicorn --bind 0.0.0.0:$PORT --workers 1 --threads $THREADS --timeout 0 endpoint:app
 fi
\ No newline at end of file
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Test alert subscriptions against PostgreSQL (DB_HOST, DB_PORT, DB_USER, DB_PASS, DB_NAME)
+
+A new point subscription must fire on the first category crossing at its
+cell, whether it was indexed at subscription time or by the next pipeline run.
+"""
+import os
+import tempfile
+import numpy as np
+import psycopg2
+import pytest
+
+import alerts
+import granule_snapshot
+import serialization
+from aqi_categories import category_codes, pack_mask
+
+LAT_AXIS = np.linspace(40.0, 39.0, 11)
+LON_AXIS = np.linspace(-105.0, -104.0, 11)
+# Subscribed cell (row 5, col 5)
+LAT, LON = float(LAT_AXIS[5]), float(LON_AXIS[5])
+
+
+def get_db_connection():
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 5432)),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        database=os.getenv("DB_NAME")
+    )
+
+
+class RecordingRedis:
+    """Collects the alert events evaluate() queues"""
+
+    def __init__(self):
+        self.queued = []
+
+    def pipeline(self):
+        return self
+
+    def rpush(self, key, *values):
+        self.queued.extend(serialization.loads(value) for value in values)
+
+    def ltrim(self, *args):
+        pass
+
+    def execute(self):
+        pass
+
+
+def granule(aqi_value, timestamp):
+    """Fully valid granule with the same AQI everywhere"""
+    shape = (len(LAT_AXIS), len(LON_AXIS))
+    index = np.arange(shape[0] * shape[1], dtype=np.uint32)
+    aqi = np.full(index.size, aqi_value, dtype=np.uint16)
+    return {
+        'index': index, 'aqi': aqi, 'category': category_codes(aqi), 'no2': np.ones(index.size, dtype=np.float32),
+        'valid_bits': pack_mask(np.ones(index.size, dtype=bool)),
+        'row_ptr': np.arange(0, index.size + 1, shape[1], dtype=np.uint32),
+        'latitude': LAT_AXIS, 'longitude': LON_AXIS, 'shape': shape, 'timestamp': timestamp
+    }
+
+
+@pytest.mark.parametrize("indexed_at_subscription", [True, False])
+def test_first_crossing(indexed_at_subscription):
+    conn = get_db_connection()
+    directory = tempfile.mkdtemp()
+    good, unhealthy = granule(30, '2025-10-03T12:00:00'), granule(160, '2025-10-03T13:00:00')
+    granule_snapshot.publish_granule(good, 'v1', directory=directory)
+    served = granule_snapshot.current(directory=directory, refresh=True)
+
+    subscription_id = alerts.add_subscription(conn, 3, latitude=LAT, longitude=LON,
+                                              snapshot=served if indexed_at_subscription else None)
+    try:
+        redis_client = RecordingRedis()
+        previous = served
+        if not indexed_at_subscription:
+            # The next run indexes the subscription on the unchanged granule: nothing fires yet
+            alerts.evaluate(good, served, 'v1', conn, redis_client)
+        alerts.evaluate(unhealthy, previous, 'v2', conn, redis_client)
+        events = [event for event in redis_client.queued if event['subscription_id'] == subscription_id]
+        assert len(events) == 1, f"expected one event, got {events}"
+        assert events[0]['direction'] == 'up' and events[0]['previous_category'] == 0 and events[0]['category'] == 3
+        print(f"✓ First crossing fires ({'indexed at subscription' if indexed_at_subscription else 'indexed by the pipeline'})")
+    finally:
+        alerts.remove_subscription(conn, subscription_id)
+        conn.close()
+
+
+if __name__ == "__main__":
+    test_first_crossing(True)
+    test_first_crossing(False)
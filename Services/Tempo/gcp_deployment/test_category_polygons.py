@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Test category polygon extraction on nested rings (island in a lake in an island)
+"""
+import numpy as np
+import shapely
+
+import category_polygons
+
+
+def nested_mask():
+    """Outer island with a lake, an inner island in the lake and a pond on the inner island"""
+    mask = np.zeros((40, 40), dtype=bool)
+    mask[2:38, 2:38] = True
+    mask[8:32, 8:32] = False
+    mask[14:26, 14:26] = True
+    mask[18:22, 18:22] = False
+    return mask
+
+
+def test_nested_holes():
+    """Each hole belongs to the innermost shell containing it, so the geometry is valid as built"""
+    lat_axis = np.linspace(40.0, 36.1, 40)
+    lon_axis = np.linspace(-120.0, -116.1, 40)
+    rings = category_polygons.trace_rings(nested_mask())
+
+    # Before simplification and precision snapping, which would repair invalid input
+    simplify, set_precision = shapely.simplify, shapely.set_precision
+    shapely.simplify = lambda geometry, tolerance, preserve_topology: geometry
+    shapely.set_precision = lambda geometry, precision: geometry
+    try:
+        raw = category_polygons.level_polygons(rings, lat_axis, lon_axis, tolerance=0.01)
+    finally:
+        shapely.simplify, shapely.set_precision = simplify, set_precision
+    assert raw.is_valid, shapely.is_valid_reason(raw)
+
+    area = category_polygons.level_polygons(rings, lat_axis, lon_axis, tolerance=0.01)
+    polygons = sorted(area.geoms, key=lambda polygon: -polygon.area)
+    assert len(polygons) == 2, f"expected 2 islands, got {len(polygons)}"
+    assert [len(polygon.interiors) for polygon in polygons] == [1, 1]
+
+    def point(row, col):
+        return shapely.Point(lon_axis[col], lat_axis[row])
+    assert area.contains(point(4, 4)), "outer island"
+    assert not area.contains(point(10, 10)), "lake"
+    assert area.contains(point(15, 15)), "inner island"
+    assert not area.contains(point(20, 20)), "pond on the inner island"
+    print("✓ Nested rings: holes attached to the innermost shell")
+
+
+if __name__ == "__main__":
+    test_nested_holes()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test that the fused numba AQI kernel matches the NumPy kernel (skipped without numba)
+
+Random blocks cover NaN, flagged, negative, gapped (between breakpoints, or
+below the first one) and out-of-range concentrations.
+"""
+import os
+import importlib
+import numpy as np
+import pytest
+
+pytest.importorskip("numba")
+import grid_kernels
+
+# The fused kernel is only compiled when selected at import; the kernel in use is left as it was
+if grid_kernels._aqi_block_fused is None:
+    kernel, active, selected = grid_kernels.GRID_KERNEL, grid_kernels.ACTIVE_KERNEL, os.environ.get("GRID_KERNEL")
+    os.environ["GRID_KERNEL"] = "numba"
+    importlib.reload(grid_kernels)
+    grid_kernels.GRID_KERNEL, grid_kernels.ACTIVE_KERNEL = kernel, active
+    if selected is None:
+        del os.environ["GRID_KERNEL"]
+    else:
+        os.environ["GRID_KERNEL"] = selected
+from aqi_categories import AQI_DTYPE, AQI_INVALID
+
+# ppb = column value with these constants; gaps at 0-9 and 21-29 ppb, nothing above 60
+GAPPED = {'avogadro': 1.0, 'atmospheric_factor': 1.0,
+          'breakpoints': [[10, 20, 0, 50], [30, 40, 51, 100], [41, 60, 101, 150]]}
+
+
+def run_both(no2, quality, conversion):
+    expected = np.full(no2.shape, AQI_INVALID, dtype=AQI_DTYPE)
+    actual = expected.copy()
+    expected_counts = grid_kernels._aqi_block_numpy(no2, quality, expected, conversion)
+    scalar = no2.dtype.type
+    actual_counts = grid_kernels._aqi_block_fused(no2, quality, actual, scalar(conversion['avogadro']),
+                                                  scalar(conversion['atmospheric_factor']),
+                                                  np.array(conversion['breakpoints'], dtype=np.int64))
+    return expected, actual, expected_counts, tuple(actual_counts)
+
+
+def random_block(rng, high, shape=(64, 97)):
+    no2 = rng.uniform(-0.1 * high, high, shape).astype(np.float32)
+    no2[rng.random(shape) < 0.05] = np.nan
+    quality = (rng.random(shape) < 0.1).astype(np.int8)
+    return no2, quality
+
+
+@pytest.mark.parametrize("conversion, high", [
+    (GAPPED, 80.0),
+    (grid_kernels.load_conversion(), 2500 * grid_kernels.AVOGADRO / grid_kernels.ATMOSPHERIC_FACTOR),
+])
+def test_fused_matches_numpy(conversion, high):
+    rng = np.random.default_rng(34)
+    for _ in range(5):
+        no2, quality = random_block(rng, high)
+        expected, actual, expected_counts, actual_counts = run_both(no2, quality, conversion)
+        assert actual_counts == expected_counts
+        mismatched = np.flatnonzero(expected != actual)
+        assert mismatched.size == 0, \
+            f"{mismatched.size} cells differ, e.g. no2={no2.flat[mismatched[0]]}: " \
+            f"numpy {expected.flat[mismatched[0]]}, numba {actual.flat[mismatched[0]]}"
+
+
+def test_gapped_values():
+    no2 = np.array([[5, 25, 35, 61, 1000]], dtype=np.float32)
+    expected, actual, _, _ = run_both(no2, np.zeros(no2.shape, dtype=np.int8), GAPPED)
+    assert expected.tolist() == actual.tolist() == [[0, 0, 76, 500, 500]]
+
+
+if __name__ == "__main__":
+    test_fused_matches_numpy(GAPPED, 80.0)
+    test_fused_matches_numpy(grid_kernels.load_conversion(),
+                             2500 * grid_kernels.AVOGADRO / grid_kernels.ATMOSPHERIC_FACTOR)
+    test_gapped_values()
+    print("✓ Fused kernel matches NumPy")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test Harmony job orchestration against fake_harmony (started on localhost:3000, HARMONY_ENV=LOCAL)
+
+Jobs are submitted, polled with backoff, resumed when paused and their
+outputs downloaded through granule_cache; every granule must complete and a
+failing job must be reported in its outcome.
+"""
+import os
+import tempfile
+import threading
+from werkzeug.serving import make_server
+from harmony import Client, Collection, Request
+from harmony.config import Environment
+
+import fake_harmony
+import granule_cache
+import harmony_jobs
+
+PORT = 3000
+GRANULES = ['TEMPO_NO2_L3_A.nc', 'TEMPO_NO2_L3_B.nc', 'TEMPO_NO2_L3_PAUSED.nc', 'TEMPO_NO2_L3_FAILING.nc']
+FILE_BYTES = 9 * 1024 * 1024 + 17
+
+_server = None
+
+
+def start_fake_harmony():
+    """Serve fake_harmony from a background thread (once per process)"""
+    global _server
+    if _server is None:
+        fake_harmony.JOB_SECONDS = [1.0]
+        fake_harmony.RANDOM_FILE_BYTES = FILE_BYTES
+        fake_harmony.FAIL_GRANULES = {'TEMPO_NO2_L3_FAILING.nc'}
+        fake_harmony.PAUSE_GRANULES = {'TEMPO_NO2_L3_PAUSED.nc'}
+        _server = make_server('127.0.0.1', PORT, fake_harmony.app, threaded=True)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+def test_run_jobs():
+    start_fake_harmony()
+    harmony_jobs.POLL_INITIAL_SECONDS = 0.1
+    harmony_jobs.POLL_MAX_SECONDS = 0.5
+    client = Client(env=Environment.LOCAL, auth=('user', 'password'))
+
+    # Record when each job is polled, to check the backoff
+    polls = {}
+    status = client.status
+
+    def recording_status(job_id):
+        polls.setdefault(job_id, []).append(harmony_jobs.time.monotonic())
+        return status(job_id)
+    client.status = recording_status
+
+    session = harmony_jobs.download_session(client)
+    cache_dir = tempfile.mkdtemp()
+    requests = {name: Request(collection=Collection(id="C3685896708-LARC_CLOUD"), granule_name=[name])
+                for name in GRANULES}
+
+    def on_complete(name, urls):
+        return granule_cache.fetch(name, urls[0], session, directory=cache_dir)
+
+    outcomes = harmony_jobs.run_jobs(client, requests, on_complete, workers=4, timeout=30)
+
+    for name in GRANULES[:3]:
+        outcome = outcomes[name]
+        assert outcome['status'] == 'successful' and outcome['error'] is None, f"{name}: {outcome}"
+        assert os.path.getsize(outcome['result']) == FILE_BYTES, name
+        assert granule_cache.lookup(name, cache_dir) == outcome['result']
+    print("✓ Every granule completed and was downloaded")
+
+    failed = outcomes['TEMPO_NO2_L3_FAILING.nc']
+    assert failed['status'] == 'failed' and isinstance(failed['error'], RuntimeError), failed
+    assert failed['result'] is None and granule_cache.lookup('TEMPO_NO2_L3_FAILING.nc', cache_dir) is None
+    print("✓ Failing job reported")
+
+    paused = fake_harmony._jobs[outcomes['TEMPO_NO2_L3_PAUSED.nc']['job_id']]
+    assert not paused['paused']
+    print("✓ Paused job resumed")
+
+    times = polls[outcomes['TEMPO_NO2_L3_A.nc']['job_id']]
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    assert len(gaps) >= 2 and gaps[-1] > gaps[0], gaps
+    print(f"✓ Polling backed off ({', '.join(f'{gap:.2f}s' for gap in gaps)})")
+
+
+if __name__ == "__main__":
+    test_run_jobs()
@@ -0,0 +1,184 @@
+import os
+import time
+import queue
+import threading
+
+import granule_delta
+import granule_snapshot
+import serialization
+from aqi_categories import expand_point
+
+# Idle streams get a comment line this often (seconds) so proxies keep them open
+STREAM_KEEPALIVE = float(os.getenv("STREAM_KEEPALIVE", 15))
+# Streams are closed after this long (seconds) and the client reconnects; keep it
+# below the Cloud Run request timeout
+STREAM_MAX_SECONDS = float(os.getenv("STREAM_MAX_SECONDS", 240))
+# Open streams per process; each holds a gunicorn thread, so keep some threads for requests
+MAX_STREAMS = int(os.getenv("MAX_STREAMS", 48))
+# Notices buffered per stream; a client that falls further behind is told to reload
+STREAM_QUEUE_SIZE = 16
+
+_subscribers = set()
+_lock = threading.Lock()
+_listener = None
+_redis_factory = None
+_watched_version = None
+_delta_cache = {}
+
+
+def subscribe(redis_factory):
+    """Register a stream; returns its notice queue, or None when the process is at MAX_STREAMS
+
+    The first stream starts the single listener thread of this process, which
+    holds the only Redis subscription and fans notices out to every queue.
+    """
+    global _listener, _redis_factory
+    with _lock:
+        if len(_subscribers) >= MAX_STREAMS:
+            return None
+        notices = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        _subscribers.add(notices)
+        _redis_factory = redis_factory
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name='update-stream', daemon=True)
+            _listener.start()
+    return notices
+
+
+def unsubscribe(notices):
+    with _lock:
+        _subscribers.discard(notices)
+
+
+def publish(notice):
+    """Hand a notice to every stream of this process
+
+    Called by the listener for each Redis message; also the in-process
+    stand-in for the channel when there is no Redis (local runs, tests).
+    """
+    with _lock:
+        subscribers = list(_subscribers)
+    for notices in subscribers:
+        try:
+            notices.put_nowait(notice)
+        except queue.Full:
+            # Too slow for deltas: replace its backlog with one reload notice
+            while True:
+                try:
+                    notices.get_nowait()
+                except queue.Empty:
+                    break
+            notices.put_nowait(dict(notice, full=True, delta_key=None))
+
+
+def _has_subscribers():
+    with _lock:
+        return bool(_subscribers)
+
+
+def _listen():
+    global _listener
+    while True:
+        with _lock:
+            if not _subscribers:
+                _listener = None
+                return
+        try:
+            pubsub = _redis_factory().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(granule_delta.UPDATES_CHANNEL)
+            print(f"📡 Subscribed to '{granule_delta.UPDATES_CHANNEL}'")
+            try:
+                while _has_subscribers():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None and message['type'] == 'message':
+                        publish(serialization.loads(message['data']))
+            finally:
+                pubsub.close()
+        except Exception as e:
+            print(f"⚠️  Update subscription failed, watching the granule snapshot instead: {e}")
+            _watch_snapshot(STREAM_KEEPALIVE)
+
+
+def _watch_snapshot(seconds):
+    """Fallback while Redis is unreachable: announce new snapshot versions as full updates"""
+    global _watched_version
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and _has_subscribers():
+        snapshot = granule_snapshot.current()
+        version = snapshot.version if snapshot is not None else None
+        if _watched_version is not None and version is not None and version != _watched_version:
+            publish({'version': version, 'previous_version': _watched_version, 'full': True,
+                     'changed': 0, 'removed': 0, 'delta_key': None})
+        _watched_version = version or _watched_version
+        time.sleep(granule_snapshot.CHECK_INTERVAL)
+
+
+def _load_delta(redis_client, notice):
+    """The stored delta of a notice, read from Redis once per process and shared by all streams"""
+    key = notice.get('delta_key')
+    if key is None:
+        return None
+    with _lock:
+        if key in _delta_cache:
+            return _delta_cache[key]
+    value = redis_client.get(key)
+    delta = serialization.loads(value) if value else None
+    with _lock:
+        _delta_cache.clear()
+        _delta_cache[key] = delta
+    return delta
+
+
+def region_delta(delta, bbox):
+    """Changed points (expanded) and removed [lat, lon] cells of a delta that fall inside bbox"""
+    west, south, east, north = bbox
+    changed = [expand_point(point) for point in delta['changed']
+               if south <= point['latitude'] <= north and west <= point['longitude'] <= east]
+    removed = []
+    for key in delta['removed']:
+        location = granule_delta.key_location(key)
+        if location is not None and south <= location[0] <= north and west <= location[1] <= east:
+            removed.append(list(location))
+    return {'version': delta['version'], 'previous_version': delta['previous_version'],
+            'changed': changed, 'removed': removed}
+
+
+def _event(name, version, data):
+    return f"id: {version}\nevent: {name}\ndata: {serialization.dumps(data).decode()}\n\n"
+
+
+def events(notices, redis_client, bbox=None, current_version=None, last_version=None):
+    """Server-Sent Events for one stream
+
+    'version' events carry each new version's notice (full=true means reload
+    rather than patch). With a bbox, incremental updates arrive as 'delta'
+    events holding only the changed and removed cells inside it. A client
+    reconnecting with an outdated Last-Event-ID gets the current version first.
+    """
+    yield "retry: 5000\n\n"
+    if current_version is not None and current_version != last_version:
+        yield _event('version', current_version, {'version': current_version, 'full': True})
+
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        try:
+            notice = notices.get(timeout=min(STREAM_KEEPALIVE, remaining))
+        except queue.Empty:
+            yield ": keepalive\n\n"
+            continue
+
+        delta = None
+        if bbox is not None and not notice['full']:
+            try:
+                delta = _load_delta(redis_client, notice)
+            except Exception as e:
+                print(f"⚠️  Delta lookup failed: {e}")
+        if delta is not None:
+            yield _event('delta', notice['version'], region_delta(delta, bbox))
+        elif bbox is not None:
+            yield _event('version', notice['version'], dict(notice, full=True))
+        else:
+            yield _event('version', notice['version'], notice)
@@ -0,0 +1,198 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+import keyed_store
+from aqi_categories import CATEGORIES, category_code
+
+# Redis hash holding one precomputed record per zone
+ZONES_KEY = 'aqi_zones'
+
+# Offline boundary polygons (GeoJSON FeatureCollection). Feature properties:
+# "id" (or the feature id), "name" and "layer" (e.g. "state", "county"); zones
+# of the same layer must not overlap, zones of different layers may.
+# build_zones.py builds it from the Census state and county boundaries.
+ZONES_PATH = os.getenv("ZONES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "zones.geojson"))
+# Label rasters, computed once per grid and zones file
+ZONE_CACHE_DIR = os.getenv("ZONE_CACHE_DIR", "/tmp/tempo_zones")
+# AQI percentiles reported per zone
+ZONE_PERCENTILES = [int(p) for p in os.getenv("ZONE_PERCENTILES", "50,90,95").split(',')]
+
+_label_cache = {}
+
+
+def load_zones(path=ZONES_PATH):
+    """Load zone polygons: [{'id', 'name', 'layer', 'polygons': [[exterior, *holes], ...]}]"""
+    with open(path) as f:
+        collection = json.load(f)
+    zones = []
+    for feature in collection['features']:
+        properties = feature.get('properties') or {}
+        geometry = feature['geometry']
+        polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+        zones.append({
+            'id': str(properties.get('id', feature.get('id'))),
+            'name': properties.get('name'),
+            'layer': properties.get('layer', 'zone'),
+            'polygons': polygons
+        })
+    print(f"Loaded {len(zones):,} zones from {path}")
+    return zones
+
+
+def _axis_range(axis, low, high):
+    """Index range [start, end) of axis values within [low, high] (axis ascending or descending)"""
+    if axis[0] > axis[-1]:
+        start = len(axis) - np.searchsorted(axis[::-1], high, side='right')
+        end = len(axis) - np.searchsorted(axis[::-1], low, side='left')
+    else:
+        start = np.searchsorted(axis, low, side='left')
+        end = np.searchsorted(axis, high, side='right')
+    return int(start), int(end)
+
+
+def _rasterize(zones, lat_axis, lon_axis):
+    """Label rasters (one int32 grid per layer, -1 outside every zone) by pixel centre"""
+    # Only needed when a grid is rasterized for the first time
+    from matplotlib.path import Path
+
+    layers = sorted({zone['layer'] for zone in zones})
+    labels = {layer: np.full((len(lat_axis), len(lon_axis)), -1, dtype=np.int32) for layer in layers}
+    for zone_index, zone in enumerate(zones):
+        grid = labels[zone['layer']]
+        for rings in zone['polygons']:
+            exterior = np.asarray(rings[0], dtype=np.float64)
+            r0, r1 = _axis_range(lat_axis, exterior[:, 1].min(), exterior[:, 1].max())
+            c0, c1 = _axis_range(lon_axis, exterior[:, 0].min(), exterior[:, 0].max())
+            if r0 >= r1 or c0 >= c1:
+                continue
+            lon_grid, lat_grid = np.meshgrid(lon_axis[c0:c1], lat_axis[r0:r1])
+            centres = np.column_stack([lon_grid.ravel(), lat_grid.ravel()])
+            inside = Path(exterior[:, :2]).contains_points(centres)
+            for hole in rings[1:]:
+                inside &= ~Path(np.asarray(hole, dtype=np.float64)[:, :2]).contains_points(centres)
+            window = grid[r0:r1, c0:c1]
+            window[inside.reshape(window.shape)] = zone_index
+    return labels
+
+
+def label_rasters(zones, lat_axis, lon_axis, zones_path=ZONES_PATH, directory=ZONE_CACHE_DIR):
+    """Per-layer label rasters for the grid, rasterized once and cached in memory and on disk"""
+    digest = hashlib.sha1(np.ascontiguousarray(lat_axis, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(lon_axis, dtype=np.float64).tobytes())
+    with open(zones_path, 'rb') as f:
+        digest.update(hashlib.sha1(f.read()).digest())
+    key = digest.hexdigest()[:16]
+    if key in _label_cache:
+        return _label_cache[key]
+
+    path = os.path.join(directory, f"labels-{key}.npz")
+    try:
+        with np.load(path) as stored:
+            labels = dict(stored)
+    except (FileNotFoundError, ValueError, OSError):
+        print(f"Rasterizing {len(zones):,} zones onto the {len(lat_axis)} x {len(lon_axis)} grid...")
+        labels = _rasterize(zones, np.asarray(lat_axis), np.asarray(lon_axis))
+        os.makedirs(directory, exist_ok=True)
+        np.savez(path + '.tmp.npz', **labels)
+        os.replace(path + '.tmp.npz', path)
+    _label_cache[key] = labels
+    return labels
+
+
+def _percentiles(sorted_values, starts, counts, q):
+    """Per-group percentile (linear interpolation, like np.percentile) of grouped sorted values"""
+    position = starts + (counts - 1) * (q / 100.0)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, starts + counts - 1)
+    fraction = position - lower
+    return sorted_values[lower] * (1 - fraction) + sorted_values[upper] * fraction
+
+
+def compute_zone_stats(sparse, zones, labels, percentiles=ZONE_PERCENTILES):
+    """Per-zone AQI statistics for a granule: one grouped pass per layer over the valid pixels
+
+    Each record holds mean, max and the configured percentiles of AQI, the
+    count of valid pixels per category and the zone's coverage (valid pixels
+    over pixels inside the zone).
+    """
+    print(f"Computing zonal statistics for {len(zones):,} zones...")
+    n_zones = len(zones)
+    n_categories = len(CATEGORIES)
+    aqi = np.asarray(sparse['aqi']).astype(np.float64)
+    category = np.asarray(sparse['category']).astype(np.int64)
+
+    count = np.zeros(n_zones, dtype=np.int64)
+    zone_pixels = np.zeros(n_zones, dtype=np.int64)
+    total = np.zeros(n_zones)
+    peak = np.zeros(n_zones)
+    quantiles = np.full((n_zones, len(percentiles)), np.nan)
+    category_counts = np.zeros((n_zones, n_categories), dtype=np.int64)
+
+    for grid in labels.values():
+        zone_pixels += np.bincount(grid[grid >= 0], minlength=n_zones)
+        zone = grid.reshape(-1)[sparse['index']]
+        inside = zone >= 0
+        zone, zone_aqi, zone_category = zone[inside], aqi[inside], category[inside]
+
+        layer_count = np.bincount(zone, minlength=n_zones)
+        count += layer_count
+        total += np.bincount(zone, weights=zone_aqi, minlength=n_zones)
+        category_counts += np.bincount(zone * n_categories + zone_category,
+                                       minlength=n_zones * n_categories).reshape(n_zones, n_categories)
+
+        # Sorting by (zone, AQI) gives max and percentiles for every zone at once
+        order = np.lexsort((zone_aqi, zone))
+        sorted_aqi = zone_aqi[order]
+        present = np.flatnonzero(layer_count)
+        starts = np.concatenate(([0], np.cumsum(layer_count)[:-1]))[present]
+        counts = layer_count[present]
+        peak[present] = sorted_aqi[starts + counts - 1]
+        for j, q in enumerate(percentiles):
+            quantiles[present, j] = _percentiles(sorted_aqi, starts, counts, q)
+
+    timestamp = sparse['timestamp']
+    timestamp = timestamp.isoformat() if hasattr(timestamp, 'isoformat') else str(timestamp)
+
+    records = []
+    for i, zone in enumerate(zones):
+        record = {
+            'id': zone['id'],
+            'name': zone['name'],
+            'layer': zone['layer'],
+            'timestamp': timestamp,
+            'valid_pixels': int(count[i]),
+            'zone_pixels': int(zone_pixels[i]),
+            'coverage': round(float(count[i]) / zone_pixels[i], 3) if zone_pixels[i] else 0.0,
+            'aqi_mean': None,
+            'aqi_max': None,
+            'percentiles': None,
+            'category': None,
+            'category_counts': {name: int(n) for (name, _), n in zip(CATEGORIES, category_counts[i])}
+        }
+        if count[i]:
+            aqi_mean = float(total[i]) / count[i]
+            record.update({
+                'aqi_mean': round(aqi_mean, 1),
+                'aqi_max': int(peak[i]),
+                'percentiles': {f"p{q}": round(float(v), 1) for q, v in zip(percentiles, quantiles[i])},
+                'category': category_code(round(aqi_mean))
+            })
+        records.append(record)
+
+    print(f"✅ Zonal statistics computed: {int((count > 0).sum()):,} of {n_zones:,} zones have valid data")
+    return records
+
+
+def store_zone_stats(records, redis_client=None, db_conn=None, ttl=None):
+    """Store zone records as a keyed table in Redis (hash) and PostgreSQL (one row per zone)"""
+    keyed_store.store_records(records, ZONES_KEY, 'tempo_zone_aqi', 'zone_id',
+                              {'layer': 'TEXT', 'timestamp': 'TIMESTAMP WITH TIME ZONE'}, 'zones',
+                              redis_client=redis_client, db_conn=db_conn, ttl=ttl)
+
+
+def get_zones(zone_ids, redis_client=None, db_conn=None):
+    """Look up zone records by id (serialized JSON bytes): Redis hash first, PostgreSQL for any misses"""
+    return keyed_store.get_records(zone_ids, ZONES_KEY, 'tempo_zone_aqi', 'zone_id', 'zone',
+                                   redis_client=redis_client, db_conn=db_conn)